@@ -27,6 +27,7 @@ from google.adk.agents.callback_context import CallbackContext
 from google.adk.tools import load_artifacts
 
 from .sub_agents import bqml_agent
+from .utils import usage_tracker
 from .sub_agents.bigquery.tools import (
     get_database_settings as get_bq_database_settings,
 )
@@ -79,5 +80,7 @@ root_agent = Agent(
         call_web_search_agent,
     ],
     before_agent_callback=setup_before_agent_call,
+    before_model_callback=usage_tracker.before_model_callback,
+    after_model_callback=usage_tracker.after_model_callback,
     generate_content_config=types.GenerateContentConfig(temperature=0.01),
 )
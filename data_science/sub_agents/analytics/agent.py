@@ -16,6 +16,7 @@
 import os
 from google.adk.code_executors import VertexAiCodeExecutor
 from google.adk.agents import Agent
+from data_science.utils import usage_tracker
 from .prompts import return_instructions_ds
 
 
@@ -27,4 +28,6 @@ root_agent = Agent(
         optimize_data_file=True,
         stateful=True,
     ),
+    before_model_callback=usage_tracker.before_model_callback,
+    after_model_callback=usage_tracker.after_model_callback,
 )
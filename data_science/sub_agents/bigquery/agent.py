@@ -16,6 +16,7 @@
 
 import os
 
+from data_science.utils import usage_tracker
 from google.adk.agents import Agent
 from google.adk.agents.callback_context import CallbackContext
 from google.genai import types
@@ -46,7 +47,13 @@ database_agent = Agent(
             else tools.initial_bq_nl2sql
         ),
         tools.run_bigquery_validation,
+        tools.run_bigquery_exploration,
+        tools.run_bigquery_batch,
+        tools.fetch_more_rows,
+        tools.create_temp_table,
     ],
     before_agent_callback=setup_before_agent_call,
+    before_model_callback=usage_tracker.before_model_callback,
+    after_model_callback=usage_tracker.after_model_callback,
     generate_content_config=types.GenerateContentConfig(temperature=0.01),
 )
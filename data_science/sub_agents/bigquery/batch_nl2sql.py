@@ -0,0 +1,317 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Offline NL2SQL generation for batches of questions, e.g. for evaluations.
+
+Reads a JSONL file of questions, each with an optional `id`, and writes one
+JSONL line per question with its `sql` or `error`:
+
+    python -m data_science.sub_agents.bigquery.batch_nl2sql \\
+        --input=questions.jsonl --output=sql.jsonl
+
+The output is the checkpoint: a rerun skips the questions it already answered
+and retries the failed ones, and the last line of a question wins. The LLM
+requests run in the BATCH priority class of the `rate_limiter`, so they never
+use the capacity reserved for interactive sessions.
+
+The SQL is generated by a backend: `LocalBackend` calls the NL2SQL method of the
+agent with bounded concurrency, and `VertexBatchBackend` sends the baseline
+prompts as a Vertex AI batch prediction job, which has its own quota.
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterator
+
+from absl import app, flags
+from data_science.utils import rate_limiter, usage_tracker
+from google.cloud import storage
+from google.genai import types
+
+from .chase_sql import llm_utils
+
+
+def read_questions(input_path: str) -> list[dict]:
+    """Reads the questions of a JSONL file.
+
+    Returns:
+        list[dict]: The questions, each with its `id` (by default its line
+        number) and `question`.
+    """
+    records = []
+    with open(input_path, encoding="utf-8") as input_file:
+        for line_number, line in enumerate(input_file, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            records.append(
+                {
+                    "id": str(record.get("id", line_number)),
+                    "question": record["question"],
+                }
+            )
+    return records
+
+
+def read_completed_ids(output_path: str) -> set[str]:
+    """Returns the IDs of the questions answered without error in an output.
+
+    Lines that cannot be decoded, e.g. the last line of a killed run, are
+    skipped, so their questions are answered again.
+    """
+    results = {}
+    if os.path.exists(output_path):
+        with open(output_path, encoding="utf-8") as output_file:
+            for line in output_file:
+                if not line.strip():
+                    continue
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Skipping an undecodable line of {output_path}.")
+                    continue
+                results[result["id"]] = result
+    return {
+        question_id
+        for question_id, result in results.items()
+        if result.get("error") is None
+    }
+
+
+class LocalBackend:
+    """Generates the SQL in this process, with bounded concurrency."""
+
+    def __init__(
+        self,
+        generate_sql: Callable[[str, dict], str],
+        database_settings: dict,
+        max_workers: int = 8,
+    ):
+        """Initializes the backend.
+
+        Args:
+            generate_sql (callable): The NL2SQL method, e.g.
+              `tools.generate_sql`.
+            database_settings (dict): The database settings of the method.
+            max_workers (int): The maximum number of questions in flight.
+        """
+        self.generate_sql = generate_sql
+        self.database_settings = database_settings
+        self.max_workers = max_workers
+
+    def _generate(self, record: dict) -> dict:
+        """Generates the SQL of a question in the BATCH priority class."""
+        with rate_limiter.priority(rate_limiter.Priority.BATCH):
+            with usage_tracker.scope(tool="batch_nl2sql"):
+                try:
+                    sql = self.generate_sql(record["question"], self.database_settings)
+                    return {**record, "sql": sql, "error": None}
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    return {**record, "sql": None, "error": str(e)}
+
+    def run(self, records: list[dict]) -> Iterator[dict]:
+        """Yields the results of the questions as they complete."""
+        with ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="batch_nl2sql"
+        ) as executor:
+            futures = [executor.submit(self._generate, record) for record in records]
+            for future in as_completed(futures):
+                yield future.result()
+
+
+class VertexBatchBackend:
+    """Generates the SQL with a Vertex AI batch prediction job.
+
+    The baseline NL2SQL prompts are written to Cloud Storage, predicted by one
+    batch job and matched back to their questions by prompt.
+    """
+
+    TERMINAL_STATES = ("JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED")
+
+    def __init__(
+        self,
+        gcs_uri: str,
+        database_settings: dict,
+        model_name: str | None = None,
+        poll_seconds: float = 60,
+    ):
+        """Initializes the backend.
+
+        Args:
+            gcs_uri (str): The Cloud Storage folder of the job input and output,
+              e.g. gs://my-bucket/nl2sql_batch.
+            database_settings (dict): The database settings of the prompts.
+            model_name (str): The model, by default `BASELINE_NL2SQL_MODEL`.
+            poll_seconds (float): The interval of the job status checks.
+        """
+        self.gcs_uri = gcs_uri.rstrip("/")
+        self.database_settings = database_settings
+        self.model_name = model_name or os.getenv("BASELINE_NL2SQL_MODEL")
+        self.poll_seconds = poll_seconds
+
+    def run(self, records: list[dict]) -> Iterator[dict]:
+        """Runs one batch job for all questions and yields their results."""
+        # Imported here, as the tools module sets up the LLM clients of the agent.
+        from . import tools  # pylint: disable=import-outside-toplevel
+
+        bucket_name, _, folder = self.gcs_uri.removeprefix("gs://").partition("/")
+        bucket = storage.Client().bucket(bucket_name)
+        run_folder = f"{folder}/{int(time.time())}".lstrip("/")
+
+        records_by_prompt = {}
+        lines = []
+        for record in records:
+            prefix, suffix = tools.baseline_nl2sql_prompt(
+                record["question"], self.database_settings
+            )
+            prompt = prefix + suffix
+            if prompt not in records_by_prompt:
+                lines.append(
+                    json.dumps(
+                        {
+                            "request": {
+                                "contents": [
+                                    {"role": "user", "parts": [{"text": prompt}]}
+                                ],
+                                "generationConfig": {"temperature": 0.1},
+                            }
+                        }
+                    )
+                )
+            records_by_prompt.setdefault(prompt, []).append(record)
+        bucket.blob(f"{run_folder}/input.jsonl").upload_from_string("\n".join(lines))
+
+        client = llm_utils.get_genai_client(llm_utils.GCP_LOCATION)
+        job = client.batches.create(
+            model=self.model_name,
+            src=f"gs://{bucket_name}/{run_folder}/input.jsonl",
+            config=types.CreateBatchJobConfig(
+                dest=f"gs://{bucket_name}/{run_folder}/output"
+            ),
+        )
+        print(f"Created batch prediction job {job.name}.")
+        while job.state not in self.TERMINAL_STATES:
+            time.sleep(self.poll_seconds)
+            job = client.batches.get(name=job.name)
+        if job.state != "JOB_STATE_SUCCEEDED":
+            raise RuntimeError(f"Batch prediction job {job.name} ended in {job.state}.")
+
+        for blob in bucket.list_blobs(prefix=f"{run_folder}/output"):
+            if not blob.name.endswith(".jsonl"):
+                continue
+            for line in blob.download_as_text().splitlines():
+                prediction = json.loads(line)
+                prompt = prediction["request"]["contents"][0]["parts"][0]["text"]
+                sql, error = None, prediction.get("status") or None
+                try:
+                    parts = prediction["response"]["candidates"][0]["content"]["parts"]
+                    sql = tools.clean_generated_sql(
+                        "".join(part.get("text", "") for part in parts)
+                    )
+                except (KeyError, IndexError):
+                    error = error or "The response has no candidates."
+                for record in records_by_prompt.pop(prompt, []):
+                    yield {**record, "sql": sql, "error": error}
+        for pending_records in records_by_prompt.values():
+            for record in pending_records:
+                yield {**record, "sql": None, "error": "No prediction."}
+
+
+def run_batch(input_path: str, output_path: str, backend) -> dict:
+    """Generates the SQL of the unanswered questions of an input file.
+
+    Args:
+        input_path (str): The JSONL file of questions.
+        output_path (str): The JSONL file the results are appended to.
+        backend (LocalBackend | VertexBatchBackend): The backend.
+
+    Returns:
+        dict: The number of `skipped`, `succeeded` and `failed` questions.
+    """
+    records = read_questions(input_path)
+    completed_ids = read_completed_ids(output_path)
+    pending_records = [r for r in records if r["id"] not in completed_ids]
+    counts = {
+        "skipped": len(records) - len(pending_records),
+        "succeeded": 0,
+        "failed": 0,
+    }
+    print(
+        f"Generating SQL for {len(pending_records)} questions,"
+        f" {counts['skipped']} already answered."
+    )
+    if not pending_records:
+        return counts
+    with open(output_path, "a", encoding="utf-8") as output_file:
+        for result in backend.run(pending_records):
+            output_file.write(json.dumps(result) + "\n")
+            # Every result is a checkpoint.
+            output_file.flush()
+            counts["failed" if result["error"] else "succeeded"] += 1
+    return counts
+
+
+FLAGS = flags.FLAGS
+
+
+def main(argv: list[str]) -> None:  # pylint: disable=unused-argument
+    """Generates the SQL of a file of questions."""
+    # Imported here, as the tools module sets up the LLM clients of the agent.
+    # pylint: disable=import-outside-toplevel
+    from . import tools
+    from .chase_sql import chase_db_tools
+
+    database_settings = tools.get_database_settings()
+    if FLAGS.backend == "vertex_batch":
+        if FLAGS.method != "BASELINE":
+            raise ValueError("The vertex_batch backend only supports BASELINE.")
+        if not FLAGS.gcs_uri:
+            raise ValueError("--gcs_uri must be set for the vertex_batch backend.")
+        backend = VertexBatchBackend(FLAGS.gcs_uri, database_settings)
+    else:
+        generate_sql = (
+            chase_db_tools.generate_sql
+            if FLAGS.method == "CHASE"
+            else tools.generate_sql
+        )
+        backend = LocalBackend(
+            generate_sql, database_settings, max_workers=FLAGS.max_workers
+        )
+    counts = run_batch(FLAGS.input, FLAGS.output, backend)
+    print(
+        f"Done: {counts['succeeded']} succeeded, {counts['failed']} failed,"
+        f" {counts['skipped']} skipped."
+    )
+    print(json.dumps(usage_tracker.get_usage_tracker().summary()["total"]))
+
+
+if __name__ == "__main__":
+    # The flags are only defined when run as a script, so that importing the
+    # backends does not register them.
+    flags.DEFINE_string("input", None, "JSONL file of questions.", required=True)
+    flags.DEFINE_string("output", None, "JSONL file of the results.", required=True)
+    flags.DEFINE_enum(
+        "method",
+        os.getenv("NL2SQL_METHOD", "BASELINE"),
+        ["BASELINE", "CHASE"],
+        "NL2SQL method.",
+    )
+    flags.DEFINE_enum(
+        "backend", "local", ["local", "vertex_batch"], "Backend generating the SQL."
+    )
+    flags.DEFINE_integer("max_workers", 8, "Questions in flight, local backend.")
+    flags.DEFINE_string("gcs_uri", None, "Cloud Storage folder, vertex_batch backend.")
+    app.run(main)
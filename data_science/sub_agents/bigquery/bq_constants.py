@@ -0,0 +1,39 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Constants used by the SQL rewrites of the database agent."""
+from typing import Any
+import immutabledict
+
+
+# Parameters for the SQL rewrites applied before a query runs.
+bq_sql_constants_dict: immutabledict.immutabledict[str, Any] = (
+    immutabledict.immutabledict(
+        {
+            # Whether to route rollup queries to the materialized views created
+            # by the mv_advisor and to the tables of `rollups`.
+            "route_aggregate_tables": True,
+            # Whether to expand `SELECT *` and prune unused columns.
+            "prune_columns": True,
+            # What to do with queries scanning all partitions of a partitioned
+            # table: "warn", "inject" a filter on the last
+            # `partition_filter_days` days up to the latest partition, or "off".
+            "partition_filter_mode": "warn",
+            # Number of days selected by an injected partition filter.
+            "partition_filter_days": 30,
+            # Percentage of a table sampled by row previews in exploration mode.
+            "exploration_sample_percent": 10,
+        }
+    )
+)
@@ -0,0 +1,86 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Selection of a SQL candidate by the agreement of the candidates.
+
+Candidates which are executed and return the same rows vote for each other,
+following the self-consistency selection of CHASE-SQL. Candidates which are
+only dry-run vote for the candidates with the same canonical SQL.
+"""
+
+import collections
+
+
+def is_valid_result(result: dict) -> bool:
+    """Checks if the evaluation of a candidate succeeded."""
+    return not (result.get("error_message") or "").startswith("Invalid SQL")
+
+
+def result_fingerprint(result: dict) -> tuple:
+    """Returns a fingerprint of the rows of a query result.
+
+    Candidates name and order their columns differently, so the fingerprint
+    only depends on the values of the rows, in any order.
+    """
+    rows = result.get("query_result") or []
+    return (
+        result.get("total_rows", len(rows)),
+        tuple(
+            sorted(
+                tuple(
+                    sorted(
+                        repr(round(value, 6) if isinstance(value, float) else value)
+                        for value in row.values()
+                    )
+                )
+                for row in rows
+            )
+        ),
+    )
+
+
+def select_by_agreement(
+    groups: list[tuple[str, int]], results: dict, by_result: bool = True
+) -> tuple[str | None, int]:
+    """Selects the candidate that most candidates agree with.
+
+    Args:
+        groups (list[tuple[str, int]]): The unique candidates with their number
+          of duplicates, in the order of generation, see
+          `sql_rewriter.group_equivalent_queries`.
+        results (dict): The evaluation of the evaluated candidates, by SQL, see
+          `tools.evaluate_candidate_sql`.
+        by_result (bool): Whether the candidates were executed and agree on
+          their results, or were only dry-run and agree on their SQL.
+
+    Returns:
+        tuple[str | None, int]: The first valid candidate of the result with the
+        most votes and its number of votes, or (None, 0) if no evaluated
+        candidate is valid.
+    """
+    votes = collections.Counter()
+    first_candidates = {}
+    for sql, count in groups:
+        result = results.get(sql)
+        if result is None or not is_valid_result(result):
+            continue
+        key = result_fingerprint(result) if by_result else sql
+        votes[key] += count
+        first_candidates.setdefault(key, sql)
+    if not votes:
+        return None, 0
+    # Counter.most_common keeps the insertion order of ties, so the earliest
+    # candidate wins a tie.
+    key, count = votes.most_common(1)[0]
+    return first_candidates[key], count
@@ -34,8 +34,21 @@ chase_sql_constants_dict: immutabledict.immutabledict[str, Any] = (
             "model": os.getenv("CHASE_NL2SQL_MODEL"),
             # Temperature for generation.
             "temperature": 0.5,
-            # Type of SQL generation method.
+            # Type of SQL generation method: "dc", "qp", or "dc_qp" for both,
+            # with the candidate selected by the agreement of the candidates.
             "generate_sql_type": "dc",
+            # Number of candidates per method of the "dc_qp" type.
+            "ensemble_candidates": 3,
+            # Whether the "dc_qp" candidates are executed and agree on their
+            # results, or only dry-run and agree on their SQL.
+            "ensemble_execute": True,
+            # Time budget (in seconds) of the "dc_qp" type, after which the
+            # best candidate so far is returned.
+            "latency_budget_seconds": 30,
+            # Maximum number of few-shot examples per prompt.
+            "few_shot_examples": 2,
+            # Maximum estimated number of tokens of the few-shot examples.
+            "few_shot_token_budget": 2000,
         }
     )
 )
@@ -14,15 +14,37 @@
 
 """This code contains the implementation of the tools used for the CHASE-SQL agent."""
 
+import collections
+import concurrent.futures
 import enum
 import os
+import time
+import uuid
 
+from data_science.utils import context_cache, usage_tracker
 from google.adk.tools import ToolContext
 
+from .. import sql_rewriter
+from ..tools import (
+    cancel_query_job,
+    evaluate_candidate_sql,
+    get_query_executor,
+    get_session_temp_tables_ddl,
+    get_sqlglot_schema,
+    uses_session_temp_tables,
+)
+
 # pylint: disable=g-importing-member
-from .dc_prompt_template import DC_PROMPT_TEMPLATE
-from .llm_utils import GeminiModel
-from .qp_prompt_template import QP_PROMPT_TEMPLATE
+from .candidate_selection import select_by_agreement
+from .dc_prompt_template import DC_EXAMPLES, DC_PROMPT_PREFIX, DC_QUESTION_TEMPLATE
+from .few_shot import select_examples
+from .llm_utils import (
+    GCP_LOCATION,
+    HedgingPolicy,
+    get_gemini_model,
+    get_genai_client,
+)
+from .qp_prompt_template import QP_EXAMPLES, QP_PROMPT_PREFIX, QP_QUESTION_TEMPLATE
 from .sql_postprocessor import sql_translator
 
 # pylint: enable=g-importing-member
@@ -35,10 +57,20 @@ class GenerateSQLType(enum.Enum):
 
     DC: Divide and Conquer ICL prompting
     QP: Query Plan-based prompting
+    DC_QP: DC and QP concurrently, selecting the candidate whose result most
+      candidates agree on
     """
 
     DC = "dc"
     QP = "qp"
+    DC_QP = "dc_qp"
+
+
+# The prompt prefix, question template and few-shot examples of each type.
+PROMPT_TEMPLATES = {
+    GenerateSQLType.DC.value: (DC_PROMPT_PREFIX, DC_QUESTION_TEMPLATE, DC_EXAMPLES),
+    GenerateSQLType.QP.value: (QP_PROMPT_PREFIX, QP_QUESTION_TEMPLATE, QP_EXAMPLES),
+}
 
 
 def exception_wrapper(func):
@@ -93,47 +125,268 @@ def initial_bq_nl2sql(
       str: An SQL statement to answer this question.
     """
     print("****** Running agent with ChaseSQL algorithm.")
-    ddl_schema = tool_context.state["database_settings"]["bq_ddl_schema"]
-    project = tool_context.state["database_settings"]["bq_project_id"]
-    db = tool_context.state["database_settings"]["bq_dataset_id"]
-    transpile_to_bigquery = tool_context.state["database_settings"][
-        "transpile_to_bigquery"
-    ]
-    process_input_errors = tool_context.state["database_settings"][
-        "process_input_errors"
-    ]
-    process_tool_output_errors = tool_context.state["database_settings"][
-        "process_tool_output_errors"
-    ]
-    number_of_candidates = tool_context.state["database_settings"][
-        "number_of_candidates"
+    with usage_tracker.tool_scope(tool_context, "initial_bq_nl2sql"):
+        return generate_sql(
+            question,
+            tool_context.state["database_settings"],
+            get_session_temp_tables_ddl(tool_context),
+            tool_context.state.get("bq_session_id"),
+        )
+
+
+def _prompt(
+    generate_sql_type: str,
+    question: str,
+    database_settings: dict,
+    temp_tables_ddl: str,
+) -> tuple[str, str | None]:
+    """Builds the prompt of a question for the DC or QP type.
+
+    Returns:
+        tuple[str, str | None]: The prompt, and the name of the context cache
+        holding its prefix, if any. With a context cache, the prompt only holds
+        the suffix.
+    """
+    prefix_template, question_template, examples = PROMPT_TEMPLATES[
+        generate_sql_type
     ]
-    model = tool_context.state["database_settings"]["model"]
-    temperature = tool_context.state["database_settings"]["temperature"]
-    generate_sql_type = tool_context.state["database_settings"]["generate_sql_type"]
+    # The instructions and dataset DDL are served from a context cache, so only
+    # the temp tables of the conversation, the few-shot examples most similar
+    # to the question and the question are sent with every request.
+    prefix = prefix_template.format(
+        SCHEMA=database_settings["bq_ddl_schema"],
+        BQ_PROJECT_ID=BQ_PROJECT_ID,
+    )
+    examples = select_examples(
+        examples,
+        question,
+        k=database_settings["few_shot_examples"],
+        token_budget=database_settings["few_shot_token_budget"],
+    )
+    suffix = temp_tables_ddl + question_template.format(
+        EXAMPLES=examples.format(BQ_PROJECT_ID=BQ_PROJECT_ID),
+        QUESTION=question,
+        BQ_PROJECT_ID=BQ_PROJECT_ID,
+    )
+    cache_name = context_cache.get_context_cache().get_cache_name(
+        get_genai_client(GCP_LOCATION),
+        database_settings["model"],
+        GCP_LOCATION,
+        prefix,
+        display_name=f"chase_{generate_sql_type}",
+    )
+    return (suffix if cache_name is not None else prefix + suffix), cache_name
+
+
+def _generation_model(database_settings: dict, cache_name: str | None):
+    """Returns the model generating the SQL candidates."""
+    # Hedging cuts the tail latency of the NL2SQL call, which the user waits on.
+    # Requests using a context cache stay in its region. The responses are
+    # streamed and cut off once the SQL block of the final query is complete.
+    return get_gemini_model(
+        database_settings["model"],
+        temperature=database_settings["temperature"],
+        cache_name=cache_name,
+        hedging=HedgingPolicy(),
+        stream_sql=True,
+    )
+
+
+def _generate_sql_by_agreement(
+    question: str,
+    database_settings: dict,
+    temp_tables_ddl: str,
+    session_id: str | None,
+) -> tuple[str, bool]:
+    """Generates DC and QP candidates concurrently and selects one of them.
+
+    The unique candidates are evaluated on BigQuery as soon as they are
+    generated, and the candidate that most candidates agree with is selected.
+    When the latency budget expires, the best candidate so far is returned.
+    The query jobs of the evaluations still running then are cancelled.
+
+    Candidates using the temp tables of the session are evaluated one at a
+    time, as the queries of a BigQuery session run serially; the others are
+    evaluated concurrently.
+
+    Returns:
+        tuple[str, bool]: The selected SQL, and whether BigQuery accepted it.
+    """
+    latency_budget = database_settings["latency_budget_seconds"]
+    deadline = time.monotonic() + latency_budget
+    candidate_count = database_settings["ensemble_candidates"]
+    execute = database_settings["ensemble_execute"]
+    sqlglot_schema = get_sqlglot_schema(
+        database_settings["bq_ddl_schema"] + temp_tables_ddl
+    )
 
-    if generate_sql_type == GenerateSQLType.DC.value:
-        prompt = DC_PROMPT_TEMPLATE.format(
-            SCHEMA=ddl_schema, QUESTION=question, BQ_PROJECT_ID=BQ_PROJECT_ID
+    generations = []
+    for generate_sql_type in (GenerateSQLType.DC.value, GenerateSQLType.QP.value):
+        prompt, cache_name = _prompt(
+            generate_sql_type, question, database_settings, temp_tables_ddl
         )
-    elif generate_sql_type == GenerateSQLType.QP.value:
-        prompt = QP_PROMPT_TEMPLATE.format(
-            SCHEMA=ddl_schema, QUESTION=question, BQ_PROJECT_ID=BQ_PROJECT_ID
+        generations.append(
+            _generation_model(database_settings, cache_name).submit_candidates(
+                prompt,
+                candidate_count,
+                parser_func=parse_response,
+                timeout=max(1, int(latency_budget)),
+            )
         )
+    candidates = []
+    groups = []
+    # The candidate and query job ID of each evaluation.
+    evaluations = {}
+    results = {}
+    session_candidates = collections.deque()
+    session_evaluation = None
+    pending = set(generations)
+
+    def evaluate(sql: str) -> concurrent.futures.Future:
+        # Evaluations run concurrently, capped by the query slots.
+        job_id = f"chase_candidate_{uuid.uuid4().hex}"
+        evaluation = get_query_executor().submit(
+            evaluate_candidate_sql,
+            sql,
+            database_settings,
+            session_id,
+            execute,
+            job_id,
+        )
+        evaluations[evaluation] = (sql, job_id)
+        pending.add(evaluation)
+        return evaluation
+
+    while pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            print(f"****** Latency budget of {latency_budget}s expired.")
+            break
+        done, pending = concurrent.futures.wait(
+            pending, timeout=remaining, return_when=concurrent.futures.FIRST_COMPLETED
+        )
+        for future in done:
+            if future in evaluations:
+                sql, _ = evaluations[future]
+                try:
+                    results[sql] = future.result()
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    results[sql] = {"error_message": f"Invalid SQL: {e}"}
+                continue
+            try:
+                candidates.extend(future.result())
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"Error generating candidates: {e}")
+                continue
+            known_candidates = {sql for sql, _ in groups}
+            groups = sql_rewriter.group_equivalent_queries(candidates)
+            for sql, _ in groups:
+                if sql in known_candidates:
+                    continue
+                if not sql_rewriter.validate_sql(sql, sqlglot_schema):
+                    results[sql] = {"error_message": "Invalid SQL: schema mismatch."}
+                elif uses_session_temp_tables(sql):
+                    session_candidates.append(sql)
+                else:
+                    evaluate(sql)
+        if session_candidates and (
+            session_evaluation is None or session_evaluation.done()
+        ):
+            session_evaluation = evaluate(session_candidates.popleft())
+        _, votes = select_by_agreement(groups, results, by_result=execute)
+        if votes * 2 > candidate_count * len(generations):
+            # A majority of all candidates agrees, more votes cannot change it.
+            break
+    for future in pending:
+        if not future.cancel() and future in evaluations and execute:
+            # The evaluation is running, stop its query job from billing.
+            cancel_query_job(evaluations[future][1])
+
+    selected_sql, votes = select_by_agreement(groups, results, by_result=execute)
+    print(
+        f"****** {len(candidates)} candidates, {len(groups)} unique,"
+        f" {len(results)} evaluated, {votes} agree with the selected one."
+    )
+    if selected_sql is not None:
+        return selected_sql, True
+    # No candidate was accepted in time, so take the first one that was not
+    # rejected, to be fixed by the translator.
+    for sql, _ in groups:
+        if sql not in results:
+            return sql, False
+    if groups:
+        return groups[0][0], False
+    return (candidates[0] if candidates else "Timeout"), False
+
+
+def generate_sql(
+    question: str,
+    database_settings: dict,
+    temp_tables_ddl: str = "",
+    session_id: str | None = None,
+) -> str:
+    """Generates a SQL query with the ChaseSQL algorithm, outside of a session.
+
+    Args:
+      question: Natural language question.
+      database_settings: The database settings, see `get_database_settings`.
+      temp_tables_ddl: The DDL of the temp tables of the conversation, if any.
+      session_id: The BigQuery session of the conversation, if any, in which
+        the candidates of the dc_qp type are evaluated.
+
+    Returns:
+      str: An SQL statement to answer this question.
+    """
+    ddl_schema = database_settings["bq_ddl_schema"] + temp_tables_ddl
+    project = database_settings["bq_project_id"]
+    db = database_settings["bq_dataset_id"]
+    transpile_to_bigquery = database_settings["transpile_to_bigquery"]
+    process_input_errors = database_settings["process_input_errors"]
+    process_tool_output_errors = database_settings["process_tool_output_errors"]
+    number_of_candidates = database_settings["number_of_candidates"]
+    model = database_settings["model"]
+    temperature = database_settings["temperature"]
+    generate_sql_type = database_settings["generate_sql_type"]
+
+    if generate_sql_type == GenerateSQLType.DC_QP.value:
+        responses, accepted = _generate_sql_by_agreement(
+            question, database_settings, temp_tables_ddl, session_id
+        )
+        # SQL accepted by BigQuery needs no transpilation.
+        transpile_to_bigquery = transpile_to_bigquery and not accepted
+    elif generate_sql_type in PROMPT_TEMPLATES:
+        prompt, cache_name = _prompt(
+            generate_sql_type, question, database_settings, temp_tables_ddl
+        )
+        validator = None
+        if number_of_candidates > 1:
+            # Take the first candidate that is valid against the schema,
+            # without waiting for the others.
+            sqlglot_schema = get_sqlglot_schema(ddl_schema)
+
+            def validator(sql: str) -> bool:
+                return sql_rewriter.validate_sql(sql, sqlglot_schema)
+
+        # The candidates are generated by one request, or a few if there are
+        # many.
+        responses = _generation_model(database_settings, cache_name).call_candidates(
+            prompt,
+            number_of_candidates,
+            parser_func=parse_response,
+            validator=validator,
+        )
+        # Take just the first response.
+        responses = responses[0]
     else:
         raise ValueError(f"Unsupported generate_sql_type: {generate_sql_type}")
 
-    model = GeminiModel(model_name=model, temperature=temperature)
-    requests = [prompt for _ in range(number_of_candidates)]
-    responses = model.call_parallel(requests, parser_func=parse_response)
-    # Take just the first response.
-    responses = responses[0]
-
     # If postprocessing of the SQL to transpile it to BigQuery is required,
     # then do it here.
     if transpile_to_bigquery:
         translator = sql_translator.SqlTranslator(
-            model=model,
+            model=get_gemini_model(
+                model, temperature=temperature, hedging=HedgingPolicy()
+            ),
             temperature=temperature,
             process_input_errors=process_input_errors,
             process_tool_output_errors=process_tool_output_errors,
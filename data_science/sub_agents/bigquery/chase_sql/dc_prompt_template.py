@@ -14,7 +14,11 @@
 
 """Divide-and-Conquer prompt template."""
 
-DC_PROMPT_TEMPLATE = """
+# The prompt is split into a static prefix, which is the same for every question
+# of a dataset and is stored in a context cache, and the question suffix. The
+# suffix holds the few-shot examples most relevant to the question, which are
+# selected from the examples library by `few_shot.select_examples`.
+DC_PROMPT_PREFIX = """
 You are an experienced database expert.
 Now you need to generate a GoogleSQL or BigQuery query given the database information, a question and some additional information.
 The database structure is defined by table schemas (some columns provide additional column descriptions in the options).
@@ -75,9 +79,16 @@ Database admin instructions (please *unconditionally* follow these instructions.
 15. **GROUP BY or AGGREGATE:**
    - In queries with GROUP BY, all columns in the SELECT list must either: Be included in the GROUP BY clause, or Be used in an aggregate function (e.g., MAX, MIN, AVG, COUNT, SUM).
 
-Here are some examples
-===========
-Example 1
+16. **Partitioned Tables:**
+   - If a table is created with `PARTITION BY <column>`, filter on that column whenever the question restricts the time range. Tables with `require_partition_filter=TRUE` must always be filtered on their partition column.
+
+**************************
+【Table creation statements】
+{SCHEMA}
+"""
+
+DC_EXAMPLES = (
+    """Example 1
 
 **************************
 【Table creation statements】
@@ -142,8 +153,8 @@ SELECT COUNT(T1.id_restaurant)
  WHERE T1.food_type = 'thai' AND T1.city = 'albany' AND T2.street_name = 'san pablo ave'
 ```
 
-===========
-Example 2
+""",
+    """Example 2
 
 **************************
 【Database Info】
@@ -213,8 +224,8 @@ SELECT `T1`.`gender`
  ORDER BY `T2`.`A11` ASC, `T1`.`birth_date` DESC NULLS LAST
  LIMIT 1
 ```
-===========
-Example 3 (dividing into two parallel sub-questions)
+""",
+    """Example 3 (dividing into two parallel sub-questions)
 
 **************************
 【Database Info】
@@ -286,8 +297,8 @@ SELECT COUNT(T3.id)
  BETWEEN 1900 AND 1992
 ```
 
-===========
-Example 4 (When it's not clear which column should be used for a string matching, use a loosen condition such as string LIKE and OR condition to cover multiple possible columns.)
+""",
+    """Example 4 (When it's not clear which column should be used for a string matching, use a loosen condition such as string LIKE and OR condition to cover multiple possible columns.)
 
 **************************
 【Database Info】
@@ -345,8 +356,8 @@ SELECT `Participants (Ages 10-15)` / `Total Enrollment (Ages 10-15)` FROM `{BQ_P
  ORDER BY `Participants (Ages 10-15)` / `Total Enrollment (Ages 10-15)` ASC NULLS LAST LIMIT 3;
 ```
 
-===========
-Example 5
+""",
+    """Example 5
 
 **************************
 【Database Info】
@@ -394,8 +405,8 @@ Repeating the question and generating the SQL with Recursive Divide-and-Conquer.
 SELECT COUNT(*) FROM {BQ_PROJECT_ID}.retails.employees WHERE salary > 100000;
 ```
 
-===========
-Example 6
+""",
+    """Example 6
 
 **************************
 【Database Info】
@@ -477,8 +488,8 @@ SELECT COUNT(FL_DATE)
    WHERE T3.Description = 'Los Angeles, CA: Los Angeles International' )
 ```
 
-===========
-Example 7
+""",
+    """Example 7
 
 **************************
 【Database Info】
@@ -571,8 +582,8 @@ SELECT DISTINCT T4.name
  WHERE T1.score = 100 ) AS T3 ) AS T4
  GROUP BY T4.name, DATE_SUB(DATE(CONCAT(T4.years, '-01-01')), INTERVAL (T4.rowNumber - 1) YEAR) HAVING COUNT(T4.years) = 4
 ```
-===========
-Example 8
+""",
+    """Example 8
 
 **************************
 【Database Info】
@@ -669,14 +680,17 @@ ORDER BY
 LIMIT 1;
 ```
 
+""",
+)
+
+DC_QUESTION_TEMPLATE = """
+Here are some examples
+{EXAMPLES}===========
 Now is the real question, following the instruction and examples, generate the GoogleSQL with Recursive Divide-and-Conquer approach.
+The database of the real question is defined by the table creation statements before the examples.
 Follow all steps from the strategy. When you get to the final query, output the query string ONLY in the format ```sql ... ```. Make sure you only output one single query.
 Table names always should be exactly the same as the table names mentioned in the database schema, for example, `{BQ_PROJECT_ID}.airlines.Airlines` instead of `Airlines`.
 
-**************************
-【Table creation statements】
-{SCHEMA}
-
 **************************
 【Question】
 Question:
@@ -686,3 +700,5 @@ Question:
 【Answer】
 Repeating the question and generating the SQL with Recursive Divide-and-Conquer.
 """
+
+DC_PROMPT_TEMPLATE = DC_PROMPT_PREFIX + DC_QUESTION_TEMPLATE
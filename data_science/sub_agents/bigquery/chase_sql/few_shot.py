@@ -0,0 +1,137 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Selection of the few-shot examples of the CHASE-SQL prompts.
+
+The DC and QP templates come with libraries of worked examples, which are too
+long to send in full with every question. Each example is indexed by the TF-IDF
+vector of its table creation statements and question, and a question gets the
+examples most similar to it that fit a token budget:
+
+    examples = few_shot.select_examples(DC_EXAMPLES, question, k=2)
+"""
+
+import collections
+import functools
+import math
+import re
+
+from data_science.utils import rate_limiter
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """Splits a text into lowercase words, including the parts of identifiers."""
+    return WORD_PATTERN.findall(text.lower())
+
+
+def _indexed_text(example: str) -> str:
+    """Returns the part of an example that is indexed, before its answer."""
+    return example.split("【Answer】")[0]
+
+
+class ExampleIndex:
+    """A TF-IDF index of a library of few-shot examples."""
+
+    def __init__(self, examples: tuple[str, ...]):
+        self.examples = examples
+        term_counts = [
+            collections.Counter(tokenize(_indexed_text(example)))
+            for example in examples
+        ]
+        document_frequencies = collections.Counter(
+            term for counts in term_counts for term in counts
+        )
+        # Smoothed IDF, so that terms of every example keep a small weight.
+        self.idf = {
+            term: math.log((1 + len(examples)) / (1 + frequency)) + 1
+            for term, frequency in document_frequencies.items()
+        }
+        self.vectors = [self._vector(counts) for counts in term_counts]
+
+    def _vector(self, term_counts: collections.Counter) -> dict[str, float]:
+        """Returns the normalized TF-IDF vector of term counts."""
+        vector = {
+            term: count * self.idf[term]
+            for term, count in term_counts.items()
+            if term in self.idf
+        }
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        return {term: weight / norm for term, weight in vector.items()} if norm else {}
+
+    def similarities(self, question: str) -> list[float]:
+        """Returns the cosine similarity of a question to each example."""
+        query = self._vector(collections.Counter(tokenize(question)))
+        return [
+            sum(weight * vector.get(term, 0.0) for term, weight in query.items())
+            for vector in self.vectors
+        ]
+
+    def select(self, question: str, k: int, token_budget: int) -> list[str]:
+        """Returns the examples most similar to a question.
+
+        Args:
+            question (str): The natural language question.
+            k (int): The maximum number of examples.
+            token_budget (int): The maximum estimated number of tokens of the
+              examples. The most similar example is returned even if it is
+              larger, and larger examples are skipped for smaller ones.
+
+        Returns:
+            list[str]: The selected examples, most similar first.
+        """
+        if k <= 0:
+            return []
+        scores = self.similarities(question)
+        ranked = sorted(range(len(self.examples)), key=lambda i: (-scores[i], i))
+        selected = []
+        used_tokens = 0
+        for i in ranked:
+            tokens = rate_limiter.estimate_tokens(self.examples[i])
+            if selected and used_tokens + tokens > token_budget:
+                continue
+            selected.append(self.examples[i])
+            used_tokens += tokens
+            if len(selected) == k:
+                break
+        return selected
+
+
+@functools.lru_cache(maxsize=8)
+def get_example_index(examples: tuple[str, ...]) -> ExampleIndex:
+    """Returns the index of a library of examples, built once per process."""
+    return ExampleIndex(examples)
+
+
+def select_examples(
+    examples: tuple[str, ...], question: str, k: int = 2, token_budget: int = 2000
+) -> str:
+    """Returns the examples of a library to show with a question.
+
+    Args:
+        examples (tuple[str, ...]): The library, e.g. `DC_EXAMPLES`.
+        question (str): The natural language question.
+        k (int): The maximum number of examples.
+        token_budget (int): The maximum estimated number of tokens of the
+          examples.
+
+    Returns:
+        str: The selected examples, each after a separator line, as expected by
+        the `{EXAMPLES}` field of the question templates.
+    """
+    return "".join(
+        f"===========\n{example}"
+        for example in get_example_index(examples).select(question, k, token_budget)
+    )
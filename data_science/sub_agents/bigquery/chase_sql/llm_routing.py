@@ -0,0 +1,326 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Routing of the LLM requests of the CHASE-SQL Agent.
+
+`RegionRouter` spreads the requests across regions by latency and health, and a
+`CircuitBreaker` per model and region stops sending requests to a degraded
+endpoint, so `GeminiModel` can fall back to another model.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+
+# Weight of the latest request in the moving averages.
+EWMA_ALPHA = 0.2
+# Share of the requests sent to a random healthy region, to keep the latencies
+# of all regions up to date.
+EXPLORATION_RATE = 0.1
+# Consecutive errors, or the error rate, after which a region is ejected.
+EJECTION_CONSECUTIVE_ERRORS = 3
+EJECTION_ERROR_RATE = 0.5
+# Seconds an ejected region is not routed to.
+EJECTION_COOLDOWN_SECONDS = float(os.getenv("LLM_REGION_COOLDOWN_SECONDS", "60"))
+# Regions without a known latency are assumed to be this much slower than the
+# median region, so they are only tried by exploration or when the known
+# regions are slower.
+UNKNOWN_LATENCY_PENALTY = 1.5
+
+
+class RegionStats:
+    """The moving averages of the requests of a model to a region."""
+
+    def __init__(self):
+        self.latency = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.selections = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+    def score(self, prior_latency: float) -> float:
+        """Returns the expected latency, penalized by the error rate.
+
+        Args:
+            prior_latency (float): The latency assumed if none is known yet,
+              e.g. if all requests to the region failed.
+        """
+        latency = self.latency if self.latency is not None else prior_latency
+        return latency * (1 + 4 * self.error_rate)
+
+
+class RegionRouter:
+    """Routes each request to a healthy, fast region.
+
+    The router keeps the moving average of the latency and error rate of every
+    (model, region) pair. Most requests go to the region with the best score,
+    the latency penalized by the error rate, and a few to a random healthy
+    region. Regions whose requests keep failing are ejected for a cool-down
+    period. All decisions are counted and exposed by `metrics`.
+    """
+
+    def __init__(self, regions: list[str]):
+        self.regions = list(regions)
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def _stats(self, model_name: str, region: str) -> RegionStats:
+        """Returns the stats of a pair, creating them on first use."""
+        return self.stats.setdefault((model_name, region), RegionStats())
+
+    def _prior_latency(self, model_name: str) -> float:
+        """Returns the latency assumed for the regions without a known one.
+
+        It is the median latency of the regions of the model, with a penalty,
+        or 1 second if no latency is known.
+        """
+        latencies = sorted(
+            self._stats(model_name, region).latency
+            for region in self.regions
+            if self._stats(model_name, region).latency is not None
+        )
+        if not latencies:
+            return 1.0
+        return latencies[len(latencies) // 2] * UNKNOWN_LATENCY_PENALTY
+
+    def choose(self, model_name: str, exclude: tuple[str, ...] = ()) -> str:
+        """Chooses the region of the next request to a model.
+
+        Args:
+            model_name (str): The name of the model.
+            exclude (tuple[str, ...]): Regions not to choose, e.g. the region
+              of the request a hedge duplicates.
+
+        Returns:
+            str: The region.
+        """
+        with self.lock:
+            now = time.monotonic()
+            candidates = [region for region in self.regions if region not in exclude]
+            candidates = candidates or self.regions
+            healthy = [
+                region
+                for region in candidates
+                if self._stats(model_name, region).ejected_until <= now
+            ]
+            if not healthy:
+                # All regions are ejected: use the one that comes back first.
+                region = min(
+                    candidates,
+                    key=lambda r: self._stats(model_name, r).ejected_until,
+                )
+            elif random.random() < EXPLORATION_RATE:
+                region = random.choice(healthy)
+            else:
+                prior_latency = self._prior_latency(model_name)
+                scores = {
+                    r: self._stats(model_name, r).score(prior_latency)
+                    for r in healthy
+                }
+                best_score = min(scores.values())
+                region = random.choice(
+                    [r for r in healthy if scores[r] == best_score]
+                )
+            self._stats(model_name, region).selections += 1
+            return region
+
+    def record(
+        self,
+        model_name: str,
+        region: str,
+        latency: float | None = None,
+        error: bool = False,
+    ) -> None:
+        """Records the outcome of a request.
+
+        Args:
+            model_name (str): The name of the model.
+            region (str): The region of the request.
+            latency (float): The latency in seconds of a successful request.
+            error (bool): Whether the request failed in the region, e.g. with
+              a server-side error or because the region does not serve the
+              model.
+        """
+        with self.lock:
+            stats = self._stats(model_name, region)
+            stats.requests += 1
+            stats.error_rate += EWMA_ALPHA * (float(error) - stats.error_rate)
+            if error:
+                stats.errors += 1
+                stats.consecutive_errors += 1
+            else:
+                stats.consecutive_errors = 0
+                if latency is not None:
+                    stats.latency = (
+                        latency
+                        if stats.latency is None
+                        else stats.latency + EWMA_ALPHA * (latency - stats.latency)
+                    )
+            if error and (
+                stats.consecutive_errors >= EJECTION_CONSECUTIVE_ERRORS
+                or (stats.requests >= 5 and stats.error_rate >= EJECTION_ERROR_RATE)
+            ):
+                stats.ejected_until = time.monotonic() + EJECTION_COOLDOWN_SECONDS
+                stats.ejections += 1
+                # The region starts over once it comes back.
+                stats.consecutive_errors = 0
+                stats.error_rate = 0.0
+                logging.warning(
+                    "Ejected region %s of model %s for %.0f seconds.",
+                    region,
+                    model_name,
+                    EJECTION_COOLDOWN_SECONDS,
+                )
+
+    def metrics(self) -> dict:
+        """Returns the routing metrics per model and region.
+
+        Returns:
+            dict: For every "model/region" pair, the moving averages of the
+            `latency_seconds` and `error_rate`, the counts of `requests`,
+            `errors`, `selections` and `ejections`, and whether the region is
+            `ejected`.
+        """
+        with self.lock:
+            now = time.monotonic()
+            return {
+                f"{model_name}/{region}": {
+                    "latency_seconds": stats.latency,
+                    "error_rate": stats.error_rate,
+                    "requests": stats.requests,
+                    "errors": stats.errors,
+                    "selections": stats.selections,
+                    "ejections": stats.ejections,
+                    "ejected": stats.ejected_until > now,
+                }
+                for (model_name, region), stats in self.stats.items()
+            }
+
+
+# Failures, including responses slower than the latency SLO, after which a
+# circuit opens, and the seconds it stays open before a trial request.
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("LLM_CIRCUIT_OPEN_SECONDS", "30"))
+LATENCY_SLO_SECONDS = float(os.getenv("LLM_LATENCY_SLO_SECONDS", "30"))
+
+
+class CircuitOpenError(Exception):
+    """Raised when a request is short-circuited by an open circuit breaker."""
+
+    # Retryable like the 503 errors of an overloaded endpoint.
+    code = 503
+
+
+class CircuitBreaker:
+    """A circuit breaker of the requests of a model to a region.
+
+    The circuit is closed while the requests succeed. After
+    `CIRCUIT_FAILURE_THRESHOLD` consecutive failures or latency SLO breaches it
+    opens, and requests are short-circuited for `CIRCUIT_OPEN_SECONDS`. Then it
+    is half-open: a single trial request is let through, which closes the
+    circuit if it succeeds and opens it again otherwise.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    ADMITTED = "admitted"
+    TRIAL = "trial"
+
+    def __init__(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def allow_request(self) -> str | None:
+        """Checks if a request may be sent, and admits it.
+
+        Returns:
+            str: `TRIAL` for the trial request of a half-open circuit,
+            `ADMITTED` for other admitted requests, or None if the request is
+            short-circuited.
+        """
+        with self.lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < CIRCUIT_OPEN_SECONDS:
+                    return None
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                if self.trial_in_flight:
+                    return None
+                self.trial_in_flight = True
+                return self.TRIAL
+            return self.ADMITTED
+
+    def record(
+        self,
+        success: bool | None,
+        latency: float | None = None,
+        admission: str = ADMITTED,
+    ) -> None:
+        """Records the outcome of an admitted request.
+
+        Args:
+            success (bool): Whether the request succeeded, or None if its
+              outcome says nothing about the endpoint, e.g. if it was cancelled
+              or invalid.
+            latency (float): The latency in seconds of a successful request.
+            admission (str): The admission of the request by `allow_request`.
+              Only the outcome of the trial request ends the trial, not those
+              of requests admitted before the circuit opened.
+        """
+        with self.lock:
+            if admission == self.TRIAL:
+                self.trial_in_flight = False
+            if success is None:
+                return
+            if success and (latency is None or latency <= LATENCY_SLO_SECONDS):
+                self.state = self.CLOSED
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (
+                self.failures >= CIRCUIT_FAILURE_THRESHOLD
+            ):
+                if self.state != self.OPEN:
+                    logging.warning("Opened a circuit after %d failures.", self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+circuit_breakers = {}
+circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(model_name: str, region: str) -> CircuitBreaker:
+    """Returns the circuit breaker of a model in a region."""
+    with circuit_breakers_lock:
+        return circuit_breakers.setdefault((model_name, region), CircuitBreaker())
+
+
+def circuit_breaker_states() -> dict:
+    """Returns the state of every circuit breaker, per "model/region" pair."""
+    with circuit_breakers_lock:
+        return {
+            f"{model_name}/{region}": breaker.state
+            for (model_name, region), breaker in circuit_breakers.items()
+        }
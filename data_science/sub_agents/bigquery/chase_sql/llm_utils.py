@@ -12,35 +12,79 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""This code contains the LLM utils for the CHASE-SQL Agent."""
+"""This code contains the LLM utils for the CHASE-SQL Agent.
 
-import functools
+It is the gateway of all LLM calls of the database agent: the tools get a shared
+`GeminiModel` from `get_gemini_model` instead of creating SDK clients, so the
+connection pooling, limits and metrics below apply to every call.
+
+All requests go through the async client of the Google Gen AI SDK, on one
+background event loop shared by the whole process. At most
+`LLM_MAX_CONCURRENT_REQUESTS` requests are in flight at any time, however many
+sessions call the model, and no thread is started per request. The sync API
+(`call`, `call_parallel`) is a thin wrapper that waits for the event loop.
+Requests also wait for the process-wide `rate_limiter`, in the priority class
+of the caller's context, and are retried according to a `RetryPolicy` within
+the time budget of the caller. Responses of low-temperature requests are
+served from the persistent `response_cache` when possible.
+
+Several candidates of a prompt are generated by `call_candidates` with the
+`candidate_count` of the generation config, so their input tokens are processed
+once per request instead of once per candidate.
+
+Models created with `stream_sql` stream their responses and stop reading them
+as soon as the first ```sql block is complete, so the reasoning and anything
+after the final query are not waited for.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import copy
+import dataclasses
+import logging
 import os
 import random
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Callable, List, Optional
 
 import dotenv
-import vertexai
-from google.cloud import aiplatform
-from vertexai.generative_models import (GenerationConfig, HarmBlockThreshold,
-                                        HarmCategory)
-from vertexai.preview import caching
-from vertexai.preview.generative_models import GenerativeModel
+import httpx
+from data_science.utils import rate_limiter, response_cache, usage_tracker
+from google import genai
+from google.genai import types
+
+from . import llm_routing
 
 dotenv.load_dotenv(override=True)
 
-SAFETY_FILTER_CONFIG = {
-    HarmCategory.HARM_CATEGORY_UNSPECIFIED: HarmBlockThreshold.BLOCK_NONE,
-    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-}
+SAFETY_FILTER_CONFIG = [
+    types.SafetySetting(
+        category=category, threshold=types.HarmBlockThreshold.BLOCK_NONE
+    )
+    for category in (
+        types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
+        types.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
+        types.HarmCategory.HARM_CATEGORY_HARASSMENT,
+        types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
+    )
+]
 
 GCP_PROJECT = os.getenv("GOOGLE_CLOUD_PROJECT")
-GCP_LOCATION = os.getenv("GOOGLE_CLOUD_LOCATION")
+GCP_LOCATION = os.getenv("GOOGLE_CLOUD_LOCATION", "us-central1")
+
+# Model used while the circuit breaker of a model is open, e.g. a faster flash
+# variant.
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL")
+
+# Maximum number of LLM requests in flight in this process.
+LLM_MAX_CONCURRENT_REQUESTS = int(os.getenv("LLM_MAX_CONCURRENT_REQUESTS", "16"))
+
+# Maximum number of candidates the models generate per request.
+LLM_MAX_CANDIDATE_COUNT = int(os.getenv("LLM_MAX_CANDIDATE_COUNT", "8"))
 
 GEMINI_AVAILABLE_REGIONS = [
     "europe-west3",
@@ -69,49 +113,333 @@ GEMINI_AVAILABLE_REGIONS = [
     "asia-southeast1",
     "southamerica-east1",
 ]
-GEMINI_URL = (
-    "projects/{GCP_PROJECT}/locations/{region}/publishers/google/models/{model_name}"
-)
 
-aiplatform.init(
-    project=GCP_PROJECT,
-    location=GCP_LOCATION,
-)
-vertexai.init(project=GCP_PROJECT, location=GCP_LOCATION)
+# Routes the requests of models with `distribute_requests` across regions.
+region_router = llm_routing.RegionRouter(GEMINI_AVAILABLE_REGIONS)
 
+# The Gen AI clients per region, which keep their connections open, and the
+# event loop all requests run on. The async clients are bound to the event loop
+# they are first used on.
+genai_clients = {}
+genai_clients_lock = threading.Lock()
+# The models shared by the tools, per model name and settings.
+gemini_models = {}
+gemini_models_lock = threading.Lock()
+event_loop = None
+event_loop_lock = threading.Lock()
+request_semaphore = None
 
-def retry(max_attempts=8, base_delay=1, backoff_factor=2):
-    """Decorator to add retry logic to a function.
 
-    Args:
-        max_attempts (int): The maximum number of attempts.
-        base_delay (int): The base delay in seconds for the exponential backoff.
-        backoff_factor (int): The factor by which to multiply the delay for each
-          subsequent attempt.
+def get_genai_client(region: str) -> genai.Client:
+    """Returns the Gen AI client of a region, creating it on first use."""
+    with genai_clients_lock:
+        if region not in genai_clients:
+            genai_clients[region] = genai.Client(
+                vertexai=True, project=GCP_PROJECT, location=region
+            )
+        return genai_clients[region]
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Returns the background event loop of the LLM requests."""
+    global event_loop
+    with event_loop_lock:
+        if event_loop is None:
+            event_loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=event_loop.run_forever, name="llm-event-loop", daemon=True
+            ).start()
+        return event_loop
+
+
+def get_routing_metrics() -> dict:
+    """Returns the latency, error and routing metrics per model and region.
+
+    See `llm_routing.RegionRouter.metrics`. The `circuit` of every pair holds
+    the state of its circuit breaker.
+    """
+    metrics = region_router.metrics()
+    for pair, state in llm_routing.circuit_breaker_states().items():
+        metrics.setdefault(pair, {})["circuit"] = state
+    return metrics
+
+
+def get_request_semaphore() -> asyncio.Semaphore:
+    """Returns the semaphore capping the requests in flight.
+
+    Must be called on the background event loop.
+    """
+    global request_semaphore
+    if request_semaphore is None:
+        request_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENT_REQUESTS)
+    return request_semaphore
+
+
+def run_in_event_loop(coroutine_function, *args, **kwargs):
+    """Runs a coroutine function on the background event loop.
+
+    The coroutine runs in a copy of the caller's context, so context variables
+    set by the caller are visible to it.
 
     Returns:
-        Callable: The decorator function.
+        concurrent.futures.Future: The future of the result.
     """
+    context = contextvars.copy_context()
 
-    def decorator(func):
-        @functools.wraps(func)
-        def wrapper(*args, **kwargs):
-            attempts = 0
-            while attempts < max_attempts:
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:  # pylint: disable=broad-exception-caught
-                    print(f"Attempt {attempts + 1} failed with error: {e}")
-                    attempts += 1
-                    if attempts >= max_attempts:
-                        raise e
-                    delay = base_delay * (backoff_factor**attempts)
-                    delay = delay + random.uniform(0, 0.1 * delay)
-                    time.sleep(delay)
+    async def run_in_context():
+        return await asyncio.get_running_loop().create_task(
+            coroutine_function(*args, **kwargs), context=context
+        )
+
+    return asyncio.run_coroutine_threadsafe(run_in_context(), get_event_loop())
+
+
+# HTTP status codes of errors that are worth retrying: timeouts, quota
+# exhaustion and server errors.
+RETRYABLE_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504})
+
+# The absolute deadline (in `time.monotonic()` seconds) of the LLM requests of
+# the current context, if any.
+current_deadline = contextvars.ContextVar("llm_deadline", default=None)
+
+
+@contextlib.contextmanager
+def deadline(seconds: float):
+    """Sets the time budget of the LLM requests made inside the block.
+
+    Nested budgets cannot extend the budget of the enclosing block.
+    """
+    new_deadline = time.monotonic() + seconds
+    enclosing_deadline = current_deadline.get()
+    if enclosing_deadline is not None:
+        new_deadline = min(new_deadline, enclosing_deadline)
+    token = current_deadline.set(new_deadline)
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Checks if a failed LLM request may succeed when it is retried.
+
+    Timeouts, connection errors, quota errors (429) and server errors (5xx) are
+    retryable. Other errors, like invalid requests (400) or failing response
+    parsers, are not.
+    """
+    if isinstance(error, (TimeoutError, ConnectionError, httpx.TransportError)):
+        return True
+    code = getattr(error, "code", None)
+    return isinstance(code, int) and code in RETRYABLE_STATUS_CODES
+
+
+@dataclasses.dataclass(frozen=True)
+class RetryPolicy:
+    """Retries retryable errors with jittered exponential backoff and a deadline.
+
+    The backoff uses full jitter: attempt n waits a random time between 0 and
+    min(max_delay, base_delay * 2**n) seconds. Attempts and waits never run past
+    the deadline, the earlier of `deadline` seconds after the first attempt and
+    the deadline of the caller's context (see `deadline`).
+
+    Attributes:
+        max_attempts (int): The maximum number of attempts.
+        base_delay (float): The base delay in seconds of the backoff.
+        max_delay (float): The maximum delay in seconds between attempts.
+        deadline (float): The total time budget in seconds, including waits.
+    """
+
+    max_attempts: int = 6
+    base_delay: float = 1.0
+    max_delay: float = 20.0
+    deadline: float = 120.0
+
+    def backoff(self, attempt: int) -> float:
+        """Returns the delay before the attempt after the given one."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    async def run(self, coroutine_function, *args, **kwargs):
+        """Runs a coroutine function until it succeeds or the policy gives up.
+
+        Returns:
+            The result of the coroutine function.
+
+        Raises:
+            The last error if it is not retryable or the attempts or the time
+            budget are exhausted, or TimeoutError if an attempt exceeds the
+            remaining time budget.
+        """
+        end_time = time.monotonic() + self.deadline
+        if current_deadline.get() is not None:
+            end_time = min(end_time, current_deadline.get())
+        attempt = 0
+        while True:
+            attempt += 1
+            remaining = end_time - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise TimeoutError("The deadline of the LLM request was exceeded.")
+                return await asyncio.wait_for(
+                    coroutine_function(*args, **kwargs), timeout=remaining
+                )
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                delay = self.backoff(attempt)
+                if (
+                    not is_retryable(e)
+                    or attempt >= self.max_attempts
+                    or time.monotonic() + delay >= end_time
+                ):
+                    raise
+                print(f"Attempt {attempt} failed with error: {e}")
+                await asyncio.sleep(delay)
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+@dataclasses.dataclass(frozen=True)
+class HedgingPolicy:
+    """When to hedge a slow request with a duplicate in another region.
+
+    A request is hedged once it takes longer than the `percentile` of the
+    recent latencies of the model, if at least `min_samples` latencies are
+    known. At most `max_hedge_rate` of the recent requests are hedged, so
+    hedging adds at most that share to the cost.
+
+    Attributes:
+        percentile (float): The latency percentile to hedge at, e.g. 0.95.
+        max_hedge_rate (float): The maximum share of hedged requests.
+        min_samples (int): The number of latencies needed to start hedging.
+    """
+
+    percentile: float = 0.95
+    max_hedge_rate: float = 0.1
+    min_samples: int = 20
 
-        return wrapper
 
-    return decorator
+class LatencyTracker:
+    """Keeps the recent latencies and hedges of the requests to a model."""
+
+    def __init__(self, window: int = 200):
+        self.latencies = collections.deque(maxlen=window)
+        self.hedged = collections.deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record_latency(self, seconds: float) -> None:
+        """Records the latency of a successful request."""
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def hedge_delay(self, policy: HedgingPolicy) -> float | None:
+        """Returns the seconds after which to hedge a request, or None."""
+        with self.lock:
+            if len(self.latencies) < policy.min_samples:
+                return None
+            latencies = sorted(self.latencies)
+        index = min(len(latencies) - 1, int(policy.percentile * len(latencies)))
+        return latencies[index]
+
+    def record_request(self, policy: HedgingPolicy, hedge: bool) -> bool:
+        """Records a request, hedged if `hedge` and the hedge rate allows it.
+
+        Returns:
+            bool: Whether the request may be hedged.
+        """
+        with self.lock:
+            hedge = hedge and (
+                sum(self.hedged) < policy.max_hedge_rate * (len(self.hedged) + 1)
+            )
+            self.hedged.append(hedge)
+            return hedge
+
+
+latency_trackers = collections.defaultdict(LatencyTracker)
+
+
+def candidate_text(candidate: types.Candidate) -> str:
+    """Returns the text of a response candidate, or an empty string."""
+    if candidate.content is None or not candidate.content.parts:
+        return ""
+    return "".join(part.text or "" for part in candidate.content.parts)
+
+
+def is_valid(validator: Callable[[str], bool], response: str) -> bool:
+    """Checks a response with a validator, treating its errors as invalid."""
+    try:
+        return bool(validator(response))
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        print(f"Error validating a response: {e}")
+        return False
+
+
+class SqlFenceDetector:
+    """Detects the end of the first ```sql block of a streamed response."""
+
+    def __init__(self):
+        self.text = ""
+        self.sql_start = None
+        # Where the next search starts, a few characters back so that fences
+        # split across chunks are found.
+        self.position = 0
+
+    def feed(self, chunk: str) -> bool:
+        """Appends a chunk and checks if the ```sql block is complete."""
+        self.text += chunk
+        if self.sql_start is None:
+            index = self.text.find("```sql", max(0, self.position - 5))
+            if index == -1:
+                self.position = len(self.text)
+                return False
+            self.sql_start = index + len("```sql")
+            self.position = self.sql_start
+        index = self.text.find("```", max(self.sql_start, self.position - 2))
+        if index == -1:
+            self.position = len(self.text)
+            return False
+        self.text = self.text[: index + len("```")]
+        return True
+
+
+class StreamingStats:
+    """Keeps the time-to-SQL of the streamed requests to a model."""
+
+    def __init__(self, window: int = 200):
+        self.times_to_sql = collections.deque(maxlen=window)
+        self.requests = 0
+        self.cutoffs = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float, cutoff: bool) -> None:
+        """Records a streamed request, and whether it was cut off early."""
+        with self.lock:
+            self.requests += 1
+            if cutoff:
+                self.cutoffs += 1
+                self.times_to_sql.append(seconds)
+
+    def metrics(self) -> dict:
+        """Returns the request counts and time-to-SQL percentiles."""
+        with self.lock:
+            times = sorted(self.times_to_sql)
+            metrics = {"requests": self.requests, "cutoffs": self.cutoffs}
+        for name, percentile in (("p50", 0.5), ("p95", 0.95)):
+            metrics[f"time_to_sql_{name}_seconds"] = (
+                times[min(len(times) - 1, int(percentile * len(times)))]
+                if times
+                else None
+            )
+        return metrics
+
+
+streaming_stats = collections.defaultdict(StreamingStats)
+
+
+def get_streaming_metrics() -> dict:
+    """Returns the time-to-SQL metrics of the streamed requests per model."""
+    return {
+        model_name: stats.metrics()
+        for model_name, stats in list(streaming_stats.items())
+    }
 
 
 class GeminiModel:
@@ -124,30 +452,530 @@ class GeminiModel:
         distribute_requests: bool = False,
         cache_name: str | None = None,
         temperature: float = 0.01,
+        retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+        hedging: HedgingPolicy | None = None,
+        fallback_model_name: str | None = LLM_FALLBACK_MODEL,
+        stream_sql: bool = False,
         **kwargs,
     ):
         self.model_name = model_name
+        self.stream_sql = stream_sql
+        self.fallback_model_name = fallback_model_name
+        self.retry_policy = retry_policy
+        self.hedging = hedging
         self.finetuned_model = finetuned_model
         self.arguments = kwargs
         self.distribute_requests = distribute_requests
         self.temperature = temperature
+        self.cache_name = cache_name
+        self.region = GCP_LOCATION
+
+    def _generation_config(
+        self, candidate_count: int = 1
+    ) -> types.GenerateContentConfig:
+        """Returns the generation config of the requests."""
+        return types.GenerateContentConfig(
+            temperature=self.temperature,
+            safety_settings=SAFETY_FILTER_CONFIG,
+            cached_content=self.cache_name,
+            candidate_count=candidate_count if candidate_count > 1 else None,
+            **self.arguments,
+        )
+
+    async def _generate(
+        self,
+        prompt: str,
+        region: str,
+        candidate_count: int = 1,
+        accept: Optional[Callable[[str], bool]] = None,
+        sent: Optional[asyncio.Event] = None,
+        answered_by: Optional[List[str]] = None,
+    ) -> types.GenerateContentResponse:
+        """Sends one request to the model in a region.
+
+        The request first waits for the rate limiter and a request slot, then
+        sets the `sent` event, if given. The name of the model that answered
+        is appended to `answered_by`, if given.
+
+        If the circuit breaker of the model in the region is open, the request
+        goes to the fallback model instead, or fails with a CircuitOpenError.
+        Requests with a cached context never fall back, as the cache belongs
+        to the model it was created for. A streamed request returns early with
+        the first candidate that passes `accept`, see `_generate_stream`.
+        """
         model_name = self.model_name
-        if not self.finetuned_model and self.distribute_requests:
-            random_region = random.choice(GEMINI_AVAILABLE_REGIONS)
-            model_name = GEMINI_URL.format(
-                GCP_PROJECT=GCP_PROJECT,
-                region=random_region,
-                model_name=self.model_name,
+        breaker = llm_routing.get_circuit_breaker(model_name, region)
+        admission = breaker.allow_request()
+        if admission is None:
+            if (
+                self.fallback_model_name is None
+                or self.finetuned_model
+                or self.cache_name is not None
+            ):
+                raise llm_routing.CircuitOpenError(
+                    f"The circuit of {model_name} in {region} is open."
+                )
+            model_name = self.fallback_model_name
+            breaker = llm_routing.get_circuit_breaker(model_name, region)
+            admission = breaker.allow_request()
+            if admission is None:
+                raise llm_routing.CircuitOpenError(
+                    f"The circuits of {self.model_name} and {model_name} in"
+                    f" {region} are open."
+                )
+            print(f"Falling back from {self.model_name} to {model_name} in {region}")
+
+        client = get_genai_client(region)
+        limiter = rate_limiter.get_rate_limiter()
+        estimated_tokens = rate_limiter.estimate_tokens(prompt)
+        success = None
+        try:
+            await limiter.acquire_async(estimated_tokens)
+            async with get_request_semaphore():
+                start_time = time.monotonic()
+                if sent is not None:
+                    sent.set()
+                try:
+                    if self.stream_sql:
+                        response = await self._generate_stream(
+                            client,
+                            model_name,
+                            prompt,
+                            start_time,
+                            candidate_count,
+                            accept,
+                        )
+                    else:
+                        response = await client.aio.models.generate_content(
+                            model=model_name,
+                            contents=prompt,
+                            config=self._generation_config(candidate_count),
+                        )
+                except Exception as e:
+                    if is_retryable(e):
+                        success = False
+                    # Non-retryable errors count for the routing too, e.g. the
+                    # 404 of a region that does not serve the model.
+                    region_router.record(model_name, region, error=True)
+                    raise
+                latency = time.monotonic() - start_time
+                success = True
+        finally:
+            breaker.record(success, latency if success else None, admission)
+        latency_trackers[model_name].record_latency(latency)
+        region_router.record(model_name, region, latency=latency)
+        usage_tracker.get_usage_tracker().record(
+            model_name, response.usage_metadata, latency
+        )
+        if response.usage_metadata is not None:
+            limiter.record_usage(
+                estimated_tokens, response.usage_metadata.total_token_count
             )
-        if cache_name is not None:
-            cached_content = caching.CachedContent(cached_content_name=cache_name)
-            self.model = GenerativeModel.from_cached_content(
-                cached_content=cached_content
+        if answered_by is not None:
+            answered_by.append(model_name)
+        return response
+
+    async def _generate_stream(
+        self,
+        client: genai.Client,
+        model_name: str,
+        prompt: str,
+        start_time: float,
+        candidate_count: int = 1,
+        accept: Optional[Callable[[str], bool]] = None,
+    ) -> types.GenerateContentResponse:
+        """Streams a response until the ```sql block of every candidate is done.
+
+        With `accept`, every candidate is checked as soon as its SQL block is
+        done, and the stream stops at the first accepted candidate.
+
+        Returns:
+            types.GenerateContentResponse: The text of the candidates up to the
+            end of their SQL block, or only the accepted candidate, with the
+            usage of the last chunk read.
+        """
+        detectors = [SqlFenceDetector() for _ in range(candidate_count)]
+        completed = set()
+        accepted = None
+        usage_metadata = None
+        cutoff = False
+        stream = await client.aio.models.generate_content_stream(
+            model=model_name,
+            contents=prompt,
+            config=self._generation_config(candidate_count),
+        )
+        try:
+            async for chunk in stream:
+                usage_metadata = chunk.usage_metadata or usage_metadata
+                for candidate in chunk.candidates or []:
+                    index = candidate.index or 0
+                    if index in completed or index >= candidate_count:
+                        continue
+                    if detectors[index].feed(candidate_text(candidate)):
+                        completed.add(index)
+                        if accept is not None and accept(detectors[index].text):
+                            accepted = index
+                            break
+                if accepted is not None or len(completed) == candidate_count:
+                    cutoff = True
+                    break
+        finally:
+            # Closing the stream stops the generation of the remaining tokens.
+            await stream.aclose()
+        time_to_sql = time.monotonic() - start_time
+        streaming_stats[model_name].record(time_to_sql, cutoff)
+        if cutoff:
+            logging.info("Time to SQL of %s: %.2fs", model_name, time_to_sql)
+        return types.GenerateContentResponse(
+            candidates=[
+                types.Candidate(
+                    index=index,
+                    content=types.Content(
+                        role="model", parts=[types.Part(text=detector.text)]
+                    ),
+                )
+                for index, detector in enumerate(detectors)
+                if accepted is None or index == accepted
+            ],
+            usage_metadata=usage_metadata,
+        )
+
+    def _choose_region(self, exclude: tuple[str, ...] = ()) -> str:
+        """Returns the region of the next request.
+
+        Requests are only routed across regions with `distribute_requests`, or
+        for hedges (the region of the request they duplicate is excluded).
+        """
+        if self.finetuned_model or self.cache_name is not None:
+            # Endpoints and cached contents only exist in their own region.
+            return self.region
+        if not self.distribute_requests and not exclude:
+            return self.region
+        return region_router.choose(self.model_name, exclude=exclude)
+
+    async def _generate_hedged(
+        self,
+        prompt: str,
+        candidate_count: int = 1,
+        accept: Optional[Callable[[str], bool]] = None,
+        answered_by: Optional[List[str]] = None,
+    ) -> types.GenerateContentResponse:
+        """Sends a request, hedged with a duplicate if it is slow.
+
+        The first successful response wins and the other request is cancelled.
+        The hedge delay starts once the primary request is sent, like the
+        latencies it is derived from, so that requests waiting for the rate
+        limiter or a request slot are not hedged.
+        """
+        tracker = latency_trackers[self.model_name]
+        hedge_delay = tracker.hedge_delay(self.hedging)
+        primary_region = self._choose_region()
+        sent = asyncio.Event()
+        primary = asyncio.ensure_future(
+            self._generate(
+                prompt,
+                primary_region,
+                candidate_count,
+                accept,
+                sent,
+                answered_by=answered_by,
+            )
+        )
+        tasks = [primary]
+        try:
+            if hedge_delay is not None:
+                sent_task = asyncio.ensure_future(sent.wait())
+                await asyncio.wait(
+                    [primary, sent_task], return_when=asyncio.FIRST_COMPLETED
+                )
+                sent_task.cancel()
+                await asyncio.wait(tasks, timeout=hedge_delay)
+            slow = hedge_delay is not None and not primary.done()
+            if not tracker.record_request(self.hedging, slow):
+                return await primary
+            print(f"Hedging a request to {self.model_name} after {hedge_delay:.2f}s")
+            tasks.append(
+                asyncio.ensure_future(
+                    self._generate(
+                        prompt,
+                        self._choose_region(exclude=(primary_region,)),
+                        candidate_count,
+                        accept,
+                        answered_by=answered_by,
+                    )
+                )
+            )
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+            # Both requests failed.
+            return primary.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _acall_once(
+        self,
+        prompt: str,
+        candidate_count: int = 1,
+        accept: Optional[Callable[[str], bool]] = None,
+        answered_by: Optional[List[str]] = None,
+    ) -> List[str]:
+        """Calls the model once, on the background event loop.
+
+        Args:
+            prompt (str): The prompt to call the model with.
+            candidate_count (int): The number of candidates.
+            accept (callable, optional): A check of the raw text of a
+              candidate. A streamed response stops at the first accepted
+              candidate.
+            answered_by (list, optional): The names of the models that
+              answered are appended to it, e.g. the fallback model.
+
+        Returns:
+            List[str]: The text of every candidate of the response.
+        """
+        if self.hedging is None:
+            response = await self._generate(
+                prompt,
+                self._choose_region(),
+                candidate_count,
+                accept,
+                answered_by=answered_by,
             )
         else:
-            self.model = GenerativeModel(model_name=model_name)
+            response = await self._generate_hedged(
+                prompt, candidate_count, accept, answered_by=answered_by
+            )
+        return [candidate_text(candidate) for candidate in response.candidates or []]
+
+    async def _acall(self, prompt: str, parser_func=None) -> str:
+        """Calls the model on the background event loop, see `acall`."""
+        cache = response_cache.get_response_cache(self.temperature)
+        response = None
+        if cache is not None:
+            key = response_cache.cache_key(
+                self.model_name,
+                prompt,
+                {
+                    "temperature": self.temperature,
+                    "cache_name": self.cache_name,
+                    **self.arguments,
+                },
+            )
+            # The SQLite I/O must not block the requests on the event loop.
+            response = await asyncio.to_thread(cache.get, key)
+        if response is None:
+            answered_by = []
+            responses = await self.retry_policy.run(
+                self._acall_once, prompt, answered_by=answered_by
+            )
+            # A response without candidates, e.g. blocked by the safety
+            # filters, has no text.
+            response = responses[0] if responses else None
+            # The answers of the fallback model are not cached, as they would
+            # be served for this model after its circuit closes.
+            if (
+                cache is not None
+                and response is not None
+                and set(answered_by) == {self.model_name}
+            ):
+                await asyncio.to_thread(cache.put, key, response)
+        if parser_func:
+            return parser_func(response)
+        return response
+
+    async def _acall_parallel(
+        self,
+        prompts: List[str],
+        parser_func: Optional[Callable[[str], str]] = None,
+        timeout: int = 60,
+    ) -> List[Optional[str]]:
+        """Calls the model for several prompts on the event loop.
+
+        See `acall_parallel`.
+        """
+        if not prompts:
+            return []
+        with deadline(timeout):
+            # The tasks copy the context, with the deadline, when created.
+            tasks = [
+                asyncio.ensure_future(self._acall(prompt, parser_func))
+                for prompt in prompts
+            ]
+        await asyncio.wait(tasks)
+
+        results = [None] * len(prompts)
+        for index, task in enumerate(tasks):
+            error = task.exception()
+            if isinstance(error, TimeoutError):
+                print(f"Timeout occurred for prompt {index}")
+                results[index] = "Timeout"
+            elif error is not None:
+                print(f"Error for prompt {index}: {error}")
+                results[index] = f"Error after retries: {error}"
+            else:
+                results[index] = task.result()
+        return results
+
+    async def _acall_candidates(
+        self,
+        prompt: str,
+        candidate_count: int,
+        parser_func: Optional[Callable[[str], str]] = None,
+        timeout: int = 60,
+        validator: Optional[Callable[[str], bool]] = None,
+    ) -> List[Optional[str]]:
+        """Generates several candidates of a prompt on the event loop.
+
+        See `acall_candidates`.
+        """
+        if candidate_count < 1:
+            return []
+        counts = [
+            min(LLM_MAX_CANDIDATE_COUNT, candidate_count - start)
+            for start in range(0, candidate_count, LLM_MAX_CANDIDATE_COUNT)
+        ]
+
+        def accept(text: str) -> bool:
+            return is_valid(validator, parser_func(text) if parser_func else text)
+
+        async def generate(count: int) -> List[str]:
+            if candidate_count == 1:
+                # Single candidates may be served from the response cache.
+                return [await self._acall(prompt, parser_func)]
+            responses = await self.retry_policy.run(
+                self._acall_once,
+                prompt,
+                count,
+                accept if validator is not None else None,
+            )
+            if parser_func:
+                responses = [parser_func(response) for response in responses]
+            return responses
+
+        with deadline(timeout):
+            # The tasks copy the context, with the deadline, when created.
+            tasks = [asyncio.ensure_future(generate(count)) for count in counts]
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            if validator is None:
+                continue
+            for task in tasks:
+                if task not in done or task.exception() is not None:
+                    continue
+                for response in task.result():
+                    if is_valid(validator, response):
+                        for other_task in pending:
+                            other_task.cancel()
+                        return [response]
+
+        results = []
+        for count, task in zip(counts, tasks):
+            error = task.exception()
+            if isinstance(error, TimeoutError):
+                print(f"Timeout occurred for {count} candidates")
+                results.extend(["Timeout"] * count)
+            elif error is not None:
+                print(f"Error for {count} candidates: {error}")
+                results.extend([f"Error after retries: {error}"] * count)
+            else:
+                results.extend(task.result())
+        return results
+
+    async def acall(self, prompt: str, parser_func=None) -> str:
+        """Calls the Gemini model with the given prompt, asynchronously.
+
+        Args:
+            prompt (str): The prompt to call the model with.
+            parser_func (callable, optional): A function that processes the LLM
+              output. It takes the model"s response as input and returns the
+              processed result.
+
+        Returns:
+            str: The processed response from the model.
+        """
+        return await asyncio.wrap_future(
+            run_in_event_loop(self._acall, prompt, parser_func)
+        )
+
+    async def acall_parallel(
+        self,
+        prompts: List[str],
+        parser_func: Optional[Callable[[str], str]] = None,
+        timeout: int = 60,
+    ) -> List[Optional[str]]:
+        """Calls the Gemini model for multiple prompts concurrently.
+
+        The requests share the process-wide limit of
+        `LLM_MAX_CONCURRENT_REQUESTS` requests in flight.
+
+        Args:
+            prompts (List[str]): A list of prompts to call the model with.
+            parser_func (callable, optional): A function to process each response.
+            timeout (int): The time budget (in seconds) of all prompts,
+              including retries.
+
+        Returns:
+            List[Optional[str]]:
+            A list of responses, or an error message for prompts that failed.
+        """
+        return await asyncio.wrap_future(
+            run_in_event_loop(self._acall_parallel, prompts, parser_func, timeout)
+        )
+
+    async def acall_candidates(
+        self,
+        prompt: str,
+        candidate_count: int,
+        parser_func: Optional[Callable[[str], str]] = None,
+        timeout: int = 60,
+        validator: Optional[Callable[[str], bool]] = None,
+    ) -> List[Optional[str]]:
+        """Generates several candidates of a prompt, asynchronously.
+
+        The candidates are generated by as few requests as possible, each with
+        up to `LLM_MAX_CANDIDATE_COUNT` candidates, so the input tokens are
+        paid once per request.
+
+        Args:
+            prompt (str): The prompt to call the model with.
+            candidate_count (int): The number of candidates.
+            parser_func (callable, optional): A function to process each
+              candidate.
+            timeout (int): The time budget (in seconds) of all requests,
+              including retries.
+            validator (callable, optional): A function checking a processed
+              candidate. If given, the call returns as soon as a candidate
+              passes it, and the other requests are cancelled. Streamed
+              candidates are checked as soon as their SQL block is done, other
+              candidates when their request completes.
+
+        Returns:
+            List[Optional[str]]:
+            A list of candidates, or an error message for the candidates of
+            requests that failed. With a validator, a list with the first valid
+            candidate, or all candidates if none is valid.
+        """
+        return await asyncio.wrap_future(
+            run_in_event_loop(
+                self._acall_candidates,
+                prompt,
+                candidate_count,
+                parser_func,
+                timeout,
+                validator,
+            )
+        )
 
-    @retry(max_attempts=12, base_delay=2, backoff_factor=2)
     def call(self, prompt: str, parser_func=None) -> str:
         """Calls the Gemini model with the given prompt.
 
@@ -160,74 +988,119 @@ class GeminiModel:
         Returns:
             str: The processed response from the model.
         """
-        response = self.model.generate_content(
-            prompt,
-            generation_config=GenerationConfig(
-                temperature=self.temperature,
-                **self.arguments,
-            ),
-            safety_settings=SAFETY_FILTER_CONFIG,
-        ).text
-        if parser_func:
-            return parser_func(response)
-        return response
+        return run_in_event_loop(self._acall, prompt, parser_func).result()
 
     def call_parallel(
         self,
         prompts: List[str],
         parser_func: Optional[Callable[[str], str]] = None,
         timeout: int = 60,
-        max_retries: int = 5,
     ) -> List[Optional[str]]:
-        """Calls the Gemini model for multiple prompts in parallel using threads with retry logic.
+        """Calls the Gemini model for multiple prompts in parallel with retry logic.
 
         Args:
             prompts (List[str]): A list of prompts to call the model with.
             parser_func (callable, optional): A function to process each response.
-            timeout (int): The maximum time (in seconds) to wait for each thread.
-            max_retries (int): The maximum number of retries for timed-out threads.
+            timeout (int): The time budget (in seconds) of all prompts,
+              including retries.
 
         Returns:
             List[Optional[str]]:
-            A list of responses, or None for threads that failed.
+            A list of responses, or an error message for prompts that failed.
         """
-        results = [None] * len(prompts)
+        return run_in_event_loop(
+            self._acall_parallel, prompts, parser_func, timeout
+        ).result()
 
-        def worker(index: int, prompt: str):
-            """Thread worker function to call the model and store the result with retries."""
-            retries = 0
-            while retries <= max_retries:
-                try:
-                    return self.call(prompt, parser_func)
-                except Exception as e:  # pylint: disable=broad-exception-caught
-                    print(f"Error for prompt {index}: {str(e)}")
-                    retries += 1
-                    if retries <= max_retries:
-                        print(f"Retrying ({retries}/{max_retries}) for prompt {index}")
-                        time.sleep(1)  # Small delay before retrying
-                    else:
-                        return f"Error after retries: {str(e)}"
+    def call_candidates(
+        self,
+        prompt: str,
+        candidate_count: int,
+        parser_func: Optional[Callable[[str], str]] = None,
+        timeout: int = 60,
+        validator: Optional[Callable[[str], bool]] = None,
+    ) -> List[Optional[str]]:
+        """Generates several candidates of a prompt, see `acall_candidates`.
 
-        # Create and start one thread for each prompt
-        with ThreadPoolExecutor(max_workers=len(prompts)) as executor:
-            future_to_index = {
-                executor.submit(worker, i, prompt): i
-                for i, prompt in enumerate(prompts)
-            }
+        Args:
+            prompt (str): The prompt to call the model with.
+            candidate_count (int): The number of candidates.
+            parser_func (callable, optional): A function to process each
+              candidate.
+            timeout (int): The time budget (in seconds) of all requests,
+              including retries.
+            validator (callable, optional): A function checking a processed
+              candidate, see `acall_candidates`.
 
-            for future in as_completed(future_to_index, timeout=timeout):
-                index = future_to_index[future]
-                try:
-                    results[index] = future.result()
-                except Exception as e:  # pylint: disable=broad-exception-caught
-                    print(f"Unhandled error for prompt {index}: {e}")
-                    results[index] = "Unhandled Error"
-
-        # Handle remaining unfinished tasks after the timeout
-        for future in future_to_index:
-            index = future_to_index[future]
-            if not future.done():
-                print(f"Timeout occurred for prompt {index}")
-                results[index] = "Timeout"
+        Returns:
+            List[Optional[str]]:
+            A list of candidates, or an error message for the candidates of
+            requests that failed. With a validator, a list with the first valid
+            candidate, or all candidates if none is valid.
+        """
+        return run_in_event_loop(
+            self._acall_candidates,
+            prompt,
+            candidate_count,
+            parser_func,
+            timeout,
+            validator,
+        ).result()
 
-        return results
+    def submit_candidates(
+        self,
+        prompt: str,
+        candidate_count: int,
+        parser_func: Optional[Callable[[str], str]] = None,
+        timeout: int = 60,
+    ) -> concurrent.futures.Future:
+        """Starts generating several candidates of a prompt in the background.
+
+        Unlike `call_candidates`, it does not wait for the candidates, so the
+        candidates of several prompts can be generated concurrently.
+
+        Args:
+            prompt (str): The prompt to call the model with.
+            candidate_count (int): The number of candidates.
+            parser_func (callable, optional): A function to process each
+              candidate.
+            timeout (int): The time budget (in seconds) of all requests,
+              including retries.
+
+        Returns:
+            concurrent.futures.Future: The future of the list of candidates,
+            see `acall_candidates`.
+        """
+        return run_in_event_loop(
+            self._acall_candidates, prompt, candidate_count, parser_func, timeout
+        )
+
+
+def get_gemini_model(
+    model_name: str, cache_name: str | None = None, **kwargs
+) -> GeminiModel:
+    """Returns the shared model of a model name and settings.
+
+    Models are stateless apart from their settings, so the tools share them
+    instead of creating one per call. The pool is keyed by the stable settings
+    only: the context cache changes whenever its prefix does, so a model with
+    a cache is a copy of the shared model that is not kept.
+
+    Args:
+        model_name (str): The name of the model.
+        cache_name (str): The context cache of the requests, if any.
+        **kwargs: The other arguments of `GeminiModel`, e.g. the temperature.
+
+    Returns:
+        GeminiModel: The model, created on first use.
+    """
+    key = (model_name, repr(sorted(kwargs.items())))
+    with gemini_models_lock:
+        if key not in gemini_models:
+            gemini_models[key] = GeminiModel(model_name=model_name, **kwargs)
+        model = gemini_models[key]
+    if cache_name is None:
+        return model
+    model = copy.copy(model)
+    model.cache_name = cache_name
+    return model
@@ -14,7 +14,11 @@
 
 """Query Plan (QP) prompt template."""
 
-QP_PROMPT_TEMPLATE = """
+# The prompt is split into a static prefix, which is the same for every question
+# of a dataset and is stored in a context cache, and the question suffix. The
+# suffix holds the few-shot examples most relevant to the question, which are
+# selected from the examples library by `few_shot.select_examples`.
+QP_PROMPT_PREFIX = """
 You are an experienced database expert.
 Now you need to generate a GoogleSQL or BigQuery query given the database information, a question and some additional information.
 The database structure is defined by table schemas (some columns provide additional column descriptions in the options).
@@ -69,9 +73,16 @@ Database admin instructions (please *unconditionally* follow these instructions.
 15. **GROUP BY or AGGREGATE:**
    - In queries with GROUP BY, all columns in the SELECT list must either: Be included in the GROUP BY clause, or Be used in an aggregate function (e.g., MAX, MIN, AVG, COUNT, SUM).
 
-Here are some examples
-===========
-Example 1
+16. **Partitioned Tables:**
+   - If a table is created with `PARTITION BY <column>`, filter on that column whenever the question restricts the time range. Tables with `require_partition_filter=TRUE` must always be filtered on their partition column.
+
+**************************
+【Table creation statements】
+{SCHEMA}
+"""
+
+QP_EXAMPLES = (
+    """Example 1
 
 **************************
 【Table creation statements】
@@ -136,8 +147,8 @@ SELECT COUNT(T1.id_restaurant)
  WHERE T1.food_type = 'thai' AND T1.city = 'albany' AND T2.street_name = 'san pablo ave'
 ```
 
-===========
-Example 2
+""",
+    """Example 2
 
 **************************
 【Database Info】
@@ -210,8 +221,8 @@ SELECT `T1`.`gender`
  ORDER BY `T2`.`A11` ASC, `T1`.`birth_date` DESC NULLS LAST
  LIMIT 1
 ```
-===========
-Example 3 (dividing into two parallel sub-questions)
+""",
+    """Example 3 (dividing into two parallel sub-questions)
 
 **************************
 【Database Info】
@@ -282,8 +293,8 @@ SELECT COUNT(T3.id)
  BETWEEN 1900 AND 1992
 ```
 
-===========
-Example 4
+""",
+    """Example 4
 
 **************************
 【Database Info】
@@ -330,8 +341,8 @@ Repeating the question and generating the SQL with Recursive Divide-and-Conquer.
 SELECT COUNT(*) FROM {BQ_PROJECT_ID}.retails.employees WHERE salary > 100000;
 ```
 
-===========
-Example 6
+""",
+    """Example 6
 
 **************************
 【Database Info】
@@ -399,8 +410,8 @@ SELECT COUNT(FL_DATE)
    WHERE T3.Description = 'Los Angeles, CA: Los Angeles International' )
 ```
 
-===========
-Example 7
+""",
+    """Example 7
 
 **************************
 【Database Info】
@@ -474,8 +485,8 @@ SELECT DISTINCT T4.name
  GROUP BY T4.name, DATE_SUB(DATE(CONCAT(T4.years, '-01-01')), INTERVAL (T4.rowNumber - 1) YEAR) HAVING COUNT(T4.years) = 4
 ```
 
-===========
-Example 8
+""",
+    """Example 8
 
 **************************
 【Database Info】
@@ -556,13 +567,16 @@ ORDER BY
 LIMIT 1;
 ```
 
+""",
+)
+
+QP_QUESTION_TEMPLATE = """
+Here are some examples
+{EXAMPLES}===========
 Now is the real question, following the instruction and examples, generate the GoogleSQL with Recursive Divide-and-Conquer approach.
+The database of the real question is defined by the table creation statements before the examples.
 Follow all steps from the strategy. When you get to the final query, output the query string ONLY in the format ```sql ... ```. Make sure you only output one single query.
 
-**************************
-【Table creation statements】
-{SCHEMA}
-
 **************************
 【Question】
 Question:
@@ -572,3 +586,5 @@ Question:
 【Answer】
 Repeating the question and generating the SQL with Recursive Divide-and-Conquer.
 """
+
+QP_PROMPT_TEMPLATE = QP_PROMPT_PREFIX + QP_QUESTION_TEMPLATE
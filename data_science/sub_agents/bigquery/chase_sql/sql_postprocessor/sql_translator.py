@@ -21,7 +21,10 @@ import regex
 import sqlglot
 import sqlglot.optimizer
 
-from ..llm_utils import GeminiModel  # pylint: disable=g-importing-member
+from ..llm_utils import (  # pylint: disable=g-importing-member
+    GeminiModel,
+    get_gemini_model,
+)
 from .correction_prompt_template import (
     CORRECTION_PROMPT_TEMPLATE_V1_0,
 )  # pylint: disable=g-importing-member
@@ -133,7 +136,7 @@ class SqlTranslator:
         self._tool_output_errors: str | None = None
         self._temperature: float = temperature
         if isinstance(model, str):
-            self._model = GeminiModel(model_name=model, temperature=self._temperature)
+            self._model = get_gemini_model(model, temperature=self._temperature)
         else:
             self._model = model
 
@@ -158,15 +161,18 @@ class SqlTranslator:
         """Extracts the schema from a single DDL statement."""
         # Split the DDL statement into table name and columns.
         # Match the following pattern:
-        # CREATE [OR REPLACE] TABLE [`]<table_name>[`] (<all_columns>);
+        # CREATE [OR REPLACE] TABLE [`]<table_name>[`] (<all_columns>)
+        # [PARTITION BY ...] [CLUSTER BY ...] [OPTIONS(...)];
         splitter_pattern = (
             # CREATE [OR REPLACE] TABLE
             r"^\s*CREATE\s+(?:OR\s+REPLACE\s+)?TABLE\s+"
             # Match the table name, optionally surrounded by backticks.
             r"(?:`)?(?P<table_name>[\w\d\-\_\.]+)(?:`)?\s*"
-            # Match the column name as everything between the first and last
-            # parentheses followed by a semicolon.
-            r"\((?P<all_columns>.*)\);$"
+            # Match the column name as everything between the first parenthesis
+            # and the parenthesis followed by the table options (if any) and a
+            # semicolon.
+            r"\((?P<all_columns>.*?)\)\s*"
+            r"(?:(?:PARTITION\s+BY|CLUSTER\s+BY|OPTIONS)\b[^;]*)?;$"
         )
         split_match = regex.search(
             splitter_pattern,
@@ -328,7 +334,10 @@ class SqlTranslator:
                 error_level=sqlglot.ErrorLevel.IMMEDIATE,
             )
             # Then add the database and catalog information for each table to the AST.
+            # Temp tables of a BigQuery session are left as they are.
             for table in sql_query_ast.find_all(sqlglot.exp.Table):
+                if table.db.upper() == "_SESSION":
+                    continue
                 table.set("catalog", sqlglot.exp.Identifier(this=catalog, quoted=True))
                 table.set("db", sqlglot.exp.Identifier(this=db, quoted=True))
             # Then, try to optimize the SQL query.
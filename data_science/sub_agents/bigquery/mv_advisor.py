@@ -0,0 +1,316 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Materialized view advisor for the database agent.
+
+Reads the queries the agent ran from `INFORMATION_SCHEMA.JOBS`, clusters them
+by their aggregation shape and proposes one materialized view per frequent
+cluster. The proposals can be created right away:
+
+    python -m data_science.sub_agents.bigquery.mv_advisor --days=7 --create
+
+The definition of a created view is stored as JSON in its description, so
+`load_materialized_views` finds it again and the agent routes matching queries
+to it with `sql_rewriter.route_to_aggregate_table`.
+"""
+
+import json
+import logging
+import os
+from collections import Counter
+
+from absl import app, flags
+from google.cloud import bigquery
+
+from . import sql_rewriter
+
+# Labels of the query jobs of the agent, used to find them in the job history.
+QUERY_JOB_LABELS = {"source": "data_science_agent"}
+
+# Key of the view definition in the description of a materialized view.
+DEFINITION_KEY = "aggregate_table"
+
+HISTORY_QUERY = """
+SELECT query
+FROM `{project_id}.region-{region}`.INFORMATION_SCHEMA.JOBS
+WHERE creation_time >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @days DAY)
+  AND job_type = 'QUERY'
+  AND statement_type = 'SELECT'
+  AND state = 'DONE'
+  AND error_result IS NULL
+  AND EXISTS (
+    SELECT 1 FROM UNNEST(labels) AS label
+    WHERE label.key = @label_key AND label.value = @label_value
+  )
+ORDER BY creation_time DESC
+LIMIT @max_queries
+"""
+
+
+def read_query_history(
+    client: bigquery.Client,
+    project_id: str,
+    dataset_id: str,
+    days: int = 7,
+    max_queries: int = 10000,
+) -> list[str]:
+    """Reads the SQL of the successful queries the agent ran recently.
+
+    Args:
+        client (bigquery.Client): A BigQuery client.
+        project_id (str): The project the queries ran in.
+        dataset_id (str): The dataset of the agent, whose location determines
+          the region of the job history.
+        days (int): How many days of history to read.
+        max_queries (int): The maximum number of queries to read.
+
+    Returns:
+        list[str]: The SQL of the queries, most recent first.
+    """
+    dataset = client.get_dataset(bigquery.DatasetReference(project_id, dataset_id))
+    [(label_key, label_value)] = QUERY_JOB_LABELS.items()
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("days", "INT64", days),
+            bigquery.ScalarQueryParameter("label_key", "STRING", label_key),
+            bigquery.ScalarQueryParameter("label_value", "STRING", label_value),
+            bigquery.ScalarQueryParameter("max_queries", "INT64", max_queries),
+        ]
+    )
+    query = HISTORY_QUERY.format(
+        project_id=project_id, region=dataset.location.lower()
+    )
+    rows = client.query(query, job_config=job_config).result()
+    return [row["query"] for row in rows]
+
+
+def load_materialized_views(
+    client: bigquery.Client, project_id: str, dataset_id: str
+) -> list[dict]:
+    """Loads the definitions of the materialized views created by the advisor.
+
+    Args:
+        client (bigquery.Client): A BigQuery client.
+        project_id (str): The ID of your Google Cloud Project.
+        dataset_id (str): The ID of the BigQuery dataset.
+
+    Returns:
+        list[dict]: The definitions, in the format expected by
+        `sql_rewriter.route_to_aggregate_table`.
+    """
+    dataset_ref = bigquery.DatasetReference(project_id, dataset_id)
+    views = []
+    for table in client.list_tables(dataset_ref):
+        if table.table_type != "MATERIALIZED_VIEW":
+            continue
+        table_obj = client.get_table(dataset_ref.table(table.table_id))
+        try:
+            definition = json.loads(table_obj.description or "")[DEFINITION_KEY]
+        except (ValueError, TypeError, KeyError):
+            continue
+        views.append(
+            {
+                "name": str(table_obj.reference),
+                **definition,
+                "num_rows": table_obj.num_rows,
+            }
+        )
+    return views
+
+
+def _view_name(shape_table: str, dimensions: list[str]) -> str:
+    """Returns the name of a view, e.g. mv_train_by_country_date."""
+    table_id = shape_table.split(".")[-1]
+    if not dimensions:
+        return f"mv_{table_id}_total"
+    return f"mv_{table_id}_by_{'_'.join(dimensions)}"
+
+
+def propose_materialized_views(
+    queries: list[str],
+    min_queries: int = 3,
+    existing_views: list[dict] | None = None,
+) -> list[dict]:
+    """Proposes materialized views for the frequent rollups among the queries.
+
+    The queries are fingerprinted by `sql_rewriter.aggregation_shape`. Shapes
+    over the same table are clustered greedily, from the most to the least
+    detailed: a shape joins the first cluster whose dimensions include its own
+    GROUP BY and filter columns, so one view answers all of its rollups. Each
+    cluster with at least `min_queries` queries becomes a proposal. Queries
+    that an existing view already answers are skipped.
+
+    Args:
+        queries (list[str]): The SQL of the queries.
+        min_queries (int): The minimum number of queries a view must answer.
+        existing_views (list[dict]): The views that already exist.
+
+    Returns:
+        list[dict]: The proposals, most frequent first, each with the `name`
+        and base `table` of the view, its `dimensions` and `measures`, the
+        number of queries it answers (`query_count`) and its `sql`.
+    """
+    existing_views = existing_views or []
+    shapes = Counter()
+    for query in queries:
+        routed_query, _ = sql_rewriter.route_to_aggregate_table(query, existing_views)
+        if routed_query != query:
+            continue
+        shape = sql_rewriter.aggregation_shape(query)
+        if shape is None:
+            continue
+        dimensions = tuple(sorted(set(shape["dimensions"]) | set(shape["filter_columns"])))
+        shapes[(shape["table"], dimensions, tuple(shape["aggregates"]))] += 1
+
+    clusters = []
+    for (table, dimensions, aggregates), count in sorted(
+        shapes.items(), key=lambda item: (-len(item[0][1]), -item[1])
+    ):
+        for cluster in clusters:
+            if cluster["table"] == table and set(dimensions) <= cluster["dimensions"]:
+                break
+        else:
+            cluster = {
+                "table": table,
+                "dimensions": set(dimensions),
+                "aggregates": set(),
+                "query_count": 0,
+            }
+            clusters.append(cluster)
+        cluster["aggregates"].update(aggregates)
+        cluster["query_count"] += count
+
+    proposals = []
+    for cluster in sorted(clusters, key=lambda cluster: -cluster["query_count"]):
+        if cluster["query_count"] < min_queries:
+            continue
+        dimensions = sorted(cluster["dimensions"])
+        measures = sql_rewriter.required_measures(sorted(cluster["aggregates"]))
+        proposals.append(
+            {
+                "name": _view_name(cluster["table"], dimensions),
+                "table": cluster["table"],
+                "dimensions": dimensions,
+                "measures": measures,
+                "query_count": cluster["query_count"],
+                "sql": sql_rewriter.aggregate_table_sql(
+                    cluster["table"], dimensions, measures
+                ),
+            }
+        )
+    return proposals
+
+
+def create_materialized_view(
+    client: bigquery.Client,
+    project_id: str,
+    dataset_id: str,
+    proposal: dict,
+    table_metadata: dict | None = None,
+) -> str:
+    """Creates the materialized view of a proposal, if it does not exist yet.
+
+    The view is partitioned like its base table if it keeps the partition
+    column, and clustered by up to four of its other dimensions.
+
+    Args:
+        client (bigquery.Client): A BigQuery client.
+        project_id (str): The ID of your Google Cloud Project.
+        dataset_id (str): The ID of the BigQuery dataset of the view.
+        proposal (dict): A proposal of `propose_materialized_views`.
+        table_metadata (dict): The partitioning metadata of the base tables,
+          see `tools.get_bigquery_table_metadata`.
+
+    Returns:
+        str: The qualified name of the view.
+    """
+    name = f"{project_id}.{dataset_id}.{proposal['name']}"
+    definition = {
+        "table": proposal["table"],
+        "dimensions": proposal["dimensions"],
+        "measures": proposal["measures"],
+    }
+    description = json.dumps({DEFINITION_KEY: definition}).replace("'", "\\'")
+
+    metadata = (table_metadata or {}).get(proposal["table"]) or {}
+    partition_column = metadata.get("partition_column")
+    clauses = ""
+    clustering_fields = proposal["dimensions"]
+    if partition_column in proposal["dimensions"] and metadata.get(
+        "partition_column_type"
+    ) == "DATE":
+        clauses += f"PARTITION BY `{partition_column}`\n"
+        clustering_fields = [d for d in clustering_fields if d != partition_column]
+    if clustering_fields:
+        clauses += (
+            "CLUSTER BY "
+            + ", ".join(f"`{field}`" for field in clustering_fields[:4])
+            + "\n"
+        )
+
+    ddl = (
+        f"CREATE MATERIALIZED VIEW IF NOT EXISTS `{name}`\n"
+        f"{clauses}"
+        f"OPTIONS(enable_refresh = TRUE, description = '{description}')\n"
+        f"AS {proposal['sql']}"
+    )
+    logging.info("Creating materialized view: %s", ddl)
+    client.query(ddl).result()
+    return name
+
+
+FLAGS = flags.FLAGS
+
+
+def main(argv: list[str]) -> None:  # pylint: disable=unused-argument
+    """Prints, and optionally creates, the proposed materialized views."""
+    # Imported here, as the tools module sets up the LLM clients of the agent.
+    from .tools import get_bigquery_table_metadata  # pylint: disable=import-outside-toplevel
+
+    project_id = os.getenv("BQ_PROJECT_ID")
+    dataset_id = os.getenv("BQ_DATASET_ID")
+    if not project_id or not dataset_id:
+        raise ValueError("BQ_PROJECT_ID and BQ_DATASET_ID must be set.")
+    client = bigquery.Client(project=project_id)
+
+    queries = read_query_history(client, project_id, dataset_id, days=FLAGS.days)
+    print(f"Read {len(queries)} queries.")
+    proposals = propose_materialized_views(
+        queries,
+        min_queries=FLAGS.min_queries,
+        existing_views=load_materialized_views(client, project_id, dataset_id),
+    )
+    if not proposals:
+        print("No materialized views to propose.")
+        return
+    table_metadata = get_bigquery_table_metadata(dataset_id, client, project_id)
+    for proposal in proposals:
+        print(
+            f"\n{proposal['name']} answers {proposal['query_count']} queries:\n"
+            f"{proposal['sql']}"
+        )
+        if FLAGS.create:
+            name = create_materialized_view(
+                client, project_id, dataset_id, proposal, table_metadata
+            )
+            print(f"Created {name}.")
+
+
+if __name__ == "__main__":
+    # The flags are only defined when run as a script, as the agent imports
+    # this module next to other modules with flags.
+    flags.DEFINE_integer("days", 7, "Days of query history to analyze.")
+    flags.DEFINE_integer("min_queries", 3, "Minimum number of queries per view.")
+    flags.DEFINE_bool("create", False, "Create the proposed materialized views.")
+    app.run(main)
@@ -38,10 +38,14 @@ def return_instructions_bigquery() -> str:
       Use the provided tools to help generate the most accurate SQL:
       1. First, use {db_tool_name} tool to generate initial SQL from the question.
       2. You should also validate the SQL you have created for syntax and function errors (Use run_bigquery_validation tool). If there are any errors, you should go back and address the error in the SQL. Recreate the SQL based by addressing the error.
-      4. Generate the final result in JSON format with four keys: "explain", "sql", "sql_results", "nl_results".
+      3. If answering the question needs several independent queries (e.g. totals by country, by product and by month), generate all of them first and then run them together with the run_bigquery_batch tool instead of calling run_bigquery_validation once per query.
+      4. If you need more rows of a result than run_bigquery_validation returned, use the fetch_more_rows tool with the handle of its result_handle and the offset of the next row. Do NOT regenerate or re-run the SQL to get more rows.
+      5. If the user is likely to ask follow-up questions about a result (e.g. filtering it further or breaking it down), materialize the intermediate result with the create_temp_table tool. Follow-up questions are then answered from `_SESSION.<table_name>` instead of re-scanning the base tables.
+      6. If the user only explores the data (e.g. "roughly how many customers", "show me some rows", "what is the typical order size") and exact numbers are not needed, run the SQL with the run_bigquery_exploration tool instead of run_bigquery_validation. Its results can be approximate or sampled: if `approximate` is true, say so in nl_results.
+      7. Generate the final result in JSON format with four keys: "explain", "sql", "sql_results", "nl_results".
           "explain": "write out step-by-step reasoning to explain how you are generating the query based on the schema, example, and question.",
           "sql": "Output your generated SQL!",
-          "sql_results": "raw sql execution query_result from run_bigquery_validation if it's available, otherwise None",
+          "sql_results": "raw sql execution query_result from run_bigquery_validation (or run_bigquery_batch or run_bigquery_exploration) if it's available, otherwise None",
           "nl_results": "Natural language about results, otherwise it's None if generated SQL is invalid"
       ```
       You should pass one tool call to another tool call as needed!
@@ -0,0 +1,186 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pre-aggregated rollup tables of the database agent.
+
+Rollups are declared in `ROLLUP_DEFINITIONS`, materialized as tables next to
+their base table and refreshed incrementally after new data is loaded:
+
+    python -m data_science.sub_agents.bigquery.rollups
+
+The agent routes rollup queries that a rollup answers to the smallest such
+table with `sql_rewriter.route_to_aggregate_table`, like the materialized views
+of the `mv_advisor`.
+"""
+
+import datetime
+import logging
+import os
+
+from absl import app
+from google.api_core import exceptions
+from google.cloud import bigquery
+
+from . import sql_rewriter
+
+# The measures of the sales rollups.
+SALES_MEASURES = ["SUM(num_sold)", "AVG(num_sold)", "MIN(num_sold)", "MAX(num_sold)"]
+
+# The rollups, each with the `name` of its table, its base `table` in the
+# dataset of the agent, the `dimensions` it is grouped by and the aggregated
+# `measures`. A rollup with an `incremental_column` (a DATE dimension) is
+# partitioned by it and refreshed from the last `lookback_days` days on, so
+# late-arriving rows are picked up. Other rollups are rebuilt on every refresh.
+ROLLUP_DEFINITIONS = (
+    {
+        "name": "rollup_train_daily_by_store",
+        "table": "train",
+        "dimensions": ["date", "country", "store"],
+        "measures": SALES_MEASURES,
+        "incremental_column": "date",
+        "lookback_days": 3,
+    },
+    {
+        "name": "rollup_train_daily_by_country",
+        "table": "train",
+        "dimensions": ["date", "country"],
+        "measures": SALES_MEASURES,
+        "incremental_column": "date",
+        "lookback_days": 3,
+    },
+    {
+        "name": "rollup_train_totals",
+        "table": "train",
+        "dimensions": ["country", "store", "product"],
+        "measures": SALES_MEASURES,
+    },
+)
+
+
+def _qualify(project_id: str, dataset_id: str, definition: dict) -> dict:
+    """Returns the definition with qualified names and all required measures."""
+    return {
+        **definition,
+        "name": f"{project_id}.{dataset_id}.{definition['name']}",
+        "table": f"{project_id}.{dataset_id}.{definition['table']}",
+        "measures": sql_rewriter.required_measures(definition["measures"]),
+    }
+
+
+def _incremental_refresh_script(definition: dict, watermark) -> str:
+    """Returns the script replacing the rollup rows from the watermark on."""
+    column = definition["incremental_column"]
+    query = sql_rewriter.aggregate_table_sql(
+        definition["table"], definition["dimensions"], definition["measures"]
+    )
+    ast = sql_rewriter.parse_sql(query)
+    ast.where(
+        f"`{column}` >= DATE '{watermark.isoformat()}'",
+        dialect=sql_rewriter.DIALECT,
+        copy=False,
+    )
+    columns = definition["dimensions"] + [
+        sql_rewriter.measure_column_name(measure) for measure in definition["measures"]
+    ]
+    return (
+        "BEGIN TRANSACTION;\n"
+        f"DELETE FROM `{definition['name']}`"
+        f" WHERE `{column}` >= DATE '{watermark.isoformat()}';\n"
+        f"INSERT INTO `{definition['name']}` ({', '.join(f'`{c}`' for c in columns)})\n"
+        f"{ast.sql(dialect=sql_rewriter.DIALECT, pretty=True)};\n"
+        "COMMIT TRANSACTION;"
+    )
+
+
+def refresh_rollup(client: bigquery.Client, definition: dict) -> None:
+    """Materializes a rollup, or refreshes it incrementally if it exists.
+
+    Args:
+        client (bigquery.Client): A BigQuery client.
+        definition (dict): A rollup definition with qualified names.
+    """
+    query = sql_rewriter.aggregate_table_sql(
+        definition["table"], definition["dimensions"], definition["measures"]
+    )
+    column = definition.get("incremental_column")
+    try:
+        client.get_table(definition["name"])
+        exists = True
+    except exceptions.NotFound:
+        exists = False
+
+    if exists and column:
+        rows = client.query(
+            f"SELECT MAX(`{column}`) AS watermark FROM `{definition['name']}`"
+        ).result()
+        watermark = next(iter(rows))["watermark"]
+        if watermark is not None:
+            watermark -= datetime.timedelta(days=definition.get("lookback_days", 0))
+            script = _incremental_refresh_script(definition, watermark)
+            logging.info("Refreshing rollup %s: %s", definition["name"], script)
+            client.query(script).result()
+            return
+
+    clustering_fields = [d for d in definition["dimensions"] if d != column][:4]
+    ddl = f"CREATE OR REPLACE TABLE `{definition['name']}`\n"
+    if column:
+        ddl += f"PARTITION BY `{column}`\n"
+    if clustering_fields:
+        ddl += f"CLUSTER BY {', '.join(f'`{f}`' for f in clustering_fields)}\n"
+    ddl += f"AS {query}"
+    logging.info("Materializing rollup %s: %s", definition["name"], ddl)
+    client.query(ddl).result()
+
+
+def load_rollups(
+    client: bigquery.Client, project_id: str, dataset_id: str
+) -> list[dict]:
+    """Loads the definitions of the rollups that are materialized.
+
+    Args:
+        client (bigquery.Client): A BigQuery client.
+        project_id (str): The ID of your Google Cloud Project.
+        dataset_id (str): The ID of the BigQuery dataset.
+
+    Returns:
+        list[dict]: The definitions, with the number of rows of the rollup in
+        `num_rows`, in the format expected by
+        `sql_rewriter.route_to_aggregate_table`.
+    """
+    rollups = []
+    for definition in ROLLUP_DEFINITIONS:
+        definition = _qualify(project_id, dataset_id, definition)
+        try:
+            table_obj = client.get_table(definition["name"])
+        except exceptions.NotFound:
+            continue
+        rollups.append({**definition, "num_rows": table_obj.num_rows})
+    return rollups
+
+
+def main(argv: list[str]) -> None:  # pylint: disable=unused-argument
+    """Materializes or refreshes all rollups."""
+    project_id = os.getenv("BQ_PROJECT_ID")
+    dataset_id = os.getenv("BQ_DATASET_ID")
+    if not project_id or not dataset_id:
+        raise ValueError("BQ_PROJECT_ID and BQ_DATASET_ID must be set.")
+    client = bigquery.Client(project=project_id)
+    for definition in ROLLUP_DEFINITIONS:
+        definition = _qualify(project_id, dataset_id, definition)
+        print(f"Refreshing {definition['name']}.")
+        refresh_rollup(client, definition)
+
+
+if __name__ == "__main__":
+    app.run(main)
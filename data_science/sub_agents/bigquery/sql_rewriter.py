@@ -0,0 +1,895 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rewrites of the SQL generated by the database agent before it runs.
+
+All rewrites work on the SQLGlot AST of a single BigQuery statement. If the
+SQL cannot be parsed, it is returned unchanged and BigQuery reports the error.
+"""
+
+import logging
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.optimizer.pushdown_projections import pushdown_projections
+from sqlglot.optimizer.qualify import qualify
+from sqlglot.optimizer.qualify_columns import quote_identifiers
+from sqlglot.optimizer.scope import traverse_scope
+
+DIALECT = "bigquery"
+
+# The pseudo-columns of ingestion-time partitioned tables. BigQuery does not
+# resolve them if they are quoted.
+PARTITION_PSEUDO_COLUMNS = ("_PARTITIONTIME", "_PARTITIONDATE")
+
+
+def parse_sql(sql_string: str) -> exp.Expression | None:
+    """Parses a single BigQuery statement, or returns None if that fails."""
+    try:
+        expressions = sqlglot.parse(sql_string, read=DIALECT)
+    except sqlglot.errors.SqlglotError as e:
+        logging.info("Could not parse SQL for rewriting: %s", e)
+        return None
+    expressions = [
+        e for e in expressions if e is not None and not isinstance(e, exp.Semicolon)
+    ]
+    if len(expressions) != 1:
+        return None
+    return expressions[0]
+
+
+def _unquote_pseudo_columns(ast: exp.Expression) -> None:
+    """Unquotes the partition pseudo-columns, e.g. `_PARTITIONTIME`."""
+    for column in ast.find_all(exp.Column):
+        if column.name.upper() in PARTITION_PSEUDO_COLUMNS:
+            column.this.set("quoted", False)
+
+
+def _canonicalize_table_names(ast: exp.Expression) -> None:
+    """Quotes qualified table names as a whole, e.g. `project.dataset.table`."""
+    for table in ast.find_all(exp.Table):
+        if table.args.get("db") is not None:
+            table.meta["quoted_table"] = True
+
+
+def _canonicalize_table_aliases(ast: exp.Expression) -> None:
+    """Renames the aliases of tables and subqueries to t0, t1, ...
+
+    Aliases are case-insensitive in BigQuery and only visible inside the query,
+    so renaming them does not change the result. The rewrite is skipped if the
+    new names could clash with other identifiers, or if an alias is used as a
+    value (e.g. `SELECT t FROM table AS t`).
+    """
+    aliases = [
+        table_alias
+        for table_alias in ast.find_all(exp.TableAlias, bfs=False)
+        if isinstance(table_alias.parent, (exp.Table, exp.Subquery))
+        and table_alias.name
+    ]
+    mapping = {}
+    for table_alias in aliases:
+        mapping.setdefault(table_alias.name.lower(), f"t{len(mapping)}")
+    if not mapping:
+        return
+
+    alias_identifiers = {id(table_alias.this) for table_alias in aliases}
+    qualifier_identifiers = set()
+    for column in ast.find_all(exp.Column):
+        if column.args.get("table") is not None:
+            qualifier_identifiers.add(id(column.args["table"]))
+    for identifier in ast.find_all(exp.Identifier):
+        if id(identifier) in alias_identifiers:
+            continue
+        if id(identifier) in qualifier_identifiers:
+            continue
+        name = identifier.name.lower()
+        if name in mapping.values():
+            return
+        if name in mapping and isinstance(identifier.parent, exp.Column):
+            return
+
+    for table_alias in aliases:
+        table_alias.set(
+            "this",
+            exp.Identifier(this=mapping[table_alias.name.lower()], quoted=True),
+        )
+    for column in ast.find_all(exp.Column):
+        qualifier = column.args.get("table")
+        if qualifier is not None and qualifier.name.lower() in mapping:
+            column.set(
+                "table",
+                exp.Identifier(this=mapping[qualifier.name.lower()], quoted=True),
+            )
+
+
+def canonicalize_sql(sql_string: str) -> str:
+    """Rewrites the SQL into a canonical form without changing its semantics.
+
+    BigQuery only serves a query from its result cache if the query text is
+    byte-identical to a previous one. Generated SQL varies in whitespace,
+    keyword and function casing, quoting, table aliases and comments from turn
+    to turn, so all of these are normalized.
+
+    Args:
+        sql_string (str): The SQL query.
+
+    Returns:
+        str: The canonical SQL query, or the input if it cannot be parsed.
+    """
+    ast = parse_sql(sql_string)
+    if ast is None:
+        return sql_string
+    _canonicalize_table_names(ast)
+    _canonicalize_table_aliases(ast)
+    ast = quote_identifiers(ast, dialect=DIALECT, identify=True)
+    _unquote_pseudo_columns(ast)
+    return ast.sql(
+        dialect=DIALECT,
+        pretty=True,
+        normalize_functions="upper",
+        comments=False,
+    )
+
+
+def group_equivalent_queries(sql_strings: list[str]) -> list[tuple[str, int]]:
+    """Groups queries which only differ in formatting, aliases or comments.
+
+    Args:
+        sql_strings (list[str]): The SQL queries, e.g. generated candidates.
+
+    Returns:
+        list[tuple[str, int]]: The first query of each group with the size of
+        the group, in the order of the queries. Strings which do not parse to
+        a query, e.g. error messages, are dropped.
+    """
+    groups = {}
+    for sql_string in sql_strings:
+        ast = parse_sql(sql_string) if sql_string else None
+        if ast is None or not isinstance(ast, exp.Query):
+            continue
+        canonical_sql = canonicalize_sql(sql_string)
+        first_sql, count = groups.get(canonical_sql, (sql_string, 0))
+        groups[canonical_sql] = (first_sql, count + 1)
+    return list(groups.values())
+
+
+def _restore_output_names(
+    original_ast: exp.Expression, rewritten_ast: exp.Expression
+) -> None:
+    """Restores the names of the output columns after qualification.
+
+    Qualification normalizes identifiers to lower case, which would change the
+    column names of the result. Stars are expanded to the names of the schema.
+    """
+    original_select = original_ast
+    rewritten_select = rewritten_ast
+    while isinstance(original_select, exp.SetOperation):
+        original_select = original_select.left
+    while isinstance(rewritten_select, exp.SetOperation):
+        rewritten_select = rewritten_select.left
+    if not isinstance(original_select, exp.Select) or not isinstance(
+        rewritten_select, exp.Select
+    ):
+        return
+    original_projections = original_select.expressions
+    rewritten_projections = rewritten_select.expressions
+    if len(original_projections) != len(rewritten_projections):
+        return
+    for index, (original, rewritten) in enumerate(
+        zip(original_projections, rewritten_projections)
+    ):
+        name = original.alias_or_name
+        if name and name != "*" and name != rewritten.alias_or_name:
+            rewritten_projections[index] = exp.alias_(
+                rewritten.unalias(), name, quoted=True
+            )
+
+
+def prune_columns(sql_string: str, schema: dict | None) -> str:
+    """Expands `SELECT *` and prunes the columns the final projection ignores.
+
+    The bytes scanned by BigQuery scale with the columns a query references.
+    Stars are expanded with the columns of the schema, and the columns of CTEs
+    and subqueries that are not needed by the outer query are dropped.
+
+    Args:
+        sql_string (str): The SQL query.
+        schema (dict): The schema in SQLGlot format, see
+          `SqlTranslator.rewrite_schema_for_sqlglot`.
+
+    Returns:
+        str: The rewritten SQL query, or the input if it cannot be rewritten or
+        the rewrite reads the same columns of the tables.
+    """
+    ast = parse_sql(sql_string)
+    if ast is None or not schema:
+        return sql_string
+    try:
+        # Quoted identifiers keep their case in the rewritten query.
+        rewritten_ast = quote_identifiers(ast.copy(), dialect=DIALECT, identify=True)
+        rewritten_ast = qualify(
+            rewritten_ast,
+            dialect=DIALECT,
+            schema=schema,
+            quote_identifiers=False,
+        )
+        columns_before = _table_columns(rewritten_ast)
+        rewritten_ast = pushdown_projections(
+            rewritten_ast, schema=schema, dialect=DIALECT
+        )
+        if _table_columns(rewritten_ast) >= columns_before:
+            # Nothing is pruned, the rewrite would scan the same bytes.
+            return sql_string
+    except sqlglot.errors.SqlglotError as e:
+        logging.info("Could not prune the columns of the SQL: %s", e)
+        return sql_string
+    _restore_output_names(ast, rewritten_ast)
+    _unquote_pseudo_columns(rewritten_ast)
+    return rewritten_ast.sql(dialect=DIALECT, pretty=True)
+
+
+def _table_columns(ast: exp.Expression) -> set[tuple[str, str]]:
+    """Returns the (table, column) pairs a qualified query reads from tables."""
+    columns = set()
+    for scope in traverse_scope(ast):
+        for column in scope.columns:
+            source = scope.sources.get(column.table)
+            if isinstance(source, exp.Table):
+                columns.add((_table_name(source), column.name))
+    return columns
+
+
+def _schema_table_names(schema: dict) -> set[str]:
+    """Returns the qualified names of the tables of a SQLGlot schema."""
+    names = set()
+    for project_id, datasets in schema.items():
+        for dataset_id, tables in datasets.items():
+            for table_name in tables:
+                names.add(f"{project_id}.{dataset_id}.{table_name}")
+    return names
+
+
+def validate_sql(sql_string: str, schema: dict | None) -> bool:
+    """Checks that a query parses and only references the schema.
+
+    Tables and columns missing from the schema make the query invalid, except
+    for the temp tables of the session (`_SESSION.*`): their columns are not
+    checked, and neither are the unqualified columns of queries joining them.
+
+    Args:
+        sql_string (str): The SQL query.
+        schema (dict): The schema in SQLGlot format, see
+          `SqlTranslator.rewrite_schema_for_sqlglot`.
+
+    Returns:
+        bool: Whether the query is valid.
+    """
+    ast = parse_sql(sql_string)
+    if ast is None or not isinstance(ast, exp.Query):
+        return False
+    if not schema:
+        return True
+    table_names = _schema_table_names(schema)
+    cte_names = {cte.alias_or_name.lower() for cte in ast.find_all(exp.CTE)}
+    uses_session_tables = False
+    for table in ast.find_all(exp.Table):
+        name = _table_name(table)
+        if name.lower() in cte_names:
+            continue
+        if name.lower().startswith("_session."):
+            uses_session_tables = True
+        elif name not in table_names and not any(
+            table_name.endswith("." + name) for table_name in table_names
+        ):
+            logging.info("Invalid SQL: unknown table %s", name)
+            return False
+    try:
+        qualify(
+            ast.copy(),
+            dialect=DIALECT,
+            schema=schema,
+            validate_qualify_columns=not uses_session_tables,
+        )
+    except sqlglot.errors.SqlglotError as e:
+        logging.info("Invalid SQL: %s", e)
+        return False
+    return True
+
+
+def _table_name(table: exp.Table) -> str:
+    """Returns the qualified name of a table, e.g. project.dataset.table."""
+    return ".".join(part.name for part in table.parts)
+
+
+def _find_table_metadata(table: exp.Table, table_metadata: dict) -> dict | None:
+    """Returns the metadata of a table, also for partially qualified names."""
+    name = _table_name(table)
+    if name in table_metadata:
+        return table_metadata[name]
+    for qualified_name, metadata in table_metadata.items():
+        if qualified_name.endswith("." + name):
+            return metadata
+    return None
+
+
+def _partition_filter_condition(metadata: dict, days: int) -> exp.Expression | None:
+    """Builds a condition selecting the partitions of the last `days` days.
+
+    The days end at the latest partition of the table, not today, so that
+    tables of historical data are filtered too. The bound is a constant, as
+    BigQuery only prunes partitions with constant filters.
+    """
+    column = metadata["partition_column"]
+    column_type = metadata["partition_column_type"]
+    latest_partition = metadata.get("latest_partition")
+    if latest_partition is None:
+        return None
+    if column == "_PARTITIONTIME":
+        # Pseudo-columns of ingestion-time partitioned tables are not quoted.
+        column_sql = "_PARTITIONTIME"
+    else:
+        column_sql = f"`{column}`"
+    if column_type in ("DATE", "DATETIME", "TIMESTAMP"):
+        lower_bound = (
+            f"{column_type}_SUB({column_type} '{latest_partition}',"
+            f" INTERVAL {days} DAY)"
+        )
+    else:
+        # Integer-range partitioning has no natural date range.
+        return None
+    return sqlglot.condition(f"{column_sql} >= {lower_bound}", dialect=DIALECT)
+
+
+def check_partition_filters(
+    sql_string: str, table_metadata: dict, inject_days: int | None = None
+) -> tuple[str, list[dict]]:
+    """Finds scans of partitioned tables without a filter on the partition column.
+
+    Without such a filter BigQuery scans every partition of the table. A filter
+    anywhere in the query counts, since BigQuery pushes filters down into CTEs
+    and subqueries.
+
+    Args:
+        sql_string (str): The SQL query.
+        table_metadata (dict): The partitioning metadata per table, see
+          `tools.get_bigquery_table_metadata`.
+        inject_days (int): If set, every unfiltered scan of a time-partitioned
+          table with a known `latest_partition` is replaced by a subquery
+          selecting its last `inject_days` days of partitions. Filtering the
+          scan itself keeps the semantics of outer joins.
+
+    Returns:
+        tuple: The (possibly rewritten) SQL query and one finding per unfiltered
+        scan, with the `table`, its `partition_column`, a `message` and the
+        `injected_filter`, if any.
+    """
+    ast = parse_sql(sql_string)
+    if ast is None or not table_metadata:
+        return sql_string, []
+
+    filtered_columns = set()
+    conditions = list(ast.find_all(exp.Where))
+    conditions += [
+        join.args["on"] for join in ast.find_all(exp.Join) if join.args.get("on")
+    ]
+    for condition in conditions:
+        for column in condition.find_all(exp.Column):
+            filtered_columns.add(column.name.lower())
+    # The pseudo-columns of ingestion-time partitioned tables are not selected
+    # by the subquery of an injected filter.
+    pseudo_columns = any(
+        column.name.upper() in PARTITION_PSEUDO_COLUMNS
+        for column in ast.find_all(exp.Column)
+    )
+
+    findings = []
+    for table in list(ast.find_all(exp.Table)):
+        metadata = _find_table_metadata(table, table_metadata)
+        if metadata is None or metadata["partition_column"] is None:
+            continue
+        partition_columns = {metadata["partition_column"].lower()}
+        if metadata["partition_column"] == "_PARTITIONTIME":
+            partition_columns.add("_partitiondate")
+        if partition_columns & filtered_columns:
+            continue
+
+        finding = {
+            "table": _table_name(table),
+            "partition_column": metadata["partition_column"],
+            "message": (
+                f"The query scans all partitions of `{_table_name(table)}`. Add"
+                f" a filter on `{metadata['partition_column']}` to scan fewer"
+                " bytes."
+            ),
+            "injected_filter": None,
+        }
+        condition = (
+            _partition_filter_condition(metadata, inject_days)
+            if inject_days is not None
+            and isinstance(table.parent, (exp.From, exp.Join))
+            and not ("_partitiontime" in partition_columns and pseudo_columns)
+            else None
+        )
+        if condition is not None:
+            scan = table.copy()
+            scan.set("alias", None)
+            table.replace(
+                exp.select("*")
+                .from_(scan)
+                .where(condition)
+                .subquery(exp.to_identifier(table.alias_or_name, quoted=True))
+            )
+            finding["injected_filter"] = condition.sql(dialect=DIALECT)
+            finding["message"] = (
+                f"Only the last {inject_days} days of partitions of"
+                f" `{_table_name(table)}` up to {metadata['latest_partition']}"
+                " were scanned, since the query had no filter on"
+                f" `{metadata['partition_column']}`."
+            )
+        findings.append(finding)
+
+    if not any(finding["injected_filter"] for finding in findings):
+        return sql_string, findings
+    return ast.sql(dialect=DIALECT, pretty=True), findings
+
+
+def _approximate_count_distinct(ast: exp.Expression) -> list[str]:
+    """Rewrites COUNT(DISTINCT x) to APPROX_COUNT_DISTINCT(x)."""
+    approximations = []
+    for count in list(ast.find_all(exp.Count)):
+        distinct = count.this
+        if not isinstance(distinct, exp.Distinct):
+            continue
+        if len(distinct.expressions) != 1 or count.find_ancestor(exp.Window):
+            continue
+        approx = exp.ApproxDistinct(this=distinct.expressions[0].copy())
+        approximations.append(
+            f"{count.sql(dialect=DIALECT)} was approximated with"
+            f" {approx.sql(dialect=DIALECT)}."
+        )
+        count.replace(approx)
+    return approximations
+
+
+def _quantile_offset(quantile: exp.Expression) -> tuple[int, int] | None:
+    """Returns the number of buckets and offset of a quantile, e.g. (100, 50)."""
+    if not isinstance(quantile, exp.Literal) or quantile.is_string:
+        return None
+    value = float(quantile.this)
+    for buckets in (100, 1000):
+        offset = value * buckets
+        if 0 <= offset <= buckets and abs(offset - round(offset)) < 1e-9:
+            return buckets, round(offset)
+    return None
+
+
+def _approximate_quantiles(select: exp.Select) -> list[str]:
+    """Rewrites PERCENTILE_CONT/DISC window functions to APPROX_QUANTILES.
+
+    BigQuery only has analytic exact percentiles, which are typically written
+    as `SELECT DISTINCT k, PERCENTILE_CONT(x, 0.5) OVER (PARTITION BY k)`. Such
+    a query computes one row per partition, as does the aggregation with
+    APPROX_QUANTILES grouped by the partition keys, which is what the query is
+    rewritten to. Other shapes are left as they are.
+    """
+    windows = [
+        projection.unalias()
+        for projection in select.expressions
+        if isinstance(projection.unalias(), exp.Window)
+    ]
+    if not windows or select.args.get("group") or select.args.get("having"):
+        return []
+    partition_by = None
+    for window in windows:
+        if not isinstance(window.this, (exp.PercentileCont, exp.PercentileDisc)):
+            return []
+        if window.args.get("order") or window.args.get("spec"):
+            return []
+        if _quantile_offset(window.this.expression) is None:
+            return []
+        keys = [
+            key.sql(dialect=DIALECT) for key in window.args.get("partition_by") or []
+        ]
+        if partition_by is not None and keys != partition_by:
+            return []
+        partition_by = keys
+    for projection in select.expressions:
+        if not isinstance(projection.unalias(), exp.Window) and (
+            projection.unalias().sql(dialect=DIALECT) not in partition_by
+        ):
+            return []
+    limit = select.args.get("limit")
+    single_row = (
+        not partition_by
+        and isinstance(limit, exp.Limit)
+        and limit.expression.sql(dialect=DIALECT) == "1"
+    )
+    if not select.args.get("distinct") and not single_row:
+        return []
+
+    approximations = []
+    for window in windows:
+        buckets, offset = _quantile_offset(window.this.expression)
+        approx = sqlglot.parse_one(
+            f"APPROX_QUANTILES({window.this.this.sql(dialect=DIALECT)},"
+            f" {buckets})[OFFSET({offset})]",
+            read=DIALECT,
+        )
+        approximations.append(
+            f"{window.sql(dialect=DIALECT)} was approximated with"
+            f" {approx.sql(dialect=DIALECT)}."
+        )
+        window.replace(approx)
+    select.set("distinct", None)
+    if partition_by:
+        select.group_by(*partition_by, dialect=DIALECT, copy=False)
+    return approximations
+
+
+def _is_preview(select: exp.Select) -> bool:
+    """Checks if a SELECT only reads rows, without aggregating them."""
+    if select.args.get("group") or select.args.get("distinct"):
+        return False
+    for projection in select.expressions:
+        if projection.find(exp.AggFunc, exp.Window):
+            return False
+    return True
+
+
+def _is_sampleable(select: exp.Select) -> bool:
+    """Checks if the rows read by a SELECT can be sampled.
+
+    This is the case if the SELECT and every query above it, e.g. the query
+    reading its CTE or subquery, only preview rows. Top-N queries are never
+    sampled, as the largest rows of a sample are not the largest rows.
+    """
+    while select is not None:
+        if not _is_preview(select) or (
+            select.args.get("order") and select.args.get("limit")
+        ):
+            return False
+        select = select.find_ancestor(exp.Select)
+    return True
+
+
+def approximate_sql(
+    sql_string: str, sample_percent: int
+) -> tuple[str, list[str], list[str]]:
+    """Rewrites a query to its cheaper, approximate counterpart.
+
+    Used by the exploration mode of the database agent:
+    - COUNT(DISTINCT x) becomes APPROX_COUNT_DISTINCT(x).
+    - Exact percentiles become APPROX_QUANTILES.
+    - Queries that only preview the rows of a single base table read a
+      `TABLESAMPLE SYSTEM` sample of it. Aggregates over the preview, e.g. in
+      the query reading its CTE, top-N queries and joins are never sampled, as
+      sampling both sides of a join drops almost all matching rows.
+
+    Args:
+        sql_string (str): The SQL query.
+        sample_percent (int): The percentage of the table sampled by previews.
+
+    Returns:
+        tuple: The rewritten SQL query, a description of every approximation
+        and warnings about previews that could not be sampled. The SQL query
+        is unchanged if there are no approximations.
+    """
+    ast = parse_sql(sql_string)
+    if ast is None:
+        return sql_string, [], []
+
+    approximations = _approximate_count_distinct(ast)
+    for select in list(ast.find_all(exp.Select)):
+        approximations += _approximate_quantiles(select)
+
+    warnings = []
+    cte_names = {cte.alias_or_name.lower() for cte in ast.find_all(exp.CTE)}
+    base_tables = [
+        table
+        for table in ast.find_all(exp.Table)
+        if table.args.get("db")
+        and table.db.upper() != "_SESSION"
+        and table.name.lower() not in cte_names
+    ]
+    for table in base_tables:
+        select = table.find_ancestor(exp.Select)
+        if (
+            select is None
+            or table.args.get("sample")
+            or not isinstance(table.parent, (exp.From, exp.Join))
+            or not _is_sampleable(select)
+        ):
+            continue
+        if len(base_tables) > 1:
+            warnings.append(
+                f"The preview of `{_table_name(table)}` was not sampled, as the"
+                " query reads several tables."
+            )
+            continue
+        table.set(
+            "sample",
+            exp.TableSample(
+                method=exp.var("SYSTEM"),
+                percent=exp.Literal.number(sample_percent),
+            ),
+        )
+        approximations.append(
+            f"Only a {sample_percent}% sample of `{_table_name(table)}` was read."
+        )
+
+    if not approximations:
+        return sql_string, [], warnings
+    return ast.sql(dialect=DIALECT, pretty=True), approximations, warnings
+
+
+# Aggregates that can be re-aggregated from a coarser aggregate table.
+_ROUTABLE_AGGREGATES = {
+    exp.Sum: "SUM",
+    exp.Count: "COUNT",
+    exp.Min: "MIN",
+    exp.Max: "MAX",
+    exp.Avg: "AVG",
+}
+
+
+def _aggregate_key(aggregate: exp.Expression) -> str | None:
+    """Returns the key of an aggregate, e.g. SUM(num_sold) or COUNT(*)."""
+    name = _ROUTABLE_AGGREGATES.get(type(aggregate))
+    if name is None:
+        return None
+    argument = aggregate.this
+    if isinstance(aggregate, exp.Count) and isinstance(argument, exp.Star):
+        return "COUNT(*)"
+    if not isinstance(argument, exp.Column):
+        return None
+    return f"{name}({argument.name})"
+
+
+def measure_column_name(aggregate_key: str) -> str:
+    """Returns the column of an aggregate table holding an aggregate.
+
+    For example, SUM(num_sold) is stored as sum_num_sold and COUNT(*) as
+    row_count.
+    """
+    if aggregate_key == "COUNT(*)":
+        return "row_count"
+    function, argument = aggregate_key[:-1].split("(")
+    return f"{function.lower()}_{argument}"
+
+
+def required_measures(aggregate_keys: list[str]) -> list[str]:
+    """Returns the aggregates an aggregate table needs to answer the given ones.
+
+    AVG(x) is answered as SAFE_DIVIDE(SUM(x), COUNT(x)). COUNT(*) is always
+    included, so the aggregate table also answers row counts.
+    """
+    measures = {"COUNT(*)"}
+    for key in aggregate_keys:
+        if key.startswith("AVG("):
+            argument = key[len("AVG(") : -1]
+            measures.update({f"SUM({argument})", f"COUNT({argument})"})
+        else:
+            measures.add(key)
+    return sorted(measures)
+
+
+def aggregate_table_sql(table: str, dimensions: list[str], measures: list[str]) -> str:
+    """Returns the query computing an aggregate table.
+
+    Args:
+        table (str): The qualified name of the base table.
+        dimensions (list[str]): The columns the base table is grouped by.
+        measures (list[str]): The aggregates to store, e.g. SUM(num_sold).
+
+    Returns:
+        str: The SELECT statement of the aggregate table.
+    """
+    projections = [f"`{dimension}`" for dimension in dimensions]
+    for measure in measures:
+        if measure == "COUNT(*)":
+            projections.append(f"COUNT(*) AS `{measure_column_name(measure)}`")
+        else:
+            function, argument = measure[:-1].split("(")
+            projections.append(
+                f"{function}(`{argument}`) AS `{measure_column_name(measure)}`"
+            )
+    sql_string = f"SELECT {', '.join(projections)} FROM `{table}`"
+    if dimensions:
+        sql_string += " GROUP BY " + ", ".join(f"`{d}`" for d in dimensions)
+    return sqlglot.transpile(sql_string, read=DIALECT, write=DIALECT, pretty=True)[0]
+
+
+def _group_by_columns(select: exp.Select) -> list[exp.Column] | None:
+    """Returns the GROUP BY columns, resolving positions like GROUP BY 1."""
+    group = select.args.get("group")
+    if group is None:
+        return []
+    columns = []
+    for key in group.expressions:
+        if isinstance(key, exp.Literal) and key.is_int:
+            position = int(key.this)
+            if not 1 <= position <= len(select.expressions):
+                return None
+            key = select.expressions[position - 1].unalias()
+        if not isinstance(key, exp.Column):
+            return None
+        columns.append(key)
+    return columns
+
+
+def _aggregation_shape(select: exp.Select) -> dict | None:
+    """Returns the aggregation shape of a SELECT, see `aggregation_shape`."""
+    from_ = select.args.get("from")
+    if (
+        from_ is None
+        or not isinstance(from_.this, exp.Table)
+        or not from_.this.args.get("db")
+        or from_.this.db.upper() == "_SESSION"
+        or from_.this.args.get("sample")
+        or select.args.get("joins")
+        or select.args.get("with")
+        or select.args.get("distinct")
+        or select.args.get("qualify")
+        or select.find(exp.Window)
+        or any(node is not select for node in select.find_all(exp.Select))
+    ):
+        return None
+    group_columns = _group_by_columns(select)
+    if group_columns is None:
+        return None
+
+    aggregates = set()
+    for aggregate in select.find_all(exp.AggFunc):
+        key = _aggregate_key(aggregate)
+        if key is None:
+            return None
+        aggregates.add(key)
+    if not aggregates:
+        return None
+
+    dimensions = {column.name for column in group_columns}
+    output_names = {projection.alias for projection in select.expressions}
+    for column in select.find_all(exp.Column):
+        if column.find_ancestor(exp.AggFunc, exp.Where):
+            continue
+        if column.name in dimensions:
+            continue
+        if column.find_ancestor(exp.Order) and column.name in output_names:
+            continue
+        return None
+
+    filter_columns = set()
+    where = select.args.get("where")
+    if where is not None:
+        filter_columns = {column.name for column in where.find_all(exp.Column)}
+
+    return {
+        "table": _table_name(from_.this),
+        "dimensions": sorted(dimensions),
+        "filter_columns": sorted(filter_columns),
+        "aggregates": sorted(aggregates),
+    }
+
+
+def aggregation_shape(sql_string: str) -> dict | None:
+    """Fingerprints a query by its aggregation shape.
+
+    Only simple rollups of a single base table are fingerprinted: no joins,
+    subqueries, CTEs or window functions, grouped by plain columns and with
+    SUM, COUNT, MIN, MAX and AVG aggregates over plain columns.
+
+    Args:
+        sql_string (str): The SQL query.
+
+    Returns:
+        dict: The qualified name of the `table`, the GROUP BY `dimensions`,
+        the `filter_columns` of the WHERE clause and the `aggregates` (e.g.
+        SUM(num_sold)) of the query, or None if the query is not a simple
+        rollup.
+    """
+    ast = parse_sql(sql_string)
+    if not isinstance(ast, exp.Select):
+        return None
+    return _aggregation_shape(ast)
+
+
+def _answers(aggregate_table: dict, shape: dict) -> bool:
+    """Checks if an aggregate table can answer a query of the given shape."""
+    table = aggregate_table["table"]
+    if table != shape["table"] and not table.endswith("." + shape["table"]):
+        return False
+    dimensions = set(aggregate_table["dimensions"])
+    if not set(shape["dimensions"]) | set(shape["filter_columns"]) <= dimensions:
+        return False
+    measures = set(aggregate_table["measures"])
+    return set(required_measures(shape["aggregates"])) - {"COUNT(*)"} <= measures
+
+
+def _reaggregate(aggregate: exp.Expression) -> exp.Expression:
+    """Builds the expression re-aggregating an aggregate from stored measures."""
+    key = _aggregate_key(aggregate)
+    argument = aggregate.this
+    qualifier = (
+        argument.args.get("table") if isinstance(argument, exp.Column) else None
+    )
+
+    def measure(measure_key):
+        return exp.column(
+            measure_column_name(measure_key),
+            table=qualifier.copy() if qualifier is not None else None,
+            quoted=True,
+        )
+
+    if key.startswith("AVG("):
+        argument_name = key[len("AVG(") : -1]
+        # AVG returns NULL for groups without values, not a division error.
+        return exp.SafeDivide(
+            this=exp.Sum(this=measure(f"SUM({argument_name})")),
+            expression=exp.Sum(this=measure(f"COUNT({argument_name})")),
+        )
+    if key.startswith("COUNT("):
+        # COUNT returns 0 for no rows, SUM returns NULL.
+        return exp.func("COALESCE", exp.Sum(this=measure(key)), exp.Literal.number(0))
+    return aggregate.__class__(this=measure(key))
+
+
+def route_to_aggregate_table(
+    sql_string: str, aggregate_tables: list[dict]
+) -> tuple[str, str | None]:
+    """Rewrites a rollup query to read a matching aggregate table.
+
+    An aggregate table (e.g. a materialized view) is a base table grouped by
+    some dimensions, with the stored measures. It answers a rollup query if
+    the query groups and filters by a subset of its dimensions and needs only
+    its measures. Of all matching aggregate tables, the one with the fewest
+    rows is used, or with the fewest dimensions if the row counts are unknown.
+
+    Args:
+        sql_string (str): The SQL query.
+        aggregate_tables (list[dict]): The aggregate tables, each with its
+          qualified `name`, the qualified name of the base `table`, its
+          `dimensions`, its `measures` (e.g. SUM(num_sold)) and optionally
+          its number of rows (`num_rows`).
+
+    Returns:
+        tuple: The rewritten SQL query and the name of the aggregate table it
+        reads, or the unchanged SQL query and None.
+    """
+    ast = parse_sql(sql_string)
+    if not isinstance(ast, exp.Select):
+        return sql_string, None
+    shape = _aggregation_shape(ast)
+    if shape is None:
+        return sql_string, None
+    candidates = [table for table in aggregate_tables if _answers(table, shape)]
+    if not candidates:
+        return sql_string, None
+    aggregate_table = min(
+        candidates,
+        key=lambda table: (
+            table.get("num_rows") is None,
+            table.get("num_rows") or 0,
+            len(table["dimensions"]),
+        ),
+    )
+
+    table = ast.args["from"].this
+    alias = table.alias or table.name
+    routed_table = exp.to_table(aggregate_table["name"], dialect=DIALECT)
+    routed_table.meta["quoted_table"] = True
+    routed_table.set("alias", exp.TableAlias(this=exp.to_identifier(alias)))
+    table.replace(routed_table)
+    for aggregate in list(ast.find_all(exp.AggFunc)):
+        aggregate.replace(_reaggregate(aggregate))
+    return ast.sql(dialect=DIALECT, pretty=True), aggregate_table["name"]
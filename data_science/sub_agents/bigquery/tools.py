@@ -15,28 +15,40 @@
 """This file contains the tools used by the database agent."""
 
 import datetime
+import functools
 import logging
 import os
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+from data_science.utils import context_cache, usage_tracker
 from data_science.utils.utils import get_env_var
 from google.adk.tools import ToolContext
 from google.cloud import bigquery
-from google.genai import Client
 
-from .chase_sql import chase_constants
-
-# Assume that `BQ_PROJECT_ID` is set in the environment. See the
-# `data_agent` README for more details.
-project = os.getenv("BQ_PROJECT_ID", None)
-location = os.getenv("GOOGLE_CLOUD_LOCATION", "us-central1")
-llm_client = Client(vertexai=True, project=project, location=location)
+from . import bq_constants, mv_advisor, rollups, sql_rewriter
+from .chase_sql import chase_constants, llm_utils
+from .chase_sql.sql_postprocessor import sql_translator
 
 MAX_NUM_ROWS = 80
+# Upper bound on the rows kept in a query's destination table. Only
+# `MAX_NUM_ROWS` rows are returned per call; the rest can be paged through
+# with `fetch_more_rows` without re-running the query.
+MAX_PAGEABLE_ROWS = 10000
+# Maximum number of queries running concurrently against one BigQuery project.
+MAX_CONCURRENT_QUERIES = int(os.getenv("BQ_MAX_CONCURRENT_QUERIES", "4"))
 
 
 database_settings = None
 bq_client = None
+query_executor = None
+query_slots: dict[str, threading.BoundedSemaphore] = {}
+query_slots_lock = threading.Lock()
+# Process-wide BigQuery result cache statistics, see `get_query_cache_stats`.
+query_cache_stats = {"queries": 0, "cache_hits": 0}
+query_cache_stats_lock = threading.Lock()
 
 
 def get_bq_client():
@@ -47,6 +59,48 @@ def get_bq_client():
     return bq_client
 
 
+def get_query_executor():
+    """Get the thread pool used to run batches of queries."""
+    global query_executor
+    if query_executor is None:
+        query_executor = ThreadPoolExecutor(
+            max_workers=MAX_CONCURRENT_QUERIES, thread_name_prefix="bq_query"
+        )
+    return query_executor
+
+
+def get_query_slot(project_id: str) -> threading.BoundedSemaphore:
+    """Get the semaphore capping the concurrent queries of a project."""
+    with query_slots_lock:
+        if project_id not in query_slots:
+            query_slots[project_id] = threading.BoundedSemaphore(
+                MAX_CONCURRENT_QUERIES
+            )
+        return query_slots[project_id]
+
+
+def get_query_cache_stats() -> dict:
+    """Returns how many queries were served from the BigQuery result cache."""
+    with query_cache_stats_lock:
+        stats = dict(query_cache_stats)
+    stats["cache_hit_rate"] = (
+        stats["cache_hits"] / stats["queries"] if stats["queries"] else 0.0
+    )
+    return stats
+
+
+def _record_cache_hit(cache_hit: bool) -> None:
+    """Updates the process-wide result cache statistics."""
+    with query_cache_stats_lock:
+        query_cache_stats["queries"] += 1
+        query_cache_stats["cache_hits"] += int(bool(cache_hit))
+        logging.info(
+            "BigQuery result cache hits: %d of %d queries",
+            query_cache_stats["cache_hits"],
+            query_cache_stats["queries"],
+        )
+
+
 def get_database_settings():
     """Get database settings."""
     global database_settings
@@ -63,16 +117,165 @@ def update_database_settings():
         client=get_bq_client(),
         project_id=get_env_var("BQ_PROJECT_ID"),
     )
+    table_metadata = get_bigquery_table_metadata(
+        get_env_var("BQ_DATASET_ID"),
+        client=get_bq_client(),
+        project_id=get_env_var("BQ_PROJECT_ID"),
+    )
+    aggregate_tables = mv_advisor.load_materialized_views(
+        get_bq_client(), get_env_var("BQ_PROJECT_ID"), get_env_var("BQ_DATASET_ID")
+    ) + rollups.load_rollups(
+        get_bq_client(), get_env_var("BQ_PROJECT_ID"), get_env_var("BQ_DATASET_ID")
+    )
     database_settings = {
         "bq_project_id": get_env_var("BQ_PROJECT_ID"),
         "bq_dataset_id": get_env_var("BQ_DATASET_ID"),
         "bq_ddl_schema": ddl_schema,
+        "bq_table_metadata": table_metadata,
+        "bq_aggregate_tables": aggregate_tables,
         # Include ChaseSQL-specific constants.
         **chase_constants.chase_sql_constants_dict,
+        # Include the settings of the SQL rewrites.
+        **bq_constants.bq_sql_constants_dict,
     }
     return database_settings
 
 
+def _get_table_metadata(table_obj) -> dict:
+    """Returns the partitioning and clustering metadata of a table."""
+    metadata = {
+        "partition_column": None,
+        "partition_type": None,
+        "partition_column_type": None,
+        "range_partitioning": None,
+        "clustering_fields": list(table_obj.clustering_fields or []),
+        "require_partition_filter": bool(table_obj.require_partition_filter),
+        "latest_partition": None,
+    }
+    field_types = {field.name: field.field_type for field in table_obj.schema}
+    if table_obj.time_partitioning is not None:
+        # Ingestion-time partitioned tables have no partition column.
+        column = table_obj.time_partitioning.field or "_PARTITIONTIME"
+        metadata["partition_column"] = column
+        metadata["partition_type"] = table_obj.time_partitioning.type_
+        metadata["partition_column_type"] = field_types.get(column, "TIMESTAMP")
+    elif table_obj.range_partitioning is not None:
+        range_ = table_obj.range_partitioning.range_
+        metadata["partition_column"] = table_obj.range_partitioning.field
+        metadata["partition_type"] = "RANGE"
+        metadata["partition_column_type"] = "INT64"
+        metadata["range_partitioning"] = {
+            "start": range_.start,
+            "end": range_.end,
+            "interval": range_.interval,
+        }
+    return metadata
+
+
+def _get_table_options_ddl(metadata: dict) -> str:
+    """Returns the PARTITION BY, CLUSTER BY and OPTIONS clauses of a table."""
+    ddl = ""
+    column = metadata["partition_column"]
+    if metadata["partition_type"] == "RANGE":
+        range_ = metadata["range_partitioning"]
+        ddl += (
+            f"PARTITION BY RANGE_BUCKET(`{column}`, GENERATE_ARRAY("
+            f"{range_['start']}, {range_['end']}, {range_['interval']}))\n"
+        )
+    elif column == "_PARTITIONTIME":
+        ddl += "PARTITION BY _PARTITIONDATE\n"
+    elif column is not None:
+        partition_type = metadata["partition_type"]
+        if metadata["partition_column_type"] == "DATE":
+            if partition_type == "DAY":
+                ddl += f"PARTITION BY `{column}`\n"
+            else:
+                ddl += f"PARTITION BY DATE_TRUNC(`{column}`, {partition_type})\n"
+        elif partition_type == "DAY":
+            ddl += f"PARTITION BY DATE(`{column}`)\n"
+        else:
+            ddl += (
+                f"PARTITION BY {metadata['partition_column_type']}_TRUNC("
+                f"`{column}`, {partition_type})\n"
+            )
+    if metadata["clustering_fields"]:
+        clustering_fields = ", ".join(
+            f"`{field}`" for field in metadata["clustering_fields"]
+        )
+        ddl += f"CLUSTER BY {clustering_fields}\n"
+    if metadata["require_partition_filter"]:
+        ddl += "OPTIONS(require_partition_filter=TRUE)\n"
+    return ddl
+
+
+LATEST_PARTITIONS_QUERY = """
+SELECT table_name, MAX(partition_id) AS partition_id
+FROM `{project_id}.{dataset_id}`.INFORMATION_SCHEMA.PARTITIONS
+WHERE partition_id NOT IN ('__NULL__', '__UNPARTITIONED__',
+                           '__STREAMING_UNPARTITIONED__')
+GROUP BY table_name
+"""
+
+
+def _partition_start_date(partition_id: str) -> str:
+    """Returns the first day of a time partition, e.g. 2016-12-01 for 201612."""
+    year, month, day = partition_id[:4], partition_id[4:6], partition_id[6:8]
+    return f"{year}-{month or '01'}-{day or '01'}"
+
+
+def get_bigquery_table_metadata(dataset_id, client=None, project_id=None):
+    """Retrieves the partitioning and clustering of the tables of a dataset.
+
+    Args:
+        dataset_id (str): The ID of the BigQuery dataset (e.g., 'my_dataset').
+        client (bigquery.Client): A BigQuery client.
+        project_id (str): The ID of your Google Cloud Project.
+
+    Returns:
+        dict: The metadata per fully qualified table name, with the
+              `partition_column`, `partition_type` (e.g. DAY or RANGE),
+              `partition_column_type`, `range_partitioning`,
+              `clustering_fields` and `require_partition_filter` of the table,
+              and the first day of the `latest_partition` of time-partitioned
+              tables.
+    """
+
+    if client is None:
+        client = bigquery.Client(project=project_id)
+
+    dataset_ref = bigquery.DatasetReference(project_id, dataset_id)
+
+    table_metadata = {}
+    for table in client.list_tables(dataset_ref):
+        table_ref = dataset_ref.table(table.table_id)
+        table_obj = client.get_table(table_ref)
+        if table_obj.table_type != "TABLE":
+            continue
+        table_metadata[str(table_ref)] = _get_table_metadata(table_obj)
+
+    if any(
+        metadata["partition_column_type"] in ("DATE", "DATETIME", "TIMESTAMP")
+        for metadata in table_metadata.values()
+    ):
+        try:
+            rows = client.query(
+                LATEST_PARTITIONS_QUERY.format(
+                    project_id=dataset_ref.project, dataset_id=dataset_id
+                )
+            ).result()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"Could not read the latest partitions of {dataset_id}: {e}")
+            rows = []
+        for row in rows:
+            metadata = table_metadata.get(str(dataset_ref.table(row["table_name"])))
+            if metadata is not None and metadata["partition_type"] != "RANGE":
+                metadata["latest_partition"] = _partition_start_date(
+                    row["partition_id"]
+                )
+
+    return table_metadata
+
+
 def get_bigquery_schema(dataset_id, client=None, project_id=None):
     """Retrieves schema and generates DDL with example values for a BigQuery dataset.
 
@@ -111,7 +314,11 @@ def get_bigquery_schema(dataset_id, client=None, project_id=None):
                 ddl_statement += f" COMMENT '{field.description}'"
             ddl_statement += ",\n"
 
-        ddl_statement = ddl_statement[:-2] + "\n);\n\n"
+        ddl_statement = ddl_statement[:-2] + "\n)"
+        table_options = _get_table_options_ddl(_get_table_metadata(table_obj))
+        if table_options:
+            ddl_statement += "\n" + table_options[:-1]
+        ddl_statement += ";\n\n"
 
         # Add example values if available (limited to first row)
         rows = client.list_rows(table_ref, max_results=5).to_dataframe()
@@ -137,22 +344,25 @@ def get_bigquery_schema(dataset_id, client=None, project_id=None):
     return ddl_statements
 
 
-def initial_bq_nl2sql(
-    question: str,
-    tool_context: ToolContext,
-) -> str:
-    """Generates an initial SQL query from a natural language question.
+def baseline_nl2sql_prompt(
+    question: str, database_settings: dict, temp_tables_ddl: str = ""
+) -> tuple[str, str]:
+    """Returns the prompt of the baseline NL2SQL method.
 
     Args:
         question (str): Natural language question.
-        tool_context (ToolContext): The tool context to use for generating the SQL
-          query.
+        database_settings (dict): The database settings, see
+          `get_database_settings`.
+        temp_tables_ddl (str): The DDL of the temp tables of the conversation.
 
     Returns:
-        str: An SQL statement to answer this question.
+        tuple[str, str]: The static prefix of the prompt and its suffix with
+        the temp tables and the question.
     """
 
-    prompt_template = """
+    # The guidelines and the schema of the dataset are a static prefix, which is
+    # stored in a context cache, followed by the question.
+    prefix_template = """
 You are a BigQuery SQL expert tasked with answering user's questions about BigQuery tables by generating SQL queries in the GoogleSql dialect.  Your task is to write a Bigquery SQL query that answers the following question while using the provided context.
 
 **Guidelines:**
@@ -163,6 +373,8 @@ You are a BigQuery SQL expert tasked with answering user's questions about BigQu
 - **SQL Syntax:** Return syntactically and semantically correct SQL for BigQuery with proper relation mapping (i.e., project_id, owner, table, and column relation). Use SQL `AS` statement to assign a new name temporarily to a table column or even a table wherever needed. Always enclose subqueries and union queries in parentheses.
 - **Column Usage:** Use *ONLY* the column names (column_name) mentioned in the Table Schema. Do *NOT* use any other column names. Associate `column_name` mentioned in the Table Schema only to the `table_name` specified under Table Schema.
 - **FILTERS:** You should write query effectively  to reduce and minimize the total rows to be returned. For example, you can use filters (like `WHERE`, `HAVING`, etc. (like 'COUNT', 'SUM', etc.) in the SQL query.
+- **Partitioned Tables:** If a table is created with `PARTITION BY <column>`, filter on that column whenever the question restricts the time range, so that BigQuery only scans the relevant partitions. Tables with `require_partition_filter=TRUE` must always be filtered on their partition column.
+- **Temporary Tables:** If the schema lists temporary tables (`_SESSION.<table_name>`) that already contain the data needed to answer the question, query them instead of the base tables.
 - **LIMIT ROWS:**  The maximum number of rows returned should be less than {MAX_NUM_ROWS}.
 
 **Schema:**
@@ -170,7 +382,8 @@ You are a BigQuery SQL expert tasked with answering user's questions about BigQu
 The database structure is defined by the following table schemas (possibly with sample rows):
 
 ```
-{SCHEMA}
+{SCHEMA}"""
+    question_template = """
 ```
 
 **Natural language question:**
@@ -183,21 +396,74 @@ The database structure is defined by the following table schemas (possibly with
 
    """
 
-    ddl_schema = tool_context.state["database_settings"]["bq_ddl_schema"]
-
-    prompt = prompt_template.format(
-        MAX_NUM_ROWS=MAX_NUM_ROWS, SCHEMA=ddl_schema, QUESTION=question
+    prefix = prefix_template.format(
+        MAX_NUM_ROWS=MAX_NUM_ROWS,
+        SCHEMA=database_settings["bq_ddl_schema"],
     )
+    # The temp tables of the conversation complete the schema of the prefix.
+    suffix = temp_tables_ddl + question_template.format(QUESTION=question)
+    return prefix, suffix
 
-    response = llm_client.models.generate_content(
-        model=os.getenv("BASELINE_NL2SQL_MODEL"),
-        contents=prompt,
-        config={"temperature": 0.1},
+
+def clean_generated_sql(response: str | None) -> str | None:
+    """Removes the Markdown code fences of a generated SQL query."""
+    if response:
+        response = response.replace("```sql", "").replace("```", "").strip()
+    return response
+
+
+def generate_sql(
+    question: str, database_settings: dict, temp_tables_ddl: str = ""
+) -> str:
+    """Generates a SQL query with the baseline method, outside of a session.
+
+    Args:
+        question (str): Natural language question.
+        database_settings (dict): The database settings, see
+          `get_database_settings`.
+        temp_tables_ddl (str): The DDL of the temp tables of the conversation.
+
+    Returns:
+        str: An SQL statement to answer this question.
+    """
+    prefix, suffix = baseline_nl2sql_prompt(
+        question, database_settings, temp_tables_ddl
+    )
+    model_name = os.getenv("BASELINE_NL2SQL_MODEL")
+    cache_name = context_cache.get_context_cache().get_cache_name(
+        llm_utils.get_genai_client(llm_utils.GCP_LOCATION),
+        model_name,
+        llm_utils.GCP_LOCATION,
+        prefix,
+        display_name="baseline_nl2sql",
     )
+    prompt = suffix if cache_name is not None else prefix + suffix
+    model = llm_utils.get_gemini_model(
+        model_name, temperature=0.1, cache_name=cache_name
+    )
+    return clean_generated_sql(model.call(prompt))
+
+
+def initial_bq_nl2sql(
+    question: str,
+    tool_context: ToolContext,
+) -> str:
+    """Generates an initial SQL query from a natural language question.
+
+    Args:
+        question (str): Natural language question.
+        tool_context (ToolContext): The tool context to use for generating the SQL
+          query.
 
-    sql = response.text
-    if sql:
-        sql = sql.replace("```sql", "").replace("```", "").strip()
+    Returns:
+        str: An SQL statement to answer this question.
+    """
+    with usage_tracker.tool_scope(tool_context, "initial_bq_nl2sql"):
+        sql = generate_sql(
+            question,
+            tool_context.state["database_settings"],
+            get_session_temp_tables_ddl(tool_context),
+        )
 
     print("\n sql:", sql)
 
@@ -206,6 +472,356 @@ The database structure is defined by the following table schemas (possibly with
     return sql
 
 
+def cleanup_sql(sql_string, add_limit=True):
+    """Processes the SQL string to get a printable, valid SQL string."""
+
+    # 1. Remove backslashes escaping double quotes
+    sql_string = sql_string.replace('\\"', '"')
+
+    # 2. Remove backslashes before newlines (the key fix for this issue)
+    sql_string = sql_string.replace("\\\n", "\n")  # Corrected regex
+
+    # 3. Replace escaped single quotes
+    sql_string = sql_string.replace("\\'", "'")
+
+    # 4. Replace escaped newlines (those not preceded by a backslash)
+    sql_string = sql_string.replace("\\n", "\n")
+
+    # 5. Add limit clause if not present
+    if add_limit and "limit" not in sql_string.lower():
+        sql_string = sql_string + " limit " + str(MAX_PAGEABLE_ROWS)
+
+    return sql_string
+
+
+def contains_dml_or_ddl(sql_string: str) -> bool:
+    """Checks if the SQL string contains DML or DDL operations."""
+    # More restrictive check for BigQuery - disallow DML and DDL
+    return bool(
+        re.search(
+            r"(?i)(update|delete|drop|insert|create|alter|truncate|merge)",
+            sql_string,
+        )
+    )
+
+
+def _rows_to_dicts(rows) -> list[dict]:
+    """Converts BigQuery rows to JSON-friendly dicts."""
+    return [
+        {
+            key: (
+                value
+                if not isinstance(value, datetime.date)
+                else value.strftime("%Y-%m-%d")
+            )
+            for (key, value) in row.items()
+        }
+        for row in rows
+    ]
+
+
+def uses_session_temp_tables(sql_string: str) -> bool:
+    """Checks if the SQL string references temp tables of a BigQuery session."""
+    return bool(re.search(r"(?i)`?_SESSION`?\s*\.", sql_string))
+
+
+def _session_job_config(session_id: str | None) -> bigquery.QueryJobConfig:
+    """Returns a job config that runs the query in the conversation's session.
+
+    A new BigQuery session is created if the conversation does not have one
+    yet. Its ID is stored by `_remember_session` once the job has started.
+    """
+    if session_id is None:
+        return bigquery.QueryJobConfig(
+            create_session=True, labels=mv_advisor.QUERY_JOB_LABELS
+        )
+    return bigquery.QueryJobConfig(
+        labels=mv_advisor.QUERY_JOB_LABELS,
+        connection_properties=[
+            bigquery.ConnectionProperty("session_id", session_id)
+        ]
+    )
+
+
+def _remember_session(query_job, tool_context: ToolContext) -> None:
+    """Stores the ID of the BigQuery session a query job ran in."""
+    session_info = query_job.session_info
+    if session_info is not None and session_info.session_id:
+        tool_context.state["bq_session_id"] = session_info.session_id
+
+
+def get_session_temp_tables_ddl(tool_context: ToolContext) -> str:
+    """Returns the DDL of the conversation's temp tables, or an empty string.
+
+    Unlike the dataset DDL, it changes during the conversation, so it is sent
+    after the context-cached prefix of the prompts.
+    """
+    temp_tables = tool_context.state.get("bq_temp_tables", {})
+    if not temp_tables:
+        return ""
+
+    ddl_schema = (
+        "-- Temporary tables materialized earlier in this conversation. They"
+        " hold\n"
+        "-- intermediate results of previous questions. Prefer them over the"
+        " base\n"
+        "-- tables whenever they contain the data needed to answer the"
+        " question, and\n"
+        "-- always reference them as `_SESSION.<table_name>`.\n\n"
+    )
+    for temp_table in temp_tables.values():
+        ddl_schema += temp_table["ddl"]
+    return ddl_schema
+
+
+def _result_handle(query_job) -> dict:
+    """Builds a handle to the destination table of a finished query job."""
+    destination = query_job.destination
+    return {
+        # The job ID is only unique within its location, so the handle keeps
+        # both, like the `LOCATION.JOB_ID` references of the `bq` tool.
+        "handle": f"{query_job.location}.{query_job.job_id}",
+        "job_id": query_job.job_id,
+        "location": query_job.location,
+        "destination_table": (
+            f"{destination.project}.{destination.dataset_id}.{destination.table_id}"
+        ),
+    }
+
+
+@functools.lru_cache(maxsize=8)
+def get_sqlglot_schema(ddl_schema: str) -> dict | None:
+    """Get the schema of the DDL statements in SQLGlot format."""
+    return sql_translator.SqlTranslator.rewrite_schema_for_sqlglot(ddl_schema)
+
+
+def _dry_run_bytes(sql_string: str) -> int | None:
+    """Returns the bytes a query would process, or None if it is invalid."""
+    job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+    try:
+        query_job = get_bq_client().query(sql_string, job_config=job_config)
+    except Exception:  # pylint: disable=broad-exception-caught
+        return None
+    return query_job.total_bytes_processed
+
+
+def _rewrite_query(
+    sql_string: str, database_settings: dict, exploration: bool = False
+) -> tuple[str, dict, list[str]]:
+    """Applies the SQL rewrites enabled in the database settings.
+
+    Rollup queries are routed to a matching materialized view of the
+    `mv_advisor` or table of `rollups`. This is only kept if the dry run of
+    the rewritten query succeeds and processes no more bytes than the original
+    query, and the column pruning rewrite only if it processes fewer bytes.
+
+    Args:
+        sql_string (str): The cleaned SQL query.
+        database_settings (dict): The database settings of the session.
+        exploration (bool): Whether to also apply the approximate rewrites of
+          `sql_rewriter.approximate_sql`.
+
+    Returns:
+        tuple: The rewritten SQL query, a report of the applied rewrites and
+        warnings about the query.
+    """
+    rewrites = {}
+    warnings = []
+    if uses_session_temp_tables(sql_string):
+        # The schema of the temp tables is not known to the rewrites.
+        return sql_string, rewrites, warnings
+    schema = get_sqlglot_schema(database_settings["bq_ddl_schema"])
+
+    aggregate_tables = database_settings.get("bq_aggregate_tables")
+    if database_settings.get("route_aggregate_tables") and aggregate_tables:
+        routed_sql, aggregate_table = sql_rewriter.route_to_aggregate_table(
+            sql_string, aggregate_tables
+        )
+        if aggregate_table is not None:
+            bytes_before = _dry_run_bytes(sql_string)
+            bytes_after = _dry_run_bytes(routed_sql)
+            if (
+                bytes_before is not None
+                and bytes_after is not None
+                and bytes_after <= bytes_before
+            ):
+                # The partition check below does not apply to the view.
+                sql_string = routed_sql
+                rewrites["aggregate_table"] = {
+                    "table": aggregate_table,
+                    "bytes_processed_before": bytes_before,
+                    "bytes_processed_after": bytes_after,
+                    "bytes_saved": bytes_before - bytes_after,
+                }
+
+    partition_filter_mode = database_settings.get("partition_filter_mode", "off")
+    if partition_filter_mode in ("warn", "inject"):
+        sql_string, findings = sql_rewriter.check_partition_filters(
+            sql_string,
+            database_settings.get("bq_table_metadata", {}),
+            inject_days=(
+                database_settings.get("partition_filter_days", 30)
+                if partition_filter_mode == "inject"
+                else None
+            ),
+        )
+        injected = [finding for finding in findings if finding["injected_filter"]]
+        if injected:
+            rewrites["partition_filter"] = injected
+        warnings += [finding["message"] for finding in findings]
+
+    if database_settings.get("prune_columns"):
+        pruned_sql = sql_rewriter.prune_columns(sql_string, schema)
+        # The query is only rewritten if columns of the tables were pruned.
+        if pruned_sql != sql_string:
+            bytes_before = _dry_run_bytes(sql_string)
+            bytes_after = _dry_run_bytes(pruned_sql)
+            if (
+                bytes_before is not None
+                and bytes_after is not None
+                and bytes_after < bytes_before
+            ):
+                sql_string = pruned_sql
+                rewrites["column_pruning"] = {
+                    "bytes_processed_before": bytes_before,
+                    "bytes_processed_after": bytes_after,
+                    "bytes_saved": bytes_before - bytes_after,
+                }
+
+    if exploration:
+        approximate_sql, approximations, sample_warnings = (
+            sql_rewriter.approximate_sql(
+                sql_string, database_settings.get("exploration_sample_percent", 10)
+            )
+        )
+        warnings += sample_warnings
+        bytes_before = _dry_run_bytes(sql_string) if approximations else None
+        bytes_after = _dry_run_bytes(approximate_sql) if approximations else None
+        if bytes_after is not None:
+            # Approximate aggregates mostly save slot time; only the sampled
+            # previews read fewer bytes.
+            sql_string = approximate_sql
+            rewrites["approximation"] = {
+                "approximations": approximations,
+                "bytes_processed_before": bytes_before,
+                "bytes_processed_after": bytes_after,
+                "bytes_saved": (
+                    bytes_before - bytes_after if bytes_before is not None else None
+                ),
+            }
+
+    return sql_string, rewrites, warnings
+
+
+def _execute_query(
+    sql_string: str,
+    database_settings: dict,
+    session_id: str | None = None,
+    exploration: bool = False,
+    job_id: str | None = None,
+):
+    """Executes a cleaned, read-only query and fetches its first page of rows.
+
+    The session state is not touched, so that queries can run on the worker
+    threads of `run_bigquery_batch`. See `_store_query_result`.
+
+    Args:
+        sql_string (str): The cleaned SQL query.
+        database_settings (dict): The database settings of the session.
+        session_id (str): The BigQuery session of the conversation, if any.
+        exploration (bool): Whether approximate results are acceptable.
+        job_id (str): The ID of the query job, so that it can be cancelled,
+          see `cancel_query_job`. By default, BigQuery generates one.
+
+    Returns:
+        tuple: The result dict and the query job, or None if the job could not
+        be created.
+    """
+    final_result = {"query_result": None, "error_message": None}
+    query_job = None
+    sql_string, rewrites, warnings = _rewrite_query(
+        sql_string, database_settings, exploration
+    )
+    if "approximation" in rewrites:
+        final_result["approximate"] = True
+        final_result["sql"] = sql_string
+    if rewrites:
+        final_result["rewrites"] = rewrites
+    if warnings:
+        final_result["warnings"] = warnings
+    # Canonical SQL text maximizes the hits in the BigQuery result cache,
+    # which requires byte-identical queries.
+    sql_string = sql_rewriter.canonicalize_sql(sql_string)
+
+    try:
+        client = get_bq_client()
+        with get_query_slot(client.project):
+            if uses_session_temp_tables(sql_string):
+                query_job = client.query(
+                    sql_string,
+                    job_config=_session_job_config(session_id),
+                    job_id=job_id,
+                )
+            else:
+                # Queries on the base tables run outside of the session so they
+                # can be served from the BigQuery result cache.
+                query_job = client.query(
+                    sql_string,
+                    job_config=bigquery.QueryJobConfig(
+                        labels=mv_advisor.QUERY_JOB_LABELS
+                    ),
+                    job_id=job_id,
+                )
+            # Only the first page is downloaded, the full result stays in the
+            # job's destination table.
+            results = query_job.result(max_results=MAX_NUM_ROWS)
+
+        final_result["cache_hit"] = bool(query_job.cache_hit)
+        _record_cache_hit(query_job.cache_hit)
+
+        if results.schema:  # Check if query returned data
+            # Convert BigQuery RowIterator to list of dicts
+            rows = _rows_to_dicts(results)[:MAX_NUM_ROWS]
+            # return f"Valid SQL. Results: {rows}"
+            final_result["query_result"] = rows
+            final_result["total_rows"] = results.total_rows
+            final_result["result_handle"] = _result_handle(query_job)
+
+        else:
+            final_result["error_message"] = (
+                "Valid SQL. Query executed successfully (no results)."
+            )
+
+    except (
+        Exception
+    ) as e:  # Catch generic exceptions from BigQuery  # pylint: disable=broad-exception-caught
+        final_result["error_message"] = f"Invalid SQL: {e}"
+
+    return final_result, query_job
+
+
+def _store_query_result(
+    final_result: dict, query_job, tool_context: ToolContext
+) -> None:
+    """Records the outcome of `_execute_query` in the session state."""
+    if query_job is not None:
+        _remember_session(query_job, tool_context)
+    if "cache_hit" in final_result:
+        cache_stats = dict(
+            tool_context.state.get("bq_cache_stats", {"queries": 0, "cache_hits": 0})
+        )
+        cache_stats["queries"] += 1
+        cache_stats["cache_hits"] += int(final_result["cache_hit"])
+        tool_context.state["bq_cache_stats"] = cache_stats
+    if final_result.get("result_handle"):
+        tool_context.state["query_result"] = final_result["query_result"]
+        handles = dict(tool_context.state.get("query_result_handles", {}))
+        handles[final_result["result_handle"]["handle"]] = final_result[
+            "result_handle"
+        ]
+        tool_context.state["query_result_handles"] = handles
+
+
 def run_bigquery_validation(
     sql_string: str,
     tool_context: ToolContext,
@@ -220,11 +836,15 @@ def run_bigquery_validation(
     2. **DML/DDL Restriction:**  Rejects any SQL queries containing DML or DDL
        statements (e.g., UPDATE, DELETE, INSERT, CREATE, ALTER) to ensure
        read-only operations.
-    3. **Syntax and Execution:** Sends the cleaned SQL to BigQuery for validation.
+    3. **Syntax and Execution:** Sends the cleaned SQL to BigQuery for validation,
+       after rewriting it into a canonical form that maximizes the hits in the
+       BigQuery result cache.
        If the query is syntactically correct and executable, it retrieves the
        results.
     4. **Result Analysis:**  Checks if the query produced any results. If so, it
-       formats the first few rows of the result set for inspection.
+       formats the first few rows of the result set for inspection and returns
+       a `result_handle` that `fetch_more_rows` can use to page through the
+       rest of the result without re-running the query.
 
     Args:
         sql_string (str): The SQL query string to validate.
@@ -232,82 +852,390 @@ def run_bigquery_validation(
 
     Returns:
         str: A message indicating the validation outcome. This includes:
-             - "Valid SQL. Results: ..." if the query is valid and returns data.
+             - "Valid SQL. Results: ..." if the query is valid and returns data,
+                together with the `result_handle` and `total_rows` of the
+                result, and whether it was served from the BigQuery result
+                cache (`cache_hit`). If the SQL was rewritten to scan fewer
+                bytes, `rewrites` reports the bytes saved per rewrite.
+                `warnings` lists problems like scans of all partitions of a
+                partitioned table.
              - "Valid SQL. Query executed successfully (no results)." if the query
                 is valid but returns no data.
              - "Invalid SQL: ..." if the query is invalid, along with the error
                 message from BigQuery.
     """
 
-    def cleanup_sql(sql_string):
-        """Processes the SQL string to get a printable, valid SQL string."""
+    logging.info("Validating SQL: %s", sql_string)
+    sql_string = cleanup_sql(sql_string)
+    logging.info("Validating SQL (after cleanup): %s", sql_string)
+
+    if contains_dml_or_ddl(sql_string):
+        return {
+            "query_result": None,
+            "error_message": "Invalid SQL: Contains disallowed DML/DDL operations.",
+        }
+
+    final_result, query_job = _execute_query(
+        sql_string,
+        tool_context.state["database_settings"],
+        tool_context.state.get("bq_session_id"),
+    )
+    _store_query_result(final_result, query_job, tool_context)
+
+    print("\n run_bigquery_validation final_result: \n", final_result)
+
+    return final_result
+
+
+def evaluate_candidate_sql(
+    sql_string: str,
+    database_settings: dict,
+    session_id: str | None = None,
+    execute: bool = True,
+    job_id: str | None = None,
+) -> dict:
+    """Dry-runs or executes a generated query, to compare candidate queries.
+
+    Unlike `run_bigquery_validation`, the session state is not touched, so that
+    candidates can be evaluated concurrently on the worker threads of
+    `get_query_executor`. Candidates using the temp tables of the session must
+    still be evaluated one at a time, as the queries of a BigQuery session run
+    serially.
+
+    Args:
+        sql_string (str): The SQL query.
+        database_settings (dict): The database settings of the session.
+        session_id (str): The BigQuery session of the conversation, if any.
+        execute (bool): Whether to execute the query, or only dry-run it.
+        job_id (str): The ID of the query job of an executed query, so that it
+          can be cancelled, see `cancel_query_job`.
+
+    Returns:
+        dict: The `error_message` of the query, which starts with "Invalid SQL"
+        if the query is invalid. Executed queries also have the first rows of
+        their `query_result` and their `total_rows`.
+    """
+    sql_string = cleanup_sql(sql_string)
+    if contains_dml_or_ddl(sql_string):
+        return {
+            "query_result": None,
+            "error_message": "Invalid SQL: Contains disallowed DML/DDL operations.",
+        }
+    if uses_session_temp_tables(sql_string) and session_id is None:
+        return {
+            "query_result": None,
+            "error_message": "Invalid SQL: The conversation has no temp tables.",
+        }
+    if execute:
+        final_result, _ = _execute_query(
+            sql_string, database_settings, session_id, job_id=job_id
+        )
+        return final_result
+
+    if uses_session_temp_tables(sql_string):
+        job_config = _session_job_config(session_id)
+        job_config.dry_run = True
+    else:
+        job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+    try:
+        get_bq_client().query(sql_string, job_config=job_config)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        return {"query_result": None, "error_message": f"Invalid SQL: {e}"}
+    return {"query_result": None, "error_message": None}
 
-        # 1. Remove backslashes escaping double quotes
-        sql_string = sql_string.replace('\\"', '"')
 
-        # 2. Remove backslashes before newlines (the key fix for this issue)
-        sql_string = sql_string.replace("\\\n", "\n")  # Corrected regex
+def cancel_query_job(job_id: str) -> None:
+    """Cancels a query job that is no longer needed, if it is still running.
 
-        # 3. Replace escaped single quotes
-        sql_string = sql_string.replace("\\'", "'")
+    Args:
+        job_id (str): The ID the job was created with. Unknown IDs are ignored,
+          e.g. of jobs that were never created.
+    """
+    try:
+        get_bq_client().cancel_job(job_id)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        logging.info("Could not cancel the query job %s: %s", job_id, e)
 
-        # 4. Replace escaped newlines (those not preceded by a backslash)
-        sql_string = sql_string.replace("\\n", "\n")
 
-        # 5. Add limit clause if not present
-        if "limit" not in sql_string.lower():
-            sql_string = sql_string + " limit " + str(MAX_NUM_ROWS)
+def run_bigquery_exploration(
+    sql_string: str,
+    tool_context: ToolContext,
+) -> str:
+    """Runs a BigQuery SQL query in exploration mode, trading accuracy for cost.
 
-        return sql_string
+    Works like `run_bigquery_validation`, but the query is first rewritten to a
+    cheaper, approximate counterpart where possible:
 
-    logging.info("Validating SQL: %s", sql_string)
+    1. `COUNT(DISTINCT x)` becomes `APPROX_COUNT_DISTINCT(x)`.
+    2. Exact percentiles (`PERCENTILE_CONT`/`PERCENTILE_DISC`) become
+       `APPROX_QUANTILES`.
+    3. Queries that only preview the rows of a single table read a
+       `TABLESAMPLE SYSTEM` sample of it, of `exploration_sample_percent`
+       percent. Joins are not sampled.
+
+    Args:
+        sql_string (str): The SQL query string to run.
+        tool_context (ToolContext): The tool context.
+
+    Returns:
+        str: The same result as `run_bigquery_validation`. If the query was
+             rewritten, `approximate` is True, `sql` holds the query that ran
+             and `rewrites["approximation"]` lists the approximations and the
+             bytes they saved.
+    """
+
+    logging.info("Exploring with SQL: %s", sql_string)
     sql_string = cleanup_sql(sql_string)
-    logging.info("Validating SQL (after cleanup): %s", sql_string)
 
+    if contains_dml_or_ddl(sql_string):
+        return {
+            "query_result": None,
+            "error_message": "Invalid SQL: Contains disallowed DML/DDL operations.",
+        }
+
+    final_result, query_job = _execute_query(
+        sql_string,
+        tool_context.state["database_settings"],
+        tool_context.state.get("bq_session_id"),
+        exploration=True,
+    )
+    _store_query_result(final_result, query_job, tool_context)
+
+    print("\n run_bigquery_exploration final_result: \n", final_result)
+
+    return final_result
+
+
+def run_bigquery_batch(
+    sql_strings: list[str],
+    tool_context: ToolContext,
+) -> str:
+    """Validates and runs several independent BigQuery SQL queries at once.
+
+    All queries are cleaned up and checked for DML/DDL operations in one pass,
+    like in `run_bigquery_validation`. The valid ones then run concurrently,
+    capped at `MAX_CONCURRENT_QUERIES` per project, so the batch takes about as
+    long as its slowest query instead of the sum of all of them. Queries using
+    the temp tables of the session run one after another, next to the others,
+    as the queries of a BigQuery session run serially.
+
+    Args:
+        sql_strings (list[str]): The read-only SQL queries to run. The queries
+          must not depend on each other.
+        tool_context (ToolContext): The tool context.
+
+    Returns:
+        str: A dict with one entry per query in `results`, in the order of
+             `sql_strings`. Each entry holds the `sql`, `query_result`,
+             `result_handle`, `error_message` and `elapsed_seconds` of the
+             query. `elapsed_seconds` holds the wall time of the whole batch.
+    """
+    start_time = time.monotonic()
+    database_settings = tool_context.state["database_settings"]
+    session_id = tool_context.state.get("bq_session_id")
+
+    def timed_query(sql_string, query_session_id):
+        query_start_time = time.monotonic()
+        final_result, query_job = _execute_query(
+            sql_string, database_settings, query_session_id
+        )
+        final_result["elapsed_seconds"] = round(
+            time.monotonic() - query_start_time, 3
+        )
+        return final_result, query_job
+
+    def session_queries(sql_strings_by_index):
+        # The first query creates the session if there is none yet, and the
+        # others run in it.
+        query_session_id = session_id
+        outcomes = {}
+        for index, sql_string in sql_strings_by_index.items():
+            final_result, query_job = timed_query(sql_string, query_session_id)
+            outcomes[index] = (final_result, query_job)
+            session_info = query_job.session_info if query_job else None
+            if session_info is not None and session_info.session_id:
+                query_session_id = session_info.session_id
+        return outcomes
+
+    sql_strings = [cleanup_sql(sql_string) for sql_string in sql_strings]
+    results = [None] * len(sql_strings)
+    futures = {}
+    session_sql_strings = {}
+    for index, sql_string in enumerate(sql_strings):
+        if contains_dml_or_ddl(sql_string):
+            results[index] = {
+                "sql": sql_string,
+                "query_result": None,
+                "error_message": (
+                    "Invalid SQL: Contains disallowed DML/DDL operations."
+                ),
+                "elapsed_seconds": 0.0,
+            }
+        elif uses_session_temp_tables(sql_string):
+            session_sql_strings[index] = sql_string
+        else:
+            futures[index] = get_query_executor().submit(
+                timed_query, sql_string, session_id
+            )
+    session_future = (
+        get_query_executor().submit(session_queries, session_sql_strings)
+        if session_sql_strings
+        else None
+    )
+
+    outcomes = {index: future.result() for index, future in futures.items()}
+    if session_future is not None:
+        outcomes.update(session_future.result())
+    for index in sorted(outcomes):
+        final_result, query_job = outcomes[index]
+        # State updates happen here, on the calling thread.
+        _store_query_result(final_result, query_job, tool_context)
+        results[index] = {"sql": sql_strings[index], **final_result}
+    tool_context.state["query_result"] = [
+        result["query_result"] for result in results
+    ]
+
+    batch_result = {
+        "results": results,
+        "elapsed_seconds": round(time.monotonic() - start_time, 3),
+    }
+
+    print("\n run_bigquery_batch final_result: \n", batch_result)
+
+    return batch_result
+
+
+def fetch_more_rows(
+    handle: str,
+    offset: int,
+    limit: int,
+    tool_context: ToolContext,
+) -> str:
+    """Fetches more rows of an already executed query.
+
+    Pages through the destination table of a query previously run by
+    `run_bigquery_validation`. The query is not re-executed, so no additional
+    bytes are scanned.
+
+    Args:
+        handle (str): The `handle` of the `result_handle` returned by
+          `run_bigquery_validation`, of the form `LOCATION.JOB_ID`.
+        offset (int): The zero-based index of the first row to fetch.
+        limit (int): The number of rows to fetch, at most `MAX_NUM_ROWS`.
+        tool_context (ToolContext): The tool context.
+
+    Returns:
+        str: A dict with the fetched rows in `query_result`, the total number of
+             rows in `total_rows`, or an `error_message` if the rows could not be
+             fetched.
+    """
     final_result = {"query_result": None, "error_message": None}
+    limit = max(1, min(int(limit), MAX_NUM_ROWS))
+    offset = max(0, int(offset))
 
-    # More restrictive check for BigQuery - disallow DML and DDL
-    if re.search(
-        r"(?i)(update|delete|drop|insert|create|alter|truncate|merge)", sql_string
-    ):
+    try:
+        result_handle = tool_context.state.get("query_result_handles", {}).get(
+            handle
+        )
+        if result_handle is None:
+            # Fall back to the job itself, e.g. for handles from an earlier
+            # session. Jobs outside the default location of the client are only
+            # found with their location.
+            location, _, job_id = handle.rpartition(".")
+            result_handle = _result_handle(
+                get_bq_client().get_job(job_id, location=location or None)
+            )
+
+        rows = get_bq_client().list_rows(
+            result_handle["destination_table"],
+            start_index=offset,
+            max_results=limit,
+        )
+        final_result["query_result"] = _rows_to_dicts(rows)
+        final_result["total_rows"] = rows.total_rows
+        final_result["result_handle"] = result_handle
+
+        tool_context.state["query_result"] = final_result["query_result"]
+
+    except (
+        Exception
+    ) as e:  # Catch generic exceptions from BigQuery  # pylint: disable=broad-exception-caught
+        final_result["error_message"] = f"Could not fetch rows: {e}"
+
+    print("\n fetch_more_rows final_result: \n", final_result)
+
+    return final_result
+
+
+def create_temp_table(
+    table_name: str,
+    sql_string: str,
+    tool_context: ToolContext,
+) -> str:
+    """Materializes the result of a query as a temp table of the conversation.
+
+    The table is created in the conversation's BigQuery session and can be
+    referenced as `_SESSION.<table_name>` by later queries, so follow-up
+    questions only scan the (small) intermediate result instead of the base
+    tables.
+
+    Args:
+        table_name (str): The name of the temp table, letters, digits and
+          underscores only.
+        sql_string (str): The read-only SQL query whose result is materialized.
+        tool_context (ToolContext): The tool context.
+
+    Returns:
+        str: A dict with the `table_name` and `num_rows` of the created temp
+             table, or an `error_message` if it could not be created.
+    """
+    final_result = {"table_name": None, "num_rows": None, "error_message": None}
+
+    if not re.fullmatch(r"[A-Za-z_]\w*", table_name):
+        final_result["error_message"] = f"Invalid temp table name: {table_name}"
+        return final_result
+
+    sql_string = cleanup_sql(sql_string, add_limit=False).strip().rstrip(";")
+    if contains_dml_or_ddl(sql_string):
         final_result["error_message"] = (
             "Invalid SQL: Contains disallowed DML/DDL operations."
         )
         return final_result
 
     try:
-        query_job = get_bq_client().query(sql_string)
-        results = query_job.result()  # Get the query results
+        session_id = tool_context.state.get("bq_session_id")
+        query_job = get_bq_client().query(
+            f"CREATE OR REPLACE TEMP TABLE `{table_name}` AS\n{sql_string}",
+            job_config=_session_job_config(session_id),
+        )
+        query_job.result()
+        _remember_session(query_job, tool_context)
 
-        if results.schema:  # Check if query returned data
-            rows = [
-                {
-                    key: (
-                        value
-                        if not isinstance(value, datetime.date)
-                        else value.strftime("%Y-%m-%d")
-                    )
-                    for (key, value) in row.items()
-                }
-                for row in results
-            ][
-                :MAX_NUM_ROWS
-            ]  # Convert BigQuery RowIterator to list of dicts
-            # return f"Valid SQL. Results: {rows}"
-            final_result["query_result"] = rows
+        table = get_bq_client().get_table(query_job.ddl_target_table)
+        ddl = f"CREATE TEMP TABLE `_SESSION.{table_name}` (\n"
+        ddl += ",\n".join(
+            f"  `{field.name}` {field.field_type}" for field in table.schema
+        )
+        ddl += f"\n);\n-- {table.num_rows} rows, defined as:\n"
+        ddl += "".join(f"-- {line}\n" for line in sql_string.splitlines())
+        ddl += "\n"
 
-            tool_context.state["query_result"] = rows
+        temp_tables = dict(tool_context.state.get("bq_temp_tables", {}))
+        temp_tables[table_name] = {
+            "sql": sql_string,
+            "ddl": ddl,
+            "num_rows": table.num_rows,
+        }
+        tool_context.state["bq_temp_tables"] = temp_tables
 
-        else:
-            final_result["error_message"] = (
-                "Valid SQL. Query executed successfully (no results)."
-            )
+        final_result["table_name"] = f"_SESSION.{table_name}"
+        final_result["num_rows"] = table.num_rows
 
     except (
         Exception
     ) as e:  # Catch generic exceptions from BigQuery  # pylint: disable=broad-exception-caught
-        final_result["error_message"] = f"Invalid SQL: {e}"
+        final_result["error_message"] = f"Could not create temp table: {e}"
 
-    print("\n run_bigquery_validation final_result: \n", final_result)
+    print("\n create_temp_table final_result: \n", final_result)
 
     return final_result
@@ -25,6 +25,7 @@ from data_science.sub_agents.bqml.tools import (
     execute_bqml_code,
     rag_response,
 )
+from data_science.utils import usage_tracker
 from .prompts import return_instructions_bqml
 
 
@@ -89,5 +90,7 @@ root_agent = Agent(
     name="bq_ml_agent",
     instruction=return_instructions_bqml(),
     before_agent_callback=setup_before_agent_call,
+    before_model_callback=usage_tracker.before_model_callback,
+    after_model_callback=usage_tracker.after_model_callback,
     tools=[execute_bqml_code, check_bq_models, call_db_agent, rag_response],
 )
@@ -20,6 +20,7 @@ from google.genai import types
 from google.adk.agents import Agent
 from google.adk.agents.callback_context import CallbackContext
 
+from data_science.utils import usage_tracker
 from .prompts import return_instructions_web_search
 from google.adk.tools import google_search
 
@@ -33,5 +34,7 @@ web_search_agent = Agent(
     instruction=return_instructions_web_search(),
     tools=[google_search],
     before_agent_callback=setup_before_agent_call,
+    before_model_callback=usage_tracker.before_model_callback,
+    after_model_callback=usage_tracker.after_model_callback,
     generate_content_config=types.GenerateContentConfig(temperature=0.2),
 ) 
\ No newline at end of file
@@ -0,0 +1,167 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Vertex AI context caches of the static prefixes of the LLM prompts.
+
+The NL2SQL prompts start with long instructions, few-shot examples and the DDL
+of the dataset, which are the same for every question. The prefix is stored
+once as a `CachedContent`, and the requests only send the question suffix:
+
+    cache_name = context_cache.get_context_cache().get_cache_name(
+        client, model_name, region, prefix
+    )
+
+A cache is keyed by the model, the region and the hash of the prefix, so a new
+cache is created as soon as the prefix changes, e.g. when the schema of the
+dataset is updated, and the cache of the previous version is deleted. Prefixes
+shorter than the minimum size of a cached content are not cached.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from data_science.utils import rate_limiter
+from google import genai
+from google.genai import types
+
+LLM_CONTEXT_CACHE_ENABLED = (
+    os.getenv("LLM_CONTEXT_CACHE_ENABLED", "true").lower() == "true"
+)
+LLM_CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("LLM_CONTEXT_CACHE_TTL_SECONDS", "3600"))
+# Vertex AI rejects cached contents below this number of tokens.
+LLM_CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("LLM_CONTEXT_CACHE_MIN_TOKENS", "1024"))
+# Caches expiring within this number of seconds get their TTL extended.
+REFRESH_MARGIN_SECONDS = 300
+
+
+class ContextCacheManager:
+    """Creates, extends and replaces the context caches of the prompt prefixes.
+
+    The manager keeps one cache per (model, region, prefix kind) and is shared
+    by all threads of the process. Each cache has its own lock, so a slow
+    create or update of one cache does not block the lookups of the others.
+    """
+
+    def __init__(self, ttl_seconds: int = LLM_CONTEXT_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        # (model_name, region, display_name) -> (prefix hash, name, expires_at)
+        self.caches = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def get_cache_name(
+        self,
+        client: genai.Client,
+        model_name: str,
+        region: str,
+        prefix: str,
+        display_name: str = "nl2sql_prefix",
+    ) -> str | None:
+        """Returns the name of the context cache holding a prompt prefix.
+
+        Args:
+            client (genai.Client): A Gen AI client of the region.
+            model_name (str): The model the cache is used with.
+            region (str): The region of the client.
+            prefix (str): The static prefix of the prompts.
+            display_name (str): The kind of prefix, e.g. the prompt template.
+
+        Returns:
+            str: The resource name of the cached content, or None if the
+            prefix is not cached, in which case it must be sent in full.
+        """
+        if not LLM_CONTEXT_CACHE_ENABLED or not model_name:
+            return None
+        if rate_limiter.estimate_tokens(prefix) < LLM_CONTEXT_CACHE_MIN_TOKENS:
+            return None
+        version = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+        key = (model_name, region, display_name)
+        with self.lock:
+            key_lock = self.locks.setdefault(key, threading.Lock())
+        with key_lock:
+            now = time.time()
+            cached_version, name, expires_at = self.caches.get(
+                key, (None, None, 0.0)
+            )
+            if cached_version == version and name is not None:
+                if expires_at - now > REFRESH_MARGIN_SECONDS:
+                    return name
+                try:
+                    client.caches.update(
+                        name=name,
+                        config=types.UpdateCachedContentConfig(
+                            ttl=f"{self.ttl_seconds}s"
+                        ),
+                    )
+                    self.caches[key] = (version, name, now + self.ttl_seconds)
+                    return name
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    logging.warning("Could not extend context cache %s: %s", name, e)
+            elif cached_version == version and expires_at > now:
+                # Creating the cache failed recently, the prefix is sent in full.
+                return None
+
+            if name is not None:
+                try:
+                    client.caches.delete(name=name)
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    logging.info("Could not delete context cache %s: %s", name, e)
+            try:
+                cached_content = client.caches.create(
+                    model=model_name,
+                    config=types.CreateCachedContentConfig(
+                        contents=[
+                            types.Content(
+                                role="user", parts=[types.Part(text=prefix)]
+                            )
+                        ],
+                        display_name=f"{display_name}_{version[:12]}",
+                        ttl=f"{self.ttl_seconds}s",
+                    ),
+                )
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logging.warning(
+                    "Could not create a context cache for %s in %s: %s",
+                    model_name,
+                    region,
+                    e,
+                )
+                self.caches[key] = (version, None, now + self.ttl_seconds)
+                return None
+            print(
+                f"Created context cache {cached_content.name} of {display_name}"
+                f" for {model_name} in {region}"
+            )
+            self.caches[key] = (
+                version,
+                cached_content.name,
+                now + self.ttl_seconds,
+            )
+            return cached_content.name
+
+
+context_cache = None
+context_cache_lock = threading.Lock()
+
+
+def get_context_cache() -> ContextCacheManager:
+    """Returns the context cache manager shared by the process."""
+    global context_cache
+    with context_cache_lock:
+        if context_cache is None:
+            context_cache = ContextCacheManager()
+        return context_cache
@@ -26,7 +26,14 @@ print(env_file_path)
 load_dotenv(dotenv_path=env_file_path)
 
 
-def load_csv_to_bigquery(project_id, dataset_name, table_name, csv_filepath):
+def load_csv_to_bigquery(
+    project_id,
+    dataset_name,
+    table_name,
+    csv_filepath,
+    partition_field=None,
+    clustering_fields=None,
+):
     """Loads a CSV file into a BigQuery table.
 
     Args:
@@ -34,6 +41,8 @@ def load_csv_to_bigquery(project_id, dataset_name, table_name, csv_filepath):
         dataset_name: The name of the BigQuery dataset.
         table_name: The name of the BigQuery table.
         csv_filepath: The path to the CSV file.
+        partition_field: The DATE column to partition the table by, if any.
+        clustering_fields: The columns to cluster the table by, if any.
     """
 
     client = bigquery.Client(project=project_id)
@@ -46,6 +55,12 @@ def load_csv_to_bigquery(project_id, dataset_name, table_name, csv_filepath):
         skip_leading_rows=1,  # Skip the header row
         autodetect=True,  # Automatically detect the schema
     )
+    if partition_field:
+        job_config.time_partitioning = bigquery.TimePartitioning(
+            type_=bigquery.TimePartitioningType.DAY, field=partition_field
+        )
+    if clustering_fields:
+        job_config.clustering_fields = clustering_fields
 
     with open(csv_filepath, "rb") as source_file:
         job = client.load_table_from_file(
@@ -97,7 +112,14 @@ def main():
 
     # Load the train data
     print("Loading train table.")
-    load_csv_to_bigquery(project_id, dataset_name, "train", train_csv_filepath)
+    load_csv_to_bigquery(
+        project_id,
+        dataset_name,
+        "train",
+        train_csv_filepath,
+        partition_field="date",
+        clustering_fields=["country", "store", "product"],
+    )
 
     # Load the test data
     print("Loading test table.")
@@ -0,0 +1,220 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Process-wide rate limiter of the LLM requests.
+
+All LLM requests of the process share one Vertex AI quota of requests and
+tokens per minute. The limiter keeps two token buckets for them, so requests
+wait here instead of failing with 429 errors and backing off.
+
+Requests have a priority class, taken from a context variable:
+
+    with rate_limiter.priority(rate_limiter.Priority.BATCH):
+        model.call_parallel(prompts)
+
+Waiting requests are served by priority, then in arrival order, and lower
+priority classes leave a reserve of the quota unused, so interactive requests
+preempt batch and evaluation traffic.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import enum
+import heapq
+import itertools
+import os
+import threading
+import time
+
+
+class Priority(enum.IntEnum):
+    """The priority classes of LLM requests, the lower the more urgent."""
+
+    INTERACTIVE = 0
+    BATCH = 1
+    EVAL = 2
+
+
+# Requests per minute and tokens per minute of the quota.
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "300"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "2000000"))
+# Share of the quota that only interactive requests may use.
+LLM_INTERACTIVE_RESERVE = float(os.getenv("LLM_INTERACTIVE_RESERVE", "0.2"))
+
+current_priority = contextvars.ContextVar(
+    "llm_priority",
+    default=Priority[os.getenv("LLM_PRIORITY", "INTERACTIVE").upper()],
+)
+
+
+@contextlib.contextmanager
+def priority(priority_class: Priority):
+    """Sets the priority class of the LLM requests made inside the block."""
+    token = current_priority.set(priority_class)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimates the number of tokens of a text, at about 4 characters each."""
+    return max(1, len(text) // 4)
+
+
+class TokenBucket:
+    """A token bucket refilled continuously up to its capacity per minute."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.level = per_minute
+        self.refill_rate = per_minute / 60.0
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        """Adds the tokens refilled since the last update."""
+        self.level = min(
+            self.capacity, self.level + (now - self.updated_at) * self.refill_rate
+        )
+        self.updated_at = now
+
+    def wait_time(self, amount: float, reserve: float) -> float:
+        """Returns the seconds until `amount` can be taken, keeping a reserve."""
+        # Requests larger than the bucket are let through once it is full.
+        amount = min(amount, self.capacity * (1 - reserve))
+        missing = amount + self.capacity * reserve - self.level
+        return max(0.0, missing / self.refill_rate)
+
+
+class RateLimiter:
+    """Limits the requests and tokens per minute, serving waiters by priority.
+
+    The limiter is thread-safe and is shared by sync callers and the event loop
+    of the async LLM requests. Token counts are estimated before a request and
+    corrected with the actual usage afterwards (see `record_usage`).
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = LLM_TOKENS_PER_MINUTE,
+        interactive_reserve: float = LLM_INTERACTIVE_RESERVE,
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.interactive_reserve = interactive_reserve
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.waiters = []
+        self.sequence = itertools.count()
+
+    def _enqueue(self, priority_class: Priority) -> tuple[int, int]:
+        """Queues a waiter and returns its ticket."""
+        ticket = (int(priority_class), next(self.sequence))
+        with self.lock:
+            heapq.heappush(self.waiters, ticket)
+        return ticket
+
+    def _try_acquire(self, ticket: tuple[int, int], tokens: int) -> float:
+        """Takes capacity if it is the turn of the ticket.
+
+        Returns:
+            float: 0 if the capacity was taken, or the seconds to wait before
+            trying again.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            if self.waiters[0] != ticket:
+                return 0.05
+            reserve = 0.0 if ticket[0] == Priority.INTERACTIVE else (
+                self.interactive_reserve
+            )
+            wait_time = max(
+                self.requests.wait_time(1, reserve),
+                self.tokens.wait_time(tokens, reserve),
+            )
+            if wait_time > 0:
+                return wait_time
+            heapq.heappop(self.waiters)
+            self.requests.level -= 1
+            self.tokens.level -= tokens
+            # The next waiter may be able to go right away.
+            self.condition.notify_all()
+            return 0.0
+
+    def _cancel(self, ticket: tuple[int, int]) -> None:
+        """Removes the ticket of a waiter that stopped waiting."""
+        with self.lock:
+            if ticket in self.waiters:
+                self.waiters.remove(ticket)
+                heapq.heapify(self.waiters)
+                self.condition.notify_all()
+
+    def acquire(self, tokens: int, priority_class: Priority | None = None) -> None:
+        """Blocks until a request of `tokens` tokens may be sent.
+
+        Args:
+            tokens (int): The estimated number of tokens of the request.
+            priority_class (Priority): The priority of the request, by default
+              the one of the current context.
+        """
+        ticket = self._enqueue(
+            current_priority.get() if priority_class is None else priority_class
+        )
+        try:
+            while wait_time := self._try_acquire(ticket, tokens):
+                with self.condition:
+                    self.condition.wait(timeout=wait_time)
+        except BaseException:
+            self._cancel(ticket)
+            raise
+
+    async def acquire_async(
+        self, tokens: int, priority_class: Priority | None = None
+    ) -> None:
+        """Waits until a request of `tokens` tokens may be sent, see `acquire`."""
+        ticket = self._enqueue(
+            current_priority.get() if priority_class is None else priority_class
+        )
+        try:
+            while wait_time := self._try_acquire(ticket, tokens):
+                # Waiters of other threads cannot wake up the event loop, so
+                # the queue is polled.
+                await asyncio.sleep(min(wait_time, 0.05))
+        except BaseException:
+            self._cancel(ticket)
+            raise
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int | None) -> None:
+        """Corrects the token bucket with the actual usage of a request."""
+        if actual_tokens is None:
+            return
+        with self.lock:
+            self.tokens.level -= actual_tokens - estimated_tokens
+
+
+rate_limiter = None
+rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Returns the rate limiter shared by all LLM requests of the process."""
+    global rate_limiter
+    with rate_limiter_lock:
+        if rate_limiter is None:
+            rate_limiter = RateLimiter()
+        return rate_limiter
@@ -0,0 +1,191 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Persistent cache of the responses of deterministic LLM prompts.
+
+Responses are keyed by the model, the hash of the prompt and the generation
+config, and stored in a SQLite file that is evicted least recently used first
+once it exceeds its size limit. Entries expire after a TTL. Reads do not write
+to the file: their access times are kept in memory until the next `put`.
+
+Only near-deterministic requests are cached: requests with a temperature above
+`LLM_CACHE_MAX_TEMPERATURE` always reach the model, as do requests made inside
+a `bypass()` block, e.g. when sampling several candidates.
+"""
+
+import contextlib
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_PATH = os.getenv(
+    "LLM_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "data_science", "llm_cache.db"),
+)
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_TEMPERATURE = float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", "0.2"))
+
+bypass_cache = contextvars.ContextVar("llm_bypass_cache", default=False)
+
+
+@contextlib.contextmanager
+def bypass():
+    """Sends the LLM requests made inside the block to the model, uncached."""
+    token = bypass_cache.set(True)
+    try:
+        yield
+    finally:
+        bypass_cache.reset(token)
+
+
+def cache_key(model_name: str, prompt: str, config: dict) -> str:
+    """Returns the content address of a request.
+
+    Args:
+        model_name (str): The name of the model.
+        prompt (str): The prompt.
+        config (dict): The generation config, e.g. the temperature.
+
+    Returns:
+        str: The SHA-256 hash of the model, prompt hash and config.
+    """
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    key = json.dumps(
+        {"model": model_name, "prompt": prompt_hash, "config": config},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """A disk-backed LRU cache of LLM responses with a size limit and TTL."""
+
+    def __init__(
+        self,
+        path: str = LLM_CACHE_PATH,
+        max_bytes: int = LLM_CACHE_MAX_BYTES,
+        ttl_seconds: float = LLM_CACHE_TTL_SECONDS,
+    ):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.access_times = {}
+        self.lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed_at"
+            " ON responses (accessed_at)"
+        )
+        self.connection.commit()
+
+    def get(self, key: str) -> str | None:
+        """Returns the cached response of a key, or None."""
+        with self.lock:
+            now = time.time()
+            row = self.connection.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            response, created_at = row
+            if now - created_at > self.ttl_seconds:
+                # Expired entries are deleted by the next `put`.
+                return None
+            self.access_times[key] = now
+            return response
+
+    def put(self, key: str, response: str) -> None:
+        """Caches a response, evicting the least recently used ones if needed."""
+        size = len(response.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            now = time.time()
+            self.connection.executemany(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                [
+                    (accessed_at, old_key)
+                    for old_key, accessed_at in self.access_times.items()
+                ],
+            )
+            self.access_times.clear()
+            self.connection.execute(
+                "DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,)
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now),
+            )
+            (total_size,) = self.connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            if total_size > self.max_bytes:
+                evicted = 0
+                for old_key, old_size in self.connection.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed_at"
+                ).fetchall():
+                    if total_size <= self.max_bytes:
+                        break
+                    self.connection.execute(
+                        "DELETE FROM responses WHERE key = ?", (old_key,)
+                    )
+                    total_size -= old_size
+                    evicted += 1
+                logging.info("Evicted %d LLM responses from the cache.", evicted)
+            self.connection.commit()
+
+
+response_cache = None
+response_cache_lock = threading.Lock()
+
+
+def get_response_cache(temperature: float) -> ResponseCache | None:
+    """Returns the response cache for a request, or None to bypass it.
+
+    Args:
+        temperature (float): The temperature of the request.
+
+    Returns:
+        ResponseCache: The cache shared by all LLM requests of the process, or
+        None if caching is disabled, bypassed or the temperature is too high.
+    """
+    global response_cache
+    if (
+        not LLM_CACHE_ENABLED
+        or bypass_cache.get()
+        or temperature is None
+        or temperature > LLM_CACHE_MAX_TEMPERATURE
+    ):
+        return None
+    with response_cache_lock:
+        if response_cache is None:
+            response_cache = ResponseCache()
+        return response_cache
@@ -0,0 +1,260 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Token and cost accounting of the LLM calls.
+
+Every LLM call records its model, prompt, cached and output tokens and latency.
+The calls are attributed to the tool, agent and session of a context variable:
+
+    with usage_tracker.tool_scope(tool_context, "initial_bq_nl2sql"):
+        model.call(prompt)
+
+and the turns of the ADK agents are recorded by the `before_model_callback`
+and `after_model_callback` of this module. The totals per model, tool, agent
+and session are returned by `get_usage_tracker().summary()` and logged every
+`LLM_USAGE_LOG_INTERVAL_SECONDS`.
+"""
+
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+
+# List prices in USD per million input, cached input and output tokens, matched
+# by model name prefix. They can be overridden with a JSON object in
+# `LLM_PRICES`, e.g. {"gemini-2.5-flash": [0.3, 0.075, 2.5]}.
+MODEL_PRICES = {
+    "gemini-2.5-pro": (1.25, 0.31, 10.0),
+    "gemini-2.5-flash-lite": (0.1, 0.025, 0.4),
+    "gemini-2.5-flash": (0.3, 0.075, 2.5),
+    "gemini-2.0-flash-lite": (0.075, 0.01875, 0.3),
+    "gemini-2.0-flash": (0.15, 0.0375, 0.6),
+    **{
+        model_name: tuple(prices)
+        for model_name, prices in json.loads(os.getenv("LLM_PRICES", "{}")).items()
+    },
+}
+LLM_USAGE_LOG_INTERVAL_SECONDS = float(
+    os.getenv("LLM_USAGE_LOG_INTERVAL_SECONDS", "60")
+)
+
+# The tool, agent and session the LLM calls of the context are attributed to.
+current_scope = contextvars.ContextVar("llm_usage_scope", default={})
+
+
+@contextlib.contextmanager
+def scope(**attributes):
+    """Attributes the LLM calls made inside the block, e.g. to a tool."""
+    token = current_scope.set({**current_scope.get(), **attributes})
+    try:
+        yield
+    finally:
+        current_scope.reset(token)
+
+
+def _session_id(context) -> str | None:
+    """Returns the session ID of an ADK tool or callback context."""
+    # pylint: disable=protected-access
+    invocation_context = getattr(context, "_invocation_context", None)
+    session = getattr(invocation_context, "session", None)
+    return getattr(session, "id", None)
+
+
+def tool_scope(tool_context, tool_name: str):
+    """Attributes the LLM calls made inside the block to a tool call.
+
+    Args:
+        tool_context (ToolContext): The context of the tool call.
+        tool_name (str): The name of the tool.
+    """
+    return scope(
+        tool=tool_name,
+        agent=tool_context.agent_name,
+        session=_session_id(tool_context),
+    )
+
+
+def _price(model_name: str) -> tuple[float, float, float] | None:
+    """Returns the prices of a model, matching the longest name prefix."""
+    for prefix in sorted(MODEL_PRICES, key=len, reverse=True):
+        if model_name.split("/")[-1].startswith(prefix):
+            return MODEL_PRICES[prefix]
+    return None
+
+
+def estimate_cost(
+    model_name: str, prompt_tokens: int, cached_tokens: int, output_tokens: int
+) -> float:
+    """Estimates the cost in USD of an LLM call, or 0 for unknown models."""
+    prices = _price(model_name or "")
+    if prices is None:
+        return 0.0
+    input_price, cached_price, output_price = prices
+    return (
+        (prompt_tokens - cached_tokens) * input_price
+        + cached_tokens * cached_price
+        + output_tokens * output_price
+    ) / 1e6
+
+
+def _new_totals() -> dict:
+    """Returns empty usage totals."""
+    return {
+        "calls": 0,
+        "prompt_tokens": 0,
+        "cached_tokens": 0,
+        "output_tokens": 0,
+        "latency_seconds": 0.0,
+        "cost_usd": 0.0,
+    }
+
+
+class UsageTracker:
+    """Aggregates the usage of the LLM calls per model, tool, agent and session."""
+
+    GROUPS = ("model", "tool", "agent", "session")
+
+    def __init__(self, log_interval_seconds: float = LLM_USAGE_LOG_INTERVAL_SECONDS):
+        self.log_interval_seconds = log_interval_seconds
+        self.totals = _new_totals()
+        self.groups = {group: {} for group in self.GROUPS}
+        self.logged_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def record(
+        self,
+        model_name: str,
+        usage_metadata,
+        latency_seconds: float | None = None,
+        **attributes,
+    ) -> None:
+        """Records the usage of an LLM call.
+
+        Args:
+            model_name (str): The model of the call.
+            usage_metadata (types.GenerateContentResponseUsageMetadata): The
+              usage metadata of the response, or None if it has none.
+            latency_seconds (float): The latency of the call, if known.
+            **attributes: The tool, agent or session of the call, by default
+              the ones of the current scope.
+        """
+        if usage_metadata is None:
+            return
+        attributes = {**current_scope.get(), **attributes, "model": model_name}
+        prompt_tokens = usage_metadata.prompt_token_count or 0
+        cached_tokens = usage_metadata.cached_content_token_count or 0
+        # Thinking tokens are billed as output tokens.
+        output_tokens = (usage_metadata.candidates_token_count or 0) + (
+            getattr(usage_metadata, "thoughts_token_count", None) or 0
+        )
+        cost = estimate_cost(model_name, prompt_tokens, cached_tokens, output_tokens)
+        with self.lock:
+            for totals in [self.totals] + [
+                self.groups[group].setdefault(attributes[group], _new_totals())
+                for group in self.GROUPS
+                if attributes.get(group) is not None
+            ]:
+                totals["calls"] += 1
+                totals["prompt_tokens"] += prompt_tokens
+                totals["cached_tokens"] += cached_tokens
+                totals["output_tokens"] += output_tokens
+                totals["latency_seconds"] += latency_seconds or 0.0
+                totals["cost_usd"] += cost
+            now = time.monotonic()
+            if now - self.logged_at < self.log_interval_seconds:
+                return
+            self.logged_at = now
+            totals = dict(self.totals)
+        logging.info(
+            "LLM usage: %d calls, %d prompt tokens (%d cached), %d output"
+            " tokens, %.1fs, $%.4f",
+            totals["calls"],
+            totals["prompt_tokens"],
+            totals["cached_tokens"],
+            totals["output_tokens"],
+            totals["latency_seconds"],
+            totals["cost_usd"],
+        )
+
+    def summary(self) -> dict:
+        """Returns the usage totals.
+
+        Returns:
+            dict: The `total` usage, and the usage `by_model`, `by_tool`,
+            `by_agent` and `by_session`. Each usage holds the number of
+            `calls`, the `prompt_tokens`, `cached_tokens` and `output_tokens`,
+            the summed `latency_seconds` and the estimated `cost_usd`.
+        """
+        with self.lock:
+            summary = {"total": dict(self.totals)}
+            for group in self.GROUPS:
+                summary[f"by_{group}"] = {
+                    name: dict(totals) for name, totals in self.groups[group].items()
+                }
+        return summary
+
+
+usage_tracker = None
+usage_tracker_lock = threading.Lock()
+
+
+def get_usage_tracker() -> UsageTracker:
+    """Returns the usage tracker shared by all LLM calls of the process."""
+    global usage_tracker
+    with usage_tracker_lock:
+        if usage_tracker is None:
+            usage_tracker = UsageTracker()
+        return usage_tracker
+
+
+# Start times of the model calls of the agents, per invocation and agent.
+model_call_starts = {}
+model_call_starts_lock = threading.Lock()
+
+
+def before_model_callback(callback_context, llm_request):
+    """Notes the start of a model call of an ADK agent."""
+    del llm_request  # Unused.
+    with model_call_starts_lock:
+        model_call_starts[
+            (callback_context.invocation_id, callback_context.agent_name)
+        ] = time.monotonic()
+
+
+def after_model_callback(callback_context, llm_response):
+    """Records the usage of a model call of an ADK agent.
+
+    Streamed responses are recorded once, with the usage of their last chunk.
+    """
+    if getattr(llm_response, "partial", False):
+        return None
+    with model_call_starts_lock:
+        start_time = model_call_starts.pop(
+            (callback_context.invocation_id, callback_context.agent_name), None
+        )
+    # pylint: disable=protected-access
+    agent = callback_context._invocation_context.agent
+    model = getattr(agent, "model", None)
+    get_usage_tracker().record(
+        model if isinstance(model, str) else getattr(model, "model", str(model)),
+        llm_response.usage_metadata,
+        time.monotonic() - start_time if start_time is not None else None,
+        tool=None,
+        agent=callback_context.agent_name,
+        session=_session_id(callback_context),
+    )
+    return None
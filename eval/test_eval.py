@@ -18,6 +18,8 @@ import pytest
 from dotenv import find_dotenv, load_dotenv
 from google.adk.evaluation.agent_evaluator import AgentEvaluator
 
+from data_science.utils import rate_limiter
+
 pytest_plugins = ("pytest_asyncio",)
 
 
@@ -29,8 +31,10 @@ def load_env():
 @pytest.mark.asyncio
 async def test_eval_simple():
     """Test the agent's basic ability via a session file."""
-    await AgentEvaluator.evaluate(
-        "data_science",
-        os.path.join(os.path.dirname(__file__), "eval_data/simple.test.json"),
-        num_runs=1,
-    )
+    # Evaluation runs must not slow down interactive sessions.
+    with rate_limiter.priority(rate_limiter.Priority.EVAL):
+        await AgentEvaluator.evaluate(
+            "data_science",
+            os.path.join(os.path.dirname(__file__), "eval_data/simple.test.json"),
+            num_runs=1,
+        )
@@ -0,0 +1,148 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for the offline NL2SQL generation of batches of questions."""
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from data_science.sub_agents.bigquery import batch_nl2sql
+from data_science.utils import rate_limiter, usage_tracker
+
+
+def write_lines(path, lines):
+    """Writes the lines of a file."""
+    with open(path, "w", encoding="utf-8") as output_file:
+        output_file.writelines(line + "\n" for line in lines)
+
+
+class FakeBackend:
+    """A backend answering the questions from a dict of SQL."""
+
+    def __init__(self, sql_by_question):
+        self.sql_by_question = sql_by_question
+        self.questions = []
+
+    def run(self, records):
+        for record in records:
+            self.questions.append(record["question"])
+            sql = self.sql_by_question.get(record["question"])
+            yield {
+                **record,
+                "sql": sql,
+                "error": None if sql else "No SQL.",
+            }
+
+
+class TestBatchNl2Sql(unittest.TestCase):
+    """Test cases for the offline NL2SQL generation of batches of questions."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.input_path = os.path.join(directory.name, "questions.jsonl")
+        self.output_path = os.path.join(directory.name, "sql.jsonl")
+
+    def test_read_completed_ids_skips_failed_and_truncated_lines(self):
+        """Only questions whose last result has no error are completed."""
+        write_lines(
+            self.output_path,
+            [
+                json.dumps({"id": "1", "sql": None, "error": "Timeout"}),
+                json.dumps({"id": "1", "sql": "SELECT 1", "error": None}),
+                json.dumps({"id": "2", "sql": "SELECT 2", "error": None}),
+                json.dumps({"id": "2", "sql": None, "error": "Timeout"}),
+                '{"id": "3", "sql": "SEL',
+            ],
+        )
+        self.assertEqual(batch_nl2sql.read_completed_ids(self.output_path), {"1"})
+        self.assertEqual(batch_nl2sql.read_completed_ids(self.input_path), set())
+
+    def test_run_batch_skips_answered_and_retries_failed_questions(self):
+        """A rerun only sends the questions without a successful answer."""
+        write_lines(
+            self.input_path,
+            [
+                json.dumps({"id": "a", "question": "first"}),
+                json.dumps({"question": "second"}),
+                json.dumps({"id": "c", "question": "third"}),
+            ],
+        )
+        backend = FakeBackend({"first": "SELECT 1", "third": "SELECT 3"})
+        counts = batch_nl2sql.run_batch(self.input_path, self.output_path, backend)
+        self.assertEqual(counts, {"skipped": 0, "succeeded": 2, "failed": 1})
+
+        backend = FakeBackend({"second": "SELECT 2"})
+        counts = batch_nl2sql.run_batch(self.input_path, self.output_path, backend)
+        self.assertEqual(backend.questions, ["second"])
+        self.assertEqual(counts, {"skipped": 2, "succeeded": 1, "failed": 0})
+        self.assertEqual(
+            batch_nl2sql.read_completed_ids(self.output_path), {"a", "2", "c"}
+        )
+
+        backend = FakeBackend({})
+        counts = batch_nl2sql.run_batch(self.input_path, self.output_path, backend)
+        self.assertEqual(backend.questions, [])
+        self.assertEqual(counts["skipped"], 3)
+
+    def test_local_backend_generates_in_the_batch_priority_class(self):
+        """Questions are generated as BATCH requests, and errors are kept."""
+        contexts = []
+
+        def generate_sql(question, database_settings):
+            contexts.append(
+                (
+                    rate_limiter.current_priority.get(),
+                    usage_tracker.current_scope.get().get("tool"),
+                    database_settings["bq_project_id"],
+                )
+            )
+            if question == "bad":
+                raise ValueError("Invalid question.")
+            return f"SELECT '{question}'"
+
+        backend = batch_nl2sql.LocalBackend(
+            generate_sql, {"bq_project_id": "project"}, max_workers=2
+        )
+        results = sorted(
+            backend.run(
+                [{"id": "1", "question": "good"}, {"id": "2", "question": "bad"}]
+            ),
+            key=lambda result: result["id"],
+        )
+        self.assertEqual(
+            results,
+            [
+                {"id": "1", "question": "good", "sql": "SELECT 'good'", "error": None},
+                {
+                    "id": "2",
+                    "question": "bad",
+                    "sql": None,
+                    "error": "Invalid question.",
+                },
+            ],
+        )
+        self.assertEqual(
+            contexts,
+            [(rate_limiter.Priority.BATCH, "batch_nl2sql", "project")] * 2,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for the selection of a SQL candidate by agreement."""
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from data_science.sub_agents.bigquery.chase_sql import candidate_selection
+
+
+def result(*rows):
+    """Returns the evaluation of an executed candidate."""
+    return {"query_result": list(rows), "total_rows": len(rows), "error_message": None}
+
+
+class TestCandidateSelection(unittest.TestCase):
+    """Test cases for the selection of a SQL candidate by agreement."""
+
+    def test_result_fingerprint_ignores_column_names_and_row_order(self):
+        """Candidates returning the same values agree on their result."""
+        self.assertEqual(
+            candidate_selection.result_fingerprint(
+                result(
+                    {"country": "FR", "total": 0.1 + 0.2},
+                    {"country": "DE", "total": 1.0},
+                )
+            ),
+            candidate_selection.result_fingerprint(
+                result({"c": "DE", "n": 1.0}, {"c": "FR", "n": 0.3})
+            ),
+        )
+
+    def test_select_by_agreement_picks_the_majority_result(self):
+        """The result of most candidates wins, invalid candidates get no vote."""
+        groups = [("dc_1", 1), ("qp_1", 1), ("dc_2", 2), ("qp_2", 3)]
+        results = {
+            "dc_1": result({"n": 1}),
+            "qp_1": result({"count": 2}),
+            "dc_2": result({"total": 2}),
+            "qp_2": {"query_result": None, "error_message": "Invalid SQL: oops"},
+        }
+        self.assertEqual(
+            candidate_selection.select_by_agreement(groups, results), ("qp_1", 3)
+        )
+
+    def test_select_by_agreement_without_execution_counts_duplicates(self):
+        """Dry-run candidates agree on their SQL, ties go to the first one."""
+        groups = [("dc_1", 1), ("qp_1", 2), ("qp_2", 2)]
+        dry_run = {"query_result": None, "error_message": None}
+        results = {"dc_1": dry_run, "qp_1": dry_run, "qp_2": dry_run}
+        self.assertEqual(
+            candidate_selection.select_by_agreement(groups, results, by_result=False),
+            ("qp_1", 2),
+        )
+        self.assertEqual(candidate_selection.select_by_agreement(groups, {}), (None, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
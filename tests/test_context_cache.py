@@ -0,0 +1,96 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for the context caches of the prompt prefixes."""
+
+import os
+import sys
+import threading
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from data_science.utils import context_cache
+
+PREFIX = "You are a BigQuery SQL expert. " * 200
+
+
+class TestContextCacheManager(unittest.TestCase):
+    """Test cases for the context caches of the prompt prefixes."""
+
+    def setUp(self):
+        self.client = mock.MagicMock()
+        cached_contents = [mock.MagicMock(), mock.MagicMock()]
+        cached_contents[0].name = "cachedContents/1"
+        cached_contents[1].name = "cachedContents/2"
+        self.client.caches.create.side_effect = cached_contents
+        self.manager = context_cache.ContextCacheManager(ttl_seconds=3600)
+
+    def test_get_cache_name_reuses_the_cache_of_a_prefix(self):
+        """A prefix is cached once and its cache is reused."""
+        for _ in range(3):
+            self.assertEqual(
+                self.manager.get_cache_name(self.client, "model", "region", PREFIX),
+                "cachedContents/1",
+            )
+        self.client.caches.create.assert_called_once()
+
+    def test_get_cache_name_replaces_the_cache_of_a_changed_prefix(self):
+        """A new schema version gets a new cache, and the old one is deleted."""
+        self.manager.get_cache_name(self.client, "model", "region", PREFIX)
+        self.assertEqual(
+            self.manager.get_cache_name(
+                self.client, "model", "region", PREFIX + "CREATE TABLE t (x INT64);"
+            ),
+            "cachedContents/2",
+        )
+        self.client.caches.delete.assert_called_once_with(name="cachedContents/1")
+
+    def test_slow_create_does_not_block_other_caches(self):
+        """Lookups of a cache do not wait for the creation of another one."""
+        self.manager.get_cache_name(self.client, "model", "region", PREFIX)
+        release = threading.Event()
+
+        def slow_create(**kwargs):  # pylint: disable=unused-argument
+            release.wait(5)
+            return mock.MagicMock()
+
+        self.client.caches.create.side_effect = slow_create
+        creation = threading.Thread(
+            target=self.manager.get_cache_name,
+            args=(self.client, "model", "region", PREFIX),
+            kwargs={"display_name": "other_prefix"},
+        )
+        creation.start()
+        try:
+            self.assertEqual(
+                self.manager.get_cache_name(self.client, "model", "region", PREFIX),
+                "cachedContents/1",
+            )
+            self.assertTrue(creation.is_alive())
+        finally:
+            release.set()
+            creation.join()
+
+    def test_get_cache_name_skips_short_prefixes(self):
+        """Prefixes below the minimum size of a cached content are sent as is."""
+        self.assertIsNone(
+            self.manager.get_cache_name(self.client, "model", "region", "Short.")
+        )
+        self.client.caches.create.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for the selection of the few-shot examples of CHASE-SQL."""
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from data_science.sub_agents.bigquery.chase_sql import few_shot
+from data_science.sub_agents.bigquery.chase_sql.dc_prompt_template import (
+    DC_EXAMPLES,
+    DC_PROMPT_TEMPLATE,
+)
+
+
+class TestFewShot(unittest.TestCase):
+    """Test cases for the selection of the few-shot examples of CHASE-SQL."""
+
+    def test_select_returns_the_most_similar_examples(self):
+        """The examples sharing the words of the question come first."""
+        index = few_shot.ExampleIndex(DC_EXAMPLES)
+        examples = index.select(
+            "How many flights from the airport of San Diego in August?",
+            k=2,
+            token_budget=10_000,
+        )
+        self.assertEqual(len(examples), 2)
+        self.assertIn("airlines.Airlines", examples[0])
+
+    def test_select_stays_within_the_token_budget(self):
+        """Examples over the budget are skipped, but one example is kept."""
+        index = few_shot.ExampleIndex(DC_EXAMPLES)
+        examples = index.select("Employees earning over 100000", k=8, token_budget=2000)
+        self.assertIn("retails.employees", examples[0])
+        self.assertLessEqual(sum(len(example) // 4 for example in examples), 2000)
+        self.assertEqual(len(index.select("flights", k=3, token_budget=0)), 1)
+        self.assertEqual(index.select("flights", k=0, token_budget=2000), [])
+
+    def test_selected_examples_shrink_the_prompt(self):
+        """The prompt with the selected examples is much shorter than with all."""
+        question = "Which restaurants serve thai food in Albany?"
+        full_prompt = DC_PROMPT_TEMPLATE.format(
+            SCHEMA="",
+            EXAMPLES=few_shot.select_examples(
+                DC_EXAMPLES, question, k=8, token_budget=10**6
+            ),
+            QUESTION=question,
+            BQ_PROJECT_ID="project",
+        )
+        prompt = DC_PROMPT_TEMPLATE.format(
+            SCHEMA="",
+            EXAMPLES=few_shot.select_examples(DC_EXAMPLES, question),
+            QUESTION=question,
+            BQ_PROJECT_ID="project",
+        )
+        self.assertIn("restaurant.generalinfo", prompt)
+        self.assertLess(len(prompt) * 3, len(full_prompt))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for the routing of the LLM requests across regions."""
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from data_science.sub_agents.bigquery.chase_sql import llm_routing
+
+MODEL = "gemini-2.5-flash"
+
+
+class TestRegionRouter(unittest.TestCase):
+    """Test cases for the routing of the LLM requests across regions."""
+
+    def setUp(self):
+        self.router = llm_routing.RegionRouter(["fast", "slow", "flaky"])
+        for _ in range(5):
+            self.router.record(MODEL, "fast", latency=1.0)
+            self.router.record(MODEL, "slow", latency=5.0)
+            self.router.record(MODEL, "flaky", latency=0.5)
+
+    @mock.patch.object(llm_routing, "EXPLORATION_RATE", 0.0)
+    def test_prefers_fast_regions(self):
+        """Requests go to the region with the lowest latency."""
+        self.assertEqual(self.router.choose(MODEL), "flaky")
+        self.assertEqual(self.router.choose(MODEL, exclude=("flaky",)), "fast")
+
+    @mock.patch.object(llm_routing, "EXPLORATION_RATE", 0.0)
+    def test_ejects_failing_regions(self):
+        """Regions with consecutive errors are not routed to."""
+        for _ in range(llm_routing.EJECTION_CONSECUTIVE_ERRORS):
+            self.router.record(MODEL, "flaky", error=True)
+        self.assertEqual(self.router.choose(MODEL), "fast")
+        metrics = self.router.metrics()[f"{MODEL}/flaky"]
+        self.assertTrue(metrics["ejected"])
+        self.assertEqual(metrics["ejections"], 1)
+        self.assertEqual(metrics["errors"], llm_routing.EJECTION_CONSECUTIVE_ERRORS)
+
+    @mock.patch.object(llm_routing, "EXPLORATION_RATE", 0.0)
+    def test_unknown_and_failing_regions_get_a_prior_score(self):
+        """Regions without a latency are not preferred over known fast ones."""
+        router = llm_routing.RegionRouter(["fast", "median", "slow", "new", "broken"])
+        router.record(MODEL, "fast", latency=1.0)
+        router.record(MODEL, "median", latency=2.0)
+        router.record(MODEL, "slow", latency=10.0)
+        router.record(MODEL, "broken", error=True)
+        self.assertEqual(router.choose(MODEL), "fast")
+        # The unknown region scores the median latency with a penalty, and the
+        # region with only errors is penalized by its error rate too.
+        self.assertEqual(router.choose(MODEL, exclude=("fast", "median")), "new")
+        self.assertEqual(
+            router.choose(MODEL, exclude=("fast", "median", "new")), "broken"
+        )
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """Test cases for the circuit breakers of the LLM requests."""
+
+    @mock.patch.object(llm_routing, "CIRCUIT_OPEN_SECONDS", 0.0)
+    def test_opens_after_failures_and_probes_recovery(self):
+        """The circuit opens after failures and closes after a good trial."""
+        breaker = llm_routing.CircuitBreaker()
+        for _ in range(llm_routing.CIRCUIT_FAILURE_THRESHOLD):
+            self.assertTrue(breaker.allow_request())
+            breaker.record(False)
+        self.assertEqual(breaker.state, breaker.OPEN)
+        # Half-open: a single trial request is let through.
+        self.assertEqual(breaker.allow_request(), breaker.TRIAL)
+        self.assertIsNone(breaker.allow_request())
+        breaker.record(True, latency=1.0, admission=breaker.TRIAL)
+        self.assertEqual(breaker.state, breaker.CLOSED)
+
+    @mock.patch.object(llm_routing, "CIRCUIT_OPEN_SECONDS", 0.0)
+    def test_only_the_trial_ends_the_trial(self):
+        """Late outcomes of other requests do not admit a second trial."""
+        breaker = llm_routing.CircuitBreaker()
+        admissions = [
+            breaker.allow_request()
+            for _ in range(llm_routing.CIRCUIT_FAILURE_THRESHOLD + 1)
+        ]
+        for admission in admissions[:-1]:
+            breaker.record(False, admission=admission)
+        self.assertEqual(breaker.allow_request(), breaker.TRIAL)
+        # The straggler was admitted before the circuit opened.
+        breaker.record(None, admission=admissions[-1])
+        self.assertIsNone(breaker.allow_request())
+
+    def test_latency_slo_breaches_count_as_failures(self):
+        """Responses slower than the latency SLO count as failures."""
+        breaker = llm_routing.CircuitBreaker()
+        for _ in range(llm_routing.CIRCUIT_FAILURE_THRESHOLD):
+            breaker.allow_request()
+            breaker.record(True, latency=llm_routing.LATENCY_SLO_SECONDS + 1)
+        self.assertFalse(breaker.allow_request())
+
+
+if __name__ == "__main__":
+    unittest.main()
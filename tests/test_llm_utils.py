@@ -0,0 +1,332 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for the LLM utils of the CHASE-SQL agent."""
+
+import asyncio
+import os
+import sys
+import time
+import types
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from data_science.sub_agents.bigquery.chase_sql import llm_utils
+
+
+class StatusError(Exception):
+    """An API error with an HTTP status code."""
+
+    def __init__(self, code: int):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+class FakeStream:
+    """A stream of response chunks, each with the text of some candidates."""
+
+    def __init__(self, chunks: list[dict[int, str]]):
+        self.chunks = chunks
+        self.chunks_read = 0
+        self.closed = False
+
+    async def start(self):
+        return self
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.chunks_read == len(self.chunks):
+            raise StopAsyncIteration
+        chunk = self.chunks[self.chunks_read]
+        self.chunks_read += 1
+        return types.SimpleNamespace(
+            usage_metadata=None,
+            candidates=[
+                types.SimpleNamespace(
+                    index=index,
+                    content=types.SimpleNamespace(
+                        parts=[types.SimpleNamespace(text=text)]
+                    ),
+                )
+                for index, text in chunk.items()
+            ],
+        )
+
+    async def aclose(self):
+        self.closed = True
+
+
+class TestRetryPolicy(unittest.TestCase):
+    """Test cases for the retry policy of the LLM requests."""
+
+    def _run(self, policy, failures):
+        """Runs a request failing with the given errors, then succeeding."""
+        attempts = []
+
+        async def request():
+            attempts.append(time.monotonic())
+            if len(attempts) <= len(failures):
+                raise failures[len(attempts) - 1]
+            return "response"
+
+        return asyncio.run(policy.run(request)), attempts
+
+    def test_retries_retryable_errors(self):
+        """Quota and server errors are retried."""
+        policy = llm_utils.RetryPolicy(base_delay=0.01, max_delay=0.01)
+        result, attempts = self._run(policy, [StatusError(429), StatusError(503)])
+        self.assertEqual(result, "response")
+        self.assertEqual(len(attempts), 3)
+
+    def test_does_not_retry_invalid_requests(self):
+        """Invalid requests fail right away."""
+        policy = llm_utils.RetryPolicy(base_delay=0.01, max_delay=0.01)
+        with self.assertRaises(StatusError):
+            self._run(policy, [StatusError(400)])
+
+    def test_respects_deadline_of_caller(self):
+        """No attempt is made after the deadline of the caller."""
+        policy = llm_utils.RetryPolicy(max_attempts=100, base_delay=0.05)
+
+        async def run():
+            with llm_utils.deadline(0.2):
+                return await policy.run(self._slow_failure)
+
+        start_time = time.monotonic()
+        with self.assertRaises((StatusError, TimeoutError)):
+            asyncio.run(run())
+        self.assertLess(time.monotonic() - start_time, 0.5)
+
+    @staticmethod
+    async def _slow_failure():
+        await asyncio.sleep(0.05)
+        raise StatusError(503)
+
+
+class TestLatencyTracker(unittest.TestCase):
+    """Test cases for the hedging decisions of the LLM requests."""
+
+    def test_hedge_delay_is_latency_percentile(self):
+        """Requests are hedged at the given percentile of recent latencies."""
+        policy = llm_utils.HedgingPolicy(percentile=0.9, min_samples=10)
+        tracker = llm_utils.LatencyTracker()
+        for latency in range(1, 10):
+            tracker.record_latency(latency)
+        self.assertIsNone(tracker.hedge_delay(policy))
+        tracker.record_latency(10)
+        self.assertEqual(tracker.hedge_delay(policy), 10)
+
+    def test_hedge_rate_is_capped(self):
+        """At most the maximum hedge rate of the requests are hedged."""
+        policy = llm_utils.HedgingPolicy(max_hedge_rate=0.1)
+        tracker = llm_utils.LatencyTracker()
+        hedges = sum(tracker.record_request(policy, True) for _ in range(100))
+        self.assertEqual(hedges, 10)
+
+    def test_hedge_delay_starts_when_the_request_is_sent(self):
+        """Time spent waiting for a request slot does not trigger a hedge."""
+        model = llm_utils.GeminiModel(
+            model_name="queued-model",
+            hedging=llm_utils.HedgingPolicy(min_samples=1, max_hedge_rate=1.0),
+        )
+        llm_utils.latency_trackers["queued-model"].record_latency(0.1)
+        regions = []
+
+        async def fake_generate(
+            prompt, region, candidate_count=1, accept=None, sent=None, answered_by=None
+        ):  # pylint: disable=unused-argument
+            regions.append(region)
+            await asyncio.sleep(0.2)  # Waiting for a request slot.
+            if sent is not None:
+                sent.set()
+            await asyncio.sleep(0.05)
+            return region
+
+        model._generate = fake_generate  # pylint: disable=protected-access
+        response = asyncio.run(
+            model._generate_hedged("prompt")  # pylint: disable=protected-access
+        )
+        self.assertEqual(response, model.region)
+        self.assertEqual(regions, [model.region])
+
+
+class TestCallParallel(unittest.TestCase):
+    """Test cases for the parallel calls of the model."""
+
+    def test_returns_first_valid_streamed_candidate(self):
+        """With a validator, a streamed candidate wins as soon as it is valid."""
+        model = llm_utils.GeminiModel(model_name="model", stream_sql=True)
+        chunks = [
+            {0: "```sql\nSELECT bad\n```", 1: "```sql\nSELECT"},
+            {1: " good\n```"},
+            {2: "```sql\nSELECT late\n```"},
+        ]
+        stream = FakeStream(chunks)
+        client = types.SimpleNamespace(
+            aio=types.SimpleNamespace(
+                models=types.SimpleNamespace(
+                    generate_content_stream=lambda **kwargs: stream.start()
+                )
+            )
+        )
+
+        async def fake_generate(
+            prompt, region, candidate_count=1, accept=None, answered_by=None
+        ):  # pylint: disable=unused-argument,protected-access
+            response = await model._generate_stream(
+                client, "model", prompt, time.monotonic(), candidate_count, accept
+            )
+            return response
+
+        model._generate = fake_generate  # pylint: disable=protected-access
+        responses = asyncio.run(
+            model._acall_candidates(  # pylint: disable=protected-access
+                "prompt",
+                3,
+                parser_func=lambda text: text.strip("`\nsql"),
+                validator=lambda sql: "good" in sql,
+            )
+        )
+        self.assertEqual(responses, ["SELECT good"])
+        self.assertEqual(stream.chunks_read, 2)
+        self.assertTrue(stream.closed)
+
+    def test_splits_candidates_over_requests(self):
+        """Candidates beyond the cap of a request are split across requests."""
+        model = llm_utils.GeminiModel(model_name="model")
+        candidate_counts = []
+
+        async def fake_acall_once(prompt, candidate_count=1, accept=None):
+            # pylint: disable=unused-argument
+            candidate_counts.append(candidate_count)
+            return [f"{prompt} {index}" for index in range(candidate_count)]
+
+        model._acall_once = fake_acall_once  # pylint: disable=protected-access
+        responses = asyncio.run(
+            model._acall_candidates(  # pylint: disable=protected-access
+                "SELECT", llm_utils.LLM_MAX_CANDIDATE_COUNT + 2, parser_func=str.lower
+            )
+        )
+        self.assertEqual(
+            sorted(candidate_counts), [2, llm_utils.LLM_MAX_CANDIDATE_COUNT]
+        )
+        self.assertEqual(len(responses), llm_utils.LLM_MAX_CANDIDATE_COUNT + 2)
+        self.assertEqual(responses[0], "select 0")
+
+
+class FakeResponseCache:
+    """A response cache in a dict."""
+
+    def __init__(self):
+        self.responses = {}
+
+    def get(self, key):
+        return self.responses.get(key)
+
+    def put(self, key, response):
+        self.responses[key] = response
+
+
+class TestResponseCaching(unittest.TestCase):
+    """Test cases for the caching of the responses of the model."""
+
+    def setUp(self):
+        self.cache = FakeResponseCache()
+        patcher = mock.patch.object(
+            llm_utils.response_cache,
+            "get_response_cache",
+            lambda temperature: self.cache,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.model = llm_utils.GeminiModel(model_name="primary-model")
+
+    def _call(self, answering_model, responses):
+        """Calls the model, answered by the given model with the responses."""
+
+        async def fake_acall_once(prompt, answered_by=None):
+            # pylint: disable=unused-argument
+            answered_by.append(answering_model)
+            return responses
+
+        self.model._acall_once = fake_acall_once  # pylint: disable=protected-access
+        return asyncio.run(
+            self.model._acall("prompt")  # pylint: disable=protected-access
+        )
+
+    def test_caches_responses_of_the_model(self):
+        """Responses of the model itself are cached."""
+        self.assertEqual(self._call("primary-model", ["SELECT 1"]), "SELECT 1")
+        self.assertEqual(list(self.cache.responses.values()), ["SELECT 1"])
+
+    def test_does_not_cache_fallback_responses(self):
+        """Responses of the fallback model are not served for the model."""
+        self.assertEqual(self._call("fallback-model", ["SELECT 1"]), "SELECT 1")
+        self.assertEqual(self.cache.responses, {})
+
+    def test_response_without_candidates_is_none(self):
+        """A response without candidates, e.g. a blocked one, has no text."""
+        self.assertIsNone(self._call("primary-model", []))
+        self.assertEqual(self.cache.responses, {})
+
+
+class TestGetGeminiModel(unittest.TestCase):
+    """Test cases for the pool of shared models."""
+
+    def test_pool_is_keyed_by_stable_settings(self):
+        """Models with a context cache do not grow the pool."""
+        model = llm_utils.get_gemini_model("pooled-model", temperature=0.1)
+        self.assertIs(
+            llm_utils.get_gemini_model("pooled-model", temperature=0.1), model
+        )
+        pool_size = len(llm_utils.gemini_models)
+        cached_models = [
+            llm_utils.get_gemini_model(
+                "pooled-model", cache_name=f"cache-{index}", temperature=0.1
+            )
+            for index in range(3)
+        ]
+        self.assertEqual(len(llm_utils.gemini_models), pool_size)
+        self.assertEqual(
+            [cached_model.cache_name for cached_model in cached_models],
+            ["cache-0", "cache-1", "cache-2"],
+        )
+        self.assertIsNone(model.cache_name)
+        self.assertEqual(cached_models[0].temperature, 0.1)
+
+
+class TestSqlFenceDetector(unittest.TestCase):
+    """Test cases for the early cut-off of streamed responses."""
+
+    def test_detects_fences_split_across_chunks(self):
+        """The SQL block is complete once its closing fence arrives."""
+        detector = llm_utils.SqlFenceDetector()
+        chunks = ["Sub-question 1: ...\n`", "``s", "ql\nSELECT 1\n`", "``\nMore"]
+        completed = [detector.feed(chunk) for chunk in chunks]
+        self.assertEqual(completed, [False, False, False, True])
+        self.assertEqual(detector.text, "Sub-question 1: ...\n```sql\nSELECT 1\n```")
+
+    def test_ignores_other_code_blocks(self):
+        """Only a ```sql block ends the stream."""
+        detector = llm_utils.SqlFenceDetector()
+        self.assertFalse(detector.feed("```python\nx = 1\n```\n"))
+        self.assertTrue(detector.feed("```sql\nSELECT 1\n```"))
+
+
+if __name__ == "__main__":
+    unittest.main()
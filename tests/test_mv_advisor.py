@@ -0,0 +1,109 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for the materialized view advisor of the database agent."""
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from data_science.sub_agents.bigquery import mv_advisor
+
+TABLE = "my-project.forecasting_sticker_sales.train"
+
+
+def rollup(dimensions, aggregate="SUM(num_sold)", where=""):
+    """Returns a rollup query of the train table."""
+    columns = "".join(f"{dimension}, " for dimension in dimensions)
+    group_by = f" GROUP BY {', '.join(dimensions)}" if dimensions else ""
+    return f"SELECT {columns}{aggregate} FROM `{TABLE}`{where}{group_by}"
+
+
+class FakeClient:
+    """A BigQuery client recording the queries it runs."""
+
+    def __init__(self):
+        self.queries = []
+
+    def query(self, sql_string):
+        self.queries.append(sql_string)
+        return self
+
+    def result(self):
+        return []
+
+
+class TestMvAdvisor(unittest.TestCase):
+    """Test cases for the materialized view advisor of the database agent."""
+
+    def test_clusters_rollups_into_the_most_detailed_view(self):
+        """Coarser rollups join the view of a finer one that answers them."""
+        queries = (
+            [rollup(["country", "store"])] * 2
+            + [rollup(["country"], "AVG(num_sold)")] * 2
+            + [rollup(["store"], where=" WHERE country = 'Canada'")]
+            + [rollup(["product"])]
+        )
+        proposals = mv_advisor.propose_materialized_views(queries, min_queries=3)
+        self.assertEqual(len(proposals), 1)
+        proposal = proposals[0]
+        self.assertEqual(proposal["name"], "mv_train_by_country_store")
+        self.assertEqual(proposal["table"], TABLE)
+        self.assertEqual(proposal["dimensions"], ["country", "store"])
+        self.assertEqual(proposal["query_count"], 5)
+        self.assertEqual(
+            proposal["measures"], ["COUNT(*)", "COUNT(num_sold)", "SUM(num_sold)"]
+        )
+        self.assertIn("GROUP BY", proposal["sql"])
+
+    def test_skips_rollups_answered_by_existing_views(self):
+        """Queries routed to an existing view do not count for new views."""
+        queries = [rollup(["country"])] * 3
+        [proposal] = mv_advisor.propose_materialized_views(queries)
+        existing_view = {
+            "name": f"my-project.forecasting_sticker_sales.{proposal['name']}",
+            "table": proposal["table"],
+            "dimensions": proposal["dimensions"],
+            "measures": proposal["measures"],
+        }
+        self.assertEqual(
+            mv_advisor.propose_materialized_views(
+                queries, existing_views=[existing_view]
+            ),
+            [],
+        )
+
+    def test_create_materialized_view_partitions_like_the_base_table(self):
+        """The view keeps the date partitioning and clusters by dimensions."""
+        [proposal] = mv_advisor.propose_materialized_views(
+            [rollup(["date", "country"])] * 3
+        )
+        client = FakeClient()
+        name = mv_advisor.create_materialized_view(
+            client,
+            "my-project",
+            "views",
+            proposal,
+            {TABLE: {"partition_column": "date", "partition_column_type": "DATE"}},
+        )
+        self.assertEqual(name, "my-project.views.mv_train_by_country_date")
+        [ddl] = client.queries
+        self.assertIn("PARTITION BY `date`\nCLUSTER BY `country`\n", ddl)
+        self.assertIn('"dimensions": ["country", "date"]', ddl)
+
+
+if __name__ == "__main__":
+    unittest.main()
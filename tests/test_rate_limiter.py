@@ -0,0 +1,76 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for the rate limiter of the LLM requests."""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from data_science.utils import rate_limiter
+from data_science.utils.rate_limiter import Priority, RateLimiter
+
+
+class TestRateLimiter(unittest.TestCase):
+    """Test cases for the rate limiter of the LLM requests."""
+
+    def test_acquire_waits_for_refill(self):
+        """Requests beyond the bucket wait until it is refilled."""
+        limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=10**6)
+        start_time = time.monotonic()
+        for _ in range(602):
+            limiter.acquire(1, Priority.INTERACTIVE)
+        # 600 requests per minute refill one request every 0.1 seconds.
+        self.assertGreaterEqual(time.monotonic() - start_time, 0.15)
+
+    def test_batch_requests_leave_interactive_reserve(self):
+        """Batch requests do not use the reserve of interactive requests."""
+        limiter = RateLimiter(
+            requests_per_minute=60, tokens_per_minute=100, interactive_reserve=0.5
+        )
+        limiter.acquire(50, Priority.BATCH)
+        acquired = threading.Event()
+
+        def acquire_batch():
+            limiter.acquire(10, Priority.BATCH)
+            acquired.set()
+
+        threading.Thread(target=acquire_batch, daemon=True).start()
+        self.assertFalse(acquired.wait(timeout=0.2))
+        # Interactive requests may still use the reserve.
+        limiter.acquire(40, Priority.INTERACTIVE)
+
+    def test_priority_context_applies_to_async_requests(self):
+        """The priority class of the context is used by default."""
+        limiter = RateLimiter(
+            requests_per_minute=60, tokens_per_minute=100, interactive_reserve=0.5
+        )
+
+        async def acquire():
+            await limiter.acquire_async(30)
+            with rate_limiter.priority(Priority.EVAL):
+                await asyncio.wait_for(limiter.acquire_async(30), timeout=0.2)
+
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(acquire())
+        self.assertEqual(limiter.waiters, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
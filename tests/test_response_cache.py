@@ -0,0 +1,92 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for the persistent LLM response cache."""
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from data_science.utils import response_cache
+
+
+class TestResponseCache(unittest.TestCase):
+    """Test cases for the persistent LLM response cache."""
+
+    def test_cache_key_depends_on_model_prompt_and_config(self):
+        """Requests differing in any part get different keys."""
+        key = response_cache.cache_key("model", "prompt", {"temperature": 0.1})
+        self.assertEqual(
+            key, response_cache.cache_key("model", "prompt", {"temperature": 0.1})
+        )
+        self.assertNotEqual(
+            key, response_cache.cache_key("other", "prompt", {"temperature": 0.1})
+        )
+        self.assertNotEqual(
+            key, response_cache.cache_key("model", "other", {"temperature": 0.1})
+        )
+        self.assertNotEqual(
+            key, response_cache.cache_key("model", "prompt", {"temperature": 0.0})
+        )
+
+    def test_get_returns_cached_responses_until_they_expire(self):
+        """Cached responses are returned within their TTL only."""
+        cache = response_cache.ResponseCache(":memory:", ttl_seconds=60)
+        self.assertIsNone(cache.get("key"))
+        with mock.patch.object(response_cache.time, "time", return_value=1000.0):
+            cache.put("key", "SELECT 1")
+            self.assertEqual(cache.get("key"), "SELECT 1")
+        with mock.patch.object(response_cache.time, "time", return_value=1061.0):
+            self.assertIsNone(cache.get("key"))
+
+    def test_get_does_not_write(self):
+        """Reads keep their access times in memory instead of committing."""
+        cache = response_cache.ResponseCache(":memory:", ttl_seconds=60)
+        cache.put("key", "SELECT 1")
+        changes = cache.connection.total_changes
+        self.assertEqual(cache.get("key"), "SELECT 1")
+        self.assertEqual(cache.connection.total_changes, changes)
+        self.assertIn("key", cache.access_times)
+
+    def test_put_evicts_least_recently_used_responses(self):
+        """The least recently used responses are evicted above the size limit."""
+        cache = response_cache.ResponseCache(":memory:", max_bytes=10, ttl_seconds=60)
+        with mock.patch.object(response_cache.time, "time", return_value=1.0):
+            cache.put("first", "aaaa")
+        with mock.patch.object(response_cache.time, "time", return_value=2.0):
+            cache.put("second", "bbbb")
+        with mock.patch.object(response_cache.time, "time", return_value=3.0):
+            cache.get("first")
+        with mock.patch.object(response_cache.time, "time", return_value=4.0):
+            cache.put("third", "cccc")
+            self.assertEqual(cache.get("first"), "aaaa")
+            self.assertIsNone(cache.get("second"))
+            self.assertEqual(cache.get("third"), "cccc")
+
+    def test_get_response_cache_bypasses_sampled_requests(self):
+        """Requests with a high temperature or in a bypass block are uncached."""
+        with mock.patch.object(
+            response_cache, "response_cache", response_cache.ResponseCache(":memory:")
+        ):
+            self.assertIsNotNone(response_cache.get_response_cache(0.1))
+            self.assertIsNone(response_cache.get_response_cache(0.5))
+            with response_cache.bypass():
+                self.assertIsNone(response_cache.get_response_cache(0.1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,376 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for the SQL rewrites of the database agent."""
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from data_science.sub_agents.bigquery import sql_rewriter
+
+TRAIN_TABLE = "`my-project.forecasting_sticker_sales.train`"
+SCHEMA = {
+    "my-project": {
+        "forecasting_sticker_sales": {
+            "train": {
+                "id": "INT64",
+                "date": "DATE",
+                "country": "STRING",
+                "store": "STRING",
+                "product": "STRING",
+                "num_sold": "FLOAT64",
+            }
+        }
+    }
+}
+
+TABLE_METADATA = {
+    "my-project.forecasting_sticker_sales.train": {
+        "partition_column": "date",
+        "partition_type": "DAY",
+        "partition_column_type": "DATE",
+        "range_partitioning": None,
+        "clustering_fields": ["country", "store", "product"],
+        "require_partition_filter": False,
+        "latest_partition": "2016-12-31",
+    }
+}
+
+
+class TestSqlRewriter(unittest.TestCase):
+    """Test cases for the SQL rewrites of the database agent."""
+
+    def test_canonicalize_sql_ignores_formatting_and_aliases(self):
+        """Equivalent queries get the same canonical text."""
+        first = sql_rewriter.canonicalize_sql(
+            "select t.country, sum(t.num_sold) as total\n"
+            f"from {TRAIN_TABLE} t group by t.country -- comment"
+        )
+        second = sql_rewriter.canonicalize_sql(
+            "SELECT  S.country ,SUM( S.num_sold )  AS total FROM "
+            "my-project.forecasting_sticker_sales.train AS S GROUP BY S.country;"
+        )
+        self.assertEqual(first, second)
+
+    def test_canonicalize_sql_quotes_identifiers_and_tables(self):
+        """Identifiers are quoted, qualified tables as a whole."""
+        self.assertEqual(
+            sql_rewriter.canonicalize_sql(
+                "select date_trunc(date, month) d, count(*) "
+                "from my-project.forecasting_sticker_sales.train group by 1"
+            ),
+            "SELECT\n"
+            "  DATE_TRUNC(`date`, MONTH) AS `d`,\n"
+            "  COUNT(*)\n"
+            f"FROM {TRAIN_TABLE}\n"
+            "GROUP BY\n"
+            "  1",
+        )
+
+    def test_canonicalize_sql_renames_subquery_aliases(self):
+        """The aliases of subqueries are renamed like those of tables."""
+        self.assertEqual(
+            sql_rewriter.canonicalize_sql(
+                f"SELECT x.c FROM (SELECT country AS c FROM {TRAIN_TABLE}) AS x"
+            ),
+            sql_rewriter.canonicalize_sql(
+                f"SELECT y.c FROM (SELECT country AS c FROM {TRAIN_TABLE}) y"
+            ),
+        )
+
+    def test_canonicalize_sql_keeps_clashing_aliases(self):
+        """Aliases are kept if renaming them could change the query."""
+        for sql in (
+            f"SELECT t FROM {TRAIN_TABLE} AS t",
+            f"SELECT a.t0 FROM {TRAIN_TABLE} AS a",
+        ):
+            with self.subTest(sql=sql):
+                canonical = sql_rewriter.canonicalize_sql(sql)
+                self.assertNotIn("AS `t0`", canonical)
+
+    def test_canonicalize_sql_keeps_unparsable_sql(self):
+        """SQL that cannot be parsed is returned unchanged."""
+        sql = "SELECT FROM WHERE"
+        self.assertEqual(sql_rewriter.canonicalize_sql(sql), sql)
+
+    def test_group_equivalent_queries_counts_duplicates(self):
+        """Candidates are deduplicated by their canonical form."""
+        first = f"SELECT t.country FROM {TRAIN_TABLE} t"
+        groups = sql_rewriter.group_equivalent_queries(
+            [
+                first,
+                f"SELECT MAX(num_sold) FROM {TRAIN_TABLE}",
+                f"select s.country\nfrom {TRAIN_TABLE} as s;",
+                "Timeout",
+                None,
+            ]
+        )
+        self.assertEqual(
+            groups, [(first, 2), (f"SELECT MAX(num_sold) FROM {TRAIN_TABLE}", 1)]
+        )
+
+    def test_prune_columns_drops_unused_cte_columns(self):
+        """Columns of a CTE that the outer query ignores are pruned."""
+        sql = sql_rewriter.prune_columns(
+            f"WITH base AS (SELECT * FROM {TRAIN_TABLE}) "
+            "SELECT country, SUM(num_sold) AS TotalSold FROM base GROUP BY country",
+            SCHEMA,
+        )
+        self.assertNotIn("*", sql)
+        self.assertNotIn("store", sql)
+        self.assertIn("`TotalSold`", sql)
+
+    def test_prune_columns_keeps_sql_reading_the_same_columns(self):
+        """Queries whose rewrite would read the same columns are kept."""
+        for sql in (
+            f"SELECT * FROM {TRAIN_TABLE}",
+            f"SELECT t.country, num_sold FROM {TRAIN_TABLE} AS t",
+            f"WITH base AS (SELECT country FROM {TRAIN_TABLE}) SELECT * FROM base",
+        ):
+            self.assertEqual(sql_rewriter.prune_columns(sql, SCHEMA), sql)
+
+    def test_prune_columns_keeps_sql_with_unknown_columns(self):
+        """SQL that does not match the schema is returned unchanged."""
+        sql = f"SELECT unknown_column FROM {TRAIN_TABLE}"
+        self.assertEqual(sql_rewriter.prune_columns(sql, SCHEMA), sql)
+
+    def test_validate_sql_checks_columns_against_schema(self):
+        """Queries must parse and reference columns of the schema."""
+        self.assertTrue(
+            sql_rewriter.validate_sql(
+                f"SELECT country, SUM(num_sold) FROM {TRAIN_TABLE} GROUP BY 1",
+                SCHEMA,
+            )
+        )
+        self.assertFalse(
+            sql_rewriter.validate_sql(f"SELECT revenue FROM {TRAIN_TABLE}", SCHEMA)
+        )
+        self.assertFalse(sql_rewriter.validate_sql("SELECT FROM WHERE", SCHEMA))
+        self.assertFalse(sql_rewriter.validate_sql("SELECT total FROM sales", SCHEMA))
+
+    def test_validate_sql_accepts_session_tables(self):
+        """Temp tables of the session are accepted, known columns still checked."""
+        self.assertTrue(
+            sql_rewriter.validate_sql("SELECT total FROM _SESSION.totals", SCHEMA)
+        )
+        join_sql = (
+            "SELECT total, t.{column} FROM _SESSION.totals AS s "
+            f"JOIN {TRAIN_TABLE} AS t USING (country)"
+        )
+        self.assertTrue(
+            sql_rewriter.validate_sql(join_sql.format(column="store"), SCHEMA)
+        )
+        self.assertFalse(
+            sql_rewriter.validate_sql(join_sql.format(column="revenue"), SCHEMA)
+        )
+
+    def test_check_partition_filters_warns_about_full_scans(self):
+        """Scans of a partitioned table without a partition filter are found."""
+        sql = f"SELECT country, SUM(num_sold) FROM {TRAIN_TABLE} GROUP BY country"
+        rewritten_sql, findings = sql_rewriter.check_partition_filters(
+            sql, TABLE_METADATA
+        )
+        self.assertEqual(rewritten_sql, sql)
+        self.assertEqual(len(findings), 1)
+        self.assertEqual(findings[0]["partition_column"], "date")
+
+    def test_check_partition_filters_accepts_filtered_scans(self):
+        """Filters on the partition column, also in an outer query, suffice."""
+        sql = (
+            f"WITH base AS (SELECT * FROM {TRAIN_TABLE}) "
+            "SELECT * FROM base WHERE date >= '2016-01-01'"
+        )
+        _, findings = sql_rewriter.check_partition_filters(sql, TABLE_METADATA)
+        self.assertEqual(findings, [])
+
+    def test_check_partition_filters_injects_date_range(self):
+        """The last days up to the latest partition are scanned if requested."""
+        sql, findings = sql_rewriter.check_partition_filters(
+            f"SELECT country FROM {TRAIN_TABLE} AS t", TABLE_METADATA, inject_days=7
+        )
+        self.assertIn("'2016-12-31' AS DATE), INTERVAL '7' DAY)", sql)
+        self.assertIn(") AS `t`", sql)
+        self.assertIsNotNone(findings[0]["injected_filter"])
+
+    def test_check_partition_filters_keeps_outer_joins(self):
+        """The injected filter applies to the scan, not to the joined rows."""
+        sql, _ = sql_rewriter.check_partition_filters(
+            f"SELECT s.id, t.country FROM `my-project.other.stores` AS s "
+            f"LEFT JOIN {TRAIN_TABLE} AS t ON s.id = t.id",
+            TABLE_METADATA,
+            inject_days=7,
+        )
+        self.assertIn("LEFT JOIN (", sql)
+        self.assertIn("WHERE", sql)
+        self.assertNotIn("WHERE", sql.split(") AS `t`")[1])
+
+    def test_check_partition_filters_needs_the_latest_partition(self):
+        """Without a known latest partition, the scan is only reported."""
+        sql = f"SELECT country FROM {TRAIN_TABLE}"
+        metadata = {
+            name: {**metadata, "latest_partition": None}
+            for name, metadata in TABLE_METADATA.items()
+        }
+        rewritten_sql, findings = sql_rewriter.check_partition_filters(
+            sql, metadata, inject_days=7
+        )
+        self.assertEqual(rewritten_sql, sql)
+        self.assertIsNone(findings[0]["injected_filter"])
+
+    def test_canonicalized_pseudo_column_filters_are_kept(self):
+        """Partition pseudo-columns stay unquoted, so their filters still count."""
+        metadata = {
+            "my-project.logs.events": {
+                **TABLE_METADATA["my-project.forecasting_sticker_sales.train"],
+                "partition_column": "_PARTITIONTIME",
+                "partition_column_type": "TIMESTAMP",
+            }
+        }
+        sql = sql_rewriter.canonicalize_sql(
+            "SELECT e.id FROM `my-project.logs.events` AS e "
+            "WHERE e._PARTITIONTIME >= TIMESTAMP '2016-12-01'"
+        )
+        self.assertIn("`t0`._PARTITIONTIME >=", sql)
+        rewritten_sql, findings = sql_rewriter.check_partition_filters(
+            sql, metadata, inject_days=7
+        )
+        self.assertEqual(rewritten_sql, sql)
+        self.assertEqual(findings, [])
+
+    def test_approximate_sql_rewrites_exact_aggregates(self):
+        """Exact distinct counts and medians become approximate aggregates."""
+        sql, approximations, _ = sql_rewriter.approximate_sql(
+            "SELECT DISTINCT country, COUNT(DISTINCT store) OVER () AS stores, "
+            "PERCENTILE_CONT(num_sold, 0.5) OVER (PARTITION BY country) AS median "
+            f"FROM {TRAIN_TABLE}",
+            10,
+        )
+        self.assertEqual(approximations, [])
+        sql, approximations, _ = sql_rewriter.approximate_sql(
+            "SELECT DISTINCT country, "
+            "PERCENTILE_CONT(num_sold, 0.5) OVER (PARTITION BY country) AS median "
+            f"FROM {TRAIN_TABLE}",
+            10,
+        )
+        self.assertIn("APPROX_QUANTILES(num_sold, 100)[OFFSET(50)]", sql)
+        self.assertIn("GROUP BY", sql)
+        self.assertEqual(len(approximations), 1)
+        sql, _, _ = sql_rewriter.approximate_sql(
+            f"SELECT COUNT(DISTINCT store) FROM {TRAIN_TABLE}", 10
+        )
+        self.assertIn("APPROX_COUNT_DISTINCT(store)", sql)
+        self.assertNotIn("TABLESAMPLE", sql)
+
+    def test_approximate_sql_samples_previews(self):
+        """Queries that only preview rows read a sample of the table."""
+        sql, approximations, warnings = sql_rewriter.approximate_sql(
+            f"SELECT * FROM {TRAIN_TABLE} LIMIT 10", 5
+        )
+        self.assertIn("TABLESAMPLE SYSTEM (5 PERCENT)", sql)
+        self.assertEqual(len(approximations), 1)
+        self.assertEqual(warnings, [])
+
+    def test_approximate_sql_does_not_sample_joins(self):
+        """Previews of joins read the full tables, with a warning."""
+        sql = (
+            f"SELECT * FROM {TRAIN_TABLE} AS a "
+            f"JOIN {TRAIN_TABLE} AS b USING (id) LIMIT 10"
+        )
+        rewritten_sql, approximations, warnings = sql_rewriter.approximate_sql(
+            sql, 5
+        )
+        self.assertEqual(rewritten_sql, sql)
+        self.assertEqual(approximations, [])
+        self.assertEqual(len(warnings), 2)
+
+    def test_approximate_sql_does_not_sample_aggregated_previews(self):
+        """Previews read by aggregates or top-N queries are not sampled."""
+        for sql in (
+            f"WITH c AS (SELECT store, num_sold FROM {TRAIN_TABLE}) "
+            "SELECT SUM(num_sold) FROM c",
+            f"SELECT COUNT(*) FROM (SELECT * FROM {TRAIN_TABLE})",
+            f"SELECT * FROM {TRAIN_TABLE} WHERE country = 'Canada' "
+            "ORDER BY num_sold DESC LIMIT 10",
+        ):
+            with self.subTest(sql=sql):
+                self.assertEqual(sql_rewriter.approximate_sql(sql, 5), (sql, [], []))
+        sql, approximations, _ = sql_rewriter.approximate_sql(
+            f"WITH c AS (SELECT store, num_sold FROM {TRAIN_TABLE}) "
+            "SELECT * FROM c LIMIT 10",
+            5,
+        )
+        self.assertIn("TABLESAMPLE SYSTEM (5 PERCENT)", sql)
+        self.assertEqual(len(approximations), 1)
+
+    def test_aggregation_shape_fingerprints_rollups(self):
+        """Rollups are fingerprinted by table, dimensions and aggregates."""
+        shape = sql_rewriter.aggregation_shape(
+            "SELECT country, SUM(num_sold) AS total, AVG(num_sold) AS average "
+            f"FROM {TRAIN_TABLE} WHERE date >= '2016-01-01' GROUP BY 1"
+        )
+        self.assertEqual(
+            shape,
+            {
+                "table": "my-project.forecasting_sticker_sales.train",
+                "dimensions": ["country"],
+                "filter_columns": ["date"],
+                "aggregates": ["AVG(num_sold)", "SUM(num_sold)"],
+            },
+        )
+        self.assertIsNone(
+            sql_rewriter.aggregation_shape(
+                f"SELECT country, COUNT(DISTINCT store) FROM {TRAIN_TABLE} "
+                "GROUP BY country"
+            )
+        )
+
+    def test_route_to_aggregate_table_reaggregates_measures(self):
+        """Rollups answerable by an aggregate table are routed to it."""
+        aggregate_table = {
+            "name": "my-project.forecasting_sticker_sales.mv_train_by_country_date",
+            "table": "my-project.forecasting_sticker_sales.train",
+            "dimensions": ["country", "date"],
+            "measures": sql_rewriter.required_measures(["AVG(num_sold)"]),
+        }
+        sql, name = sql_rewriter.route_to_aggregate_table(
+            f"SELECT country, AVG(num_sold) AS average FROM {TRAIN_TABLE} "
+            "GROUP BY country",
+            [aggregate_table],
+        )
+        self.assertEqual(name, aggregate_table["name"])
+        self.assertIn("SAFE_DIVIDE(SUM(`sum_num_sold`), SUM(`count_num_sold`))", sql)
+        totals_table = {
+            "name": "my-project.forecasting_sticker_sales.rollup_train_totals",
+            "table": "my-project.forecasting_sticker_sales.train",
+            "dimensions": ["country", "store", "product"],
+            "measures": sql_rewriter.required_measures(["AVG(num_sold)"]),
+            "num_rows": 90,
+        }
+        _, name = sql_rewriter.route_to_aggregate_table(
+            f"SELECT country, COUNT(*) FROM {TRAIN_TABLE} GROUP BY country",
+            [{**aggregate_table, "num_rows": 15000}, totals_table],
+        )
+        self.assertEqual(name, totals_table["name"])
+        unrouted_sql = f"SELECT store, SUM(num_sold) FROM {TRAIN_TABLE} GROUP BY store"
+        self.assertEqual(
+            sql_rewriter.route_to_aggregate_table(unrouted_sql, [aggregate_table]),
+            (unrouted_sql, None),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
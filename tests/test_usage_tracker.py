@@ -0,0 +1,97 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for the token and cost accounting of the LLM calls."""
+
+import os
+import sys
+import types
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from data_science.utils import usage_tracker
+
+
+def usage(prompt_tokens, cached_tokens, output_tokens):
+    """Returns the usage metadata of a response."""
+    return types.SimpleNamespace(
+        prompt_token_count=prompt_tokens,
+        cached_content_token_count=cached_tokens,
+        candidates_token_count=output_tokens,
+        thoughts_token_count=None,
+    )
+
+
+class TestUsageTracker(unittest.TestCase):
+    """Test cases for the token and cost accounting of the LLM calls."""
+
+    def test_estimate_cost_discounts_cached_tokens(self):
+        """Cached prompt tokens are billed at the cached input price."""
+        self.assertAlmostEqual(
+            usage_tracker.estimate_cost("gemini-2.5-flash-001", 1_000_000, 0, 0),
+            0.3,
+        )
+        self.assertAlmostEqual(
+            usage_tracker.estimate_cost(
+                "gemini-2.5-flash", 1_000_000, 1_000_000, 1_000_000
+            ),
+            0.075 + 2.5,
+        )
+        self.assertEqual(usage_tracker.estimate_cost("unknown", 1000, 0, 1000), 0.0)
+
+    def test_record_aggregates_per_scope(self):
+        """Calls are aggregated per model, tool, agent and session."""
+        tracker = usage_tracker.UsageTracker(log_interval_seconds=3600)
+        with usage_tracker.scope(tool="initial_bq_nl2sql", session="s1"):
+            with usage_tracker.scope(agent="database_agent"):
+                tracker.record("gemini-2.5-flash", usage(1000, 800, 50), 1.5)
+            tracker.record("gemini-2.5-pro", usage(100, 0, 10), 0.5)
+        tracker.record("gemini-2.5-pro", None)
+        summary = tracker.summary()
+        self.assertEqual(summary["total"]["calls"], 2)
+        self.assertEqual(summary["total"]["cached_tokens"], 800)
+        self.assertEqual(summary["by_tool"]["initial_bq_nl2sql"]["calls"], 2)
+        self.assertEqual(summary["by_agent"]["database_agent"]["prompt_tokens"], 1000)
+        self.assertEqual(summary["by_session"]["s1"]["output_tokens"], 60)
+        self.assertEqual(summary["by_model"]["gemini-2.5-pro"]["latency_seconds"], 0.5)
+
+    def test_model_callbacks_record_agent_turns(self):
+        """The turns of the ADK agents are recorded by the model callbacks."""
+        tracker = usage_tracker.UsageTracker(log_interval_seconds=3600)
+        callback_context = types.SimpleNamespace(
+            invocation_id="i1",
+            agent_name="db_ds_multiagent",
+            _invocation_context=types.SimpleNamespace(
+                session=types.SimpleNamespace(id="s1"),
+                agent=types.SimpleNamespace(model="gemini-2.5-flash"),
+            ),
+        )
+        llm_response = types.SimpleNamespace(
+            partial=False, usage_metadata=usage(2000, 0, 100)
+        )
+        with mock.patch.object(usage_tracker, "usage_tracker", tracker):
+            usage_tracker.before_model_callback(callback_context, None)
+            self.assertIsNone(
+                usage_tracker.after_model_callback(callback_context, llm_response)
+            )
+        summary = tracker.summary()
+        self.assertEqual(summary["by_agent"]["db_ds_multiagent"]["prompt_tokens"], 2000)
+        self.assertEqual(summary["by_session"]["s1"]["calls"], 1)
+        self.assertEqual(summary["by_tool"], {})
+
+
+if __name__ == "__main__":
+    unittest.main()